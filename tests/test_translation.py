@@ -0,0 +1,202 @@
+import os
+import re
+import threading
+
+import docx
+import pytest
+
+import 文档翻译_纯净版 as translation
+
+
+class _Response:
+    status_code = 200
+    
+    def __init__(self, content):
+        self.content = content
+    
+    def json(self):
+        return {"choices": [{"message": {"content": self.content}}], "usage": {}}
+
+
+class FakeTranslationManager(translation.TranslationManager):
+    """Offline API: answers with the upper-cased text and counts the requests per text"""
+    def __init__(self):
+        super().__init__(rate_limiter=translation.RateLimiter(0))
+        self.interactive = False
+        self.calls = []
+        self.calls_lock = threading.Lock()
+    
+    def send_request(self, headers, data):
+        text = data["messages"][-1]["content"][-1]["text"].split("Text to translate:\n", 1)[-1]
+        with self.calls_lock:
+            self.calls.append(text)
+        return _Response(text.upper())
+
+
+def test_segment_workers_translate_each_unique_segment_once(tmp_path):
+    path = str(tmp_path / "many.docx")
+    words = ["camera", "motion", "privacy", "storage", "cloud", "night", "vision", "alerts", "battery", "scene"]
+    doc = docx.Document()
+    for i in range(1000):
+        # Numbers are masked, so segments must differ in their words to be unique
+        doc.add_paragraph(f"The {words[i % 10]} {words[i // 10 % 10]} {words[i // 100 % 10]} feature "
+                          f"supports local recording and {words[(i * 7) % 10]} automation")
+    doc.save(path)
+    
+    manager = FakeTranslationManager()
+    processor = translation.DocumentProcessor(manager)
+    processor.segment_workers = 8
+    plan = processor.build_plan(docx.Document(path), path, include_notes=False, include_headers=False)
+    processor.translate_plan(plan, "German", "DE")
+    
+    assert plan.unique_count == 1000
+    assert manager.metrics.counters['segment_errors'] == 0
+    assert len(manager.calls) == plan.unique_count
+    assert len(set(manager.calls)) == plan.unique_count
+
+
+def _document_translator(manager):
+    translator = translation.DocumentTranslator()
+    translator.translator = manager
+    translator.processor.translator = manager
+    translator.workbook_processor.translator = manager
+    return translator
+
+
+def test_carry_over_lines_up_around_inline_images(tmp_path, monkeypatch):
+    from 文档翻译_基准测试 import make_png
+    monkeypatch.setattr(translation, 'LANGUAGES', {"German": "DE"})
+    image = tmp_path / "image.png"
+    image.write_bytes(make_png())
+    words = ["one", "two", "three", "four", "five", "six", "seven", "eight"]
+    v1 = [f"Paragraph {word} describes the camera" for word in words]
+    v2 = list(v1)
+    v2[6] = "A rewritten paragraph about the doorbell"
+    for name, texts in (("v1", v1), ("v2", v2)):
+        doc = docx.Document()
+        for i, text in enumerate(texts):
+            paragraph = doc.add_paragraph(text)
+            if i == 1:
+                paragraph.add_run().add_picture(str(image))  # Inline image: moved to its own paragraph on output
+        doc.save(str(tmp_path / f"{name}.docx"))
+    
+    _document_translator(FakeTranslationManager()).translate_document(str(tmp_path / "v1.docx"),
+                                                                      str(tmp_path / "out1"))
+    manager = FakeTranslationManager()
+    _document_translator(manager).translate_document(str(tmp_path / "v2.docx"), str(tmp_path / "out2"),
+                                                     previous_source=str(tmp_path / "v1.docx"),
+                                                     previous_output_dir=str(tmp_path / "out1"))
+    
+    output = [para.text for para in docx.Document(str(tmp_path / "out2" / "v2_DE.docx")).paragraphs if para.text]
+    assert output == [text.upper() for text in v2]
+    assert manager.calls == [v2[6]]
+
+
+def test_mask_translation_matches_whole_values_only():
+    masker = translation.PlaceholderMasker()
+    masked, values = masker.mask("Released in 2021 with 10 modes and 1 hub")
+    assert values == ["2021", "10", "1"]
+    literal = "2021 veröffentlicht, mit 10 Modi und 1 Hub"
+    masked_translation = masker.mask_translation(literal, values)
+    assert masked_translation == "⟦0⟧ veröffentlicht, mit ⟦1⟧ Modi und ⟦2⟧ Hub"
+    assert masker.unmask(masked_translation, values) == literal
+    # A later "0" must not land inside the placeholder inserted for the earlier value
+    assert masker.mask_translation("0 von 5", ["5", "0"]) == "⟦1⟧ von ⟦0⟧"
+    assert masker.mask_translation("Version 10 kostet 5.", ["1"]) is None
+    assert masker.mask_translation("Kostet 5.", ["5"]) == "Kostet ⟦0⟧."
+
+
+# Cleanup that translate_text applied before ResponseSanitizer: the line filter, then each pattern once in order
+LEGACY_INDICATORS = ["I'm sorry", "I apologize", "Here is the translation", "Translated text", "Please note",
+                     "I cannot", "I would", "Dear Valued Customer", "Best regards", "The Customer Service Team"]
+LEGACY_EXPLANATION_PATTERNS = [
+    r'^(I\'m sorry|I apologize|Sorry|Note|Please note).*?\n\n',
+    r'\n\n(I\'m sorry|I apologize|Sorry|Note|Please note).*?$',
+    r'^(Here is|Here\'s|The following is|This is) the translation.*?\n\n',
+    r'^Translated text:.*?\n\n'
+]
+SANITIZER_SAMPLES = [
+    "Hola mundo",
+    "Note: x\n\nHere's the translation:\n\nHola mundo",
+    "Here is the translation:\n\nBonjour\n\nNote: kept literal",
+    "Translated text: below\n\nHallo Welt",
+    "Sorry for the delay\n\nThe following is the translation:\n\nCiao",
+    "Primera línea\n\nSegunda línea",
+    "I apologize, here it is\n\nTranslated text:\n\nOlá",
+    # After one stripped note, a translation that itself starts with "Note" stays
+    "Sorry for the wait\n\nNote: Kabel trocken halten\n\nNur das mitgelieferte Ladegerät verwenden",
+]
+
+
+def legacy_clean(translated_text, original_text):
+    if any(phrase.lower() in translated_text.lower() for phrase in LEGACY_INDICATORS):
+        translated_text = '\n'.join(line for line in translated_text.split('\n')
+                                    if not any(phrase.lower() in line.lower() for phrase in LEGACY_INDICATORS))
+    if not translated_text.strip() and original_text.strip():
+        return original_text
+    for pattern in LEGACY_EXPLANATION_PATTERNS:
+        translated_text = re.sub(pattern, '', translated_text, flags=re.IGNORECASE | re.DOTALL)
+    return translated_text
+
+
+def test_sanitizer_matches_legacy_cleanup():
+    sanitizer = translation.ResponseSanitizer()
+    metrics = translation.TranslationMetrics()
+    for sample in SANITIZER_SAMPLES:
+        assert sanitizer.sanitize(sample, "source text", metrics) == legacy_clean(sample, "source text")
+    # Time is charged to each rule, not to a whole pass
+    assert set(metrics.rule_seconds) == set(sanitizer.drop_line_rules) | set(sanitizer.strip_rules)
+
+
+class ThrottledTranslationManager(FakeTranslationManager):
+    """Answers the first requests with an HTTP error status, then like FakeTranslationManager"""
+    def __init__(self, failures, status=429):
+        super().__init__()
+        self.failures = failures
+        self.status = status
+    
+    def send_request(self, headers, data):
+        if self.failures:
+            self.failures -= 1
+            self.calls.append(None)
+            response = _Response("")
+            response.status_code = self.status
+            return response
+        text = data["messages"][-1]["content"][-1]["text"].split("Text to translate:\n", 1)[-1]
+        self.calls.append(text)
+        parts = self.BATCH_MARKER.split(text)
+        answer = "\n".join(f"[[{number}]] {piece.strip().upper()}" for number, piece in zip(parts[1::2], parts[2::2]))
+        return _Response(answer)
+
+
+def test_batch_request_backs_off_instead_of_splitting(monkeypatch):
+    monkeypatch.setattr(translation.time, 'sleep', lambda seconds: None)
+    texts = ["First footnote about the camera", "Second footnote about the hub", "Third footnote text"]
+    
+    manager = ThrottledTranslationManager(failures=1)
+    assert manager.translate_batch(texts, "German", "DE", is_footnote=True) == 3
+    assert len(manager.calls) == 2  # The 429, then the retried batch
+    assert manager.metrics.counters['rate_limited'] == 1
+    
+    # Still failing after every retry: no one-by-one fallback
+    manager = ThrottledTranslationManager(failures=10, status=502)
+    assert manager.translate_batch(texts, "German", "DE", is_footnote=True) == 0
+    assert manager.calls == [None, None, None]
+
+
+def test_daemon_rejects_output_inside_drop_folder(tmp_path):
+    with pytest.raises(ValueError):
+        translation.TranslationDaemon(str(tmp_path / "drop" / "out"), drop_folder=str(tmp_path / "drop"))
+
+
+def test_same_named_documents_get_their_own_journal(tmp_path):
+    translator = translation.DocumentTranslator()
+    paths = []
+    for folder in ("a", "b"):
+        (tmp_path / folder).mkdir()
+        input_file = tmp_path / folder / "report.docx"
+        docx.Document().save(str(input_file))
+        translator.run_journaled(str(input_file), str(tmp_path / "out"), False, {"German": "DE"},
+                                 lambda: paths.append(translator.translator.journal.path) or [])
+    assert paths[0] != paths[1]
+    assert all(os.path.basename(path).startswith("report.") for path in paths)
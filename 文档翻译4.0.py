@@ -1,4 +1,6 @@
+import copy
 import os
+import posixpath
 import docx
 import requests
 import re
@@ -8,6 +10,9 @@ from oauth2client.service_account import ServiceAccountCredentials
 import zipfile
 import tempfile
 import shutil
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
 from tqdm import tqdm
 import time
@@ -22,10 +27,56 @@ LANGUAGES = {
     "Chinese": "ZH",
 }
 
+# WordprocessingML namespace
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+class PlaceholderMasker:
+    """Swap numbers, units, URLs, citations and inline code for indexed placeholders around translation"""
+    PATTERN = re.compile(r"""
+        (?P<citation>\((?:[A-Z][\w'\-]+(?:\ (?:et\ al\.|and|&)(?:\ [A-Z][\w'\-]+)?)*,\ \d{4}[a-z]?(?:;\ *)?)+\)
+                   |\[\d+(?:\s*[,–-]\s*\d+)*\])
+      | (?P<url>\b(?:https?://|www\.)[^\s<>"]*[^\s<>".,;:!?)])
+      | (?P<email>\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b)
+      | (?P<code>`[^`\n]+`)
+      | (?P<number>(?<![\w.])[-+]?\d+(?:[.,:/]\d+)*
+                   (?:\s?(?:mm|cm|km|kg|mg|mAh|Ah|kWh|kW|W|V|mA|GHz|MHz|kHz|Hz|dB|fps|Mbps|TB|GB|MB|KB|°C|°F|ms|px)
+                   (?![A-Za-z])|%)?(?![\w]))
+    """, re.VERBOSE)
+    PLACEHOLDER = re.compile(r'⟦(\d+)⟧')
+    
+    @staticmethod
+    def placeholder(index):
+        return f'⟦{index}⟧'
+    
+    def mask(self, text):
+        """Return (masked text, original values in placeholder order)"""
+        values = []
+        def replace(match):
+            values.append(match.group(0))
+            return self.placeholder(len(values) - 1)
+        return self.PATTERN.sub(replace, text), values
+    
+    def unmask(self, text, values):
+        """Restore placeholders; None unless every placeholder survived exactly once"""
+        found = [int(index) for index in self.PLACEHOLDER.findall(text)]
+        if sorted(found) != list(range(len(values))):
+            return None
+        return self.PLACEHOLDER.sub(lambda match: values[int(match.group(1))], text)
+    
+    def mask_translation(self, translation, values):
+        """Put placeholders back into a literal translation; None if a value is not found in it"""
+        for index, value in enumerate(values):
+            if value not in translation:
+                return None
+            translation = translation.replace(value, self.placeholder(index), 1)
+        return translation
+
 class TranslationManager:
     def __init__(self):
         self.translation_memory = {}
         self.terminology_db = {}
+        self.masker = PlaceholderMasker()  # Numbers, URLs, citations and code travel as placeholders
+        self.document_glossary = {}  # language code -> glossary lines of the current document (prompt prefix)
     
     def load_terminology(self, sheet_url, source_lang_col, target_lang_col, language_code):
         """Load terminology from Google Sheets"""
@@ -131,45 +182,67 @@ class TranslationManager:
             
         return translated_text
     
-    def translate_text(self, text, target_language, language_code, context=None):
+    def set_document_glossary(self, texts, language_code):
+        """Collect the glossary entries used anywhere in a document, for the cacheable system prefix"""
+        terms = self.terminology_db.get(language_code, {})
+        used = set()
+        for text in texts:
+            for term in terms:
+                if term not in used and re.search(r'\b' + re.escape(term) + r'\b', text, re.IGNORECASE):
+                    used.add(term)
+        # Sorted so the prefix is byte-identical for every request of the document
+        self.document_glossary[language_code] = [f"{term} -> {terms[term]}" for term in sorted(used)]
+    
+    def translate_text(self, text, target_language, language_code, context=None, mask=True):
         """Translate text using API with context and terminology support"""
         if not text.strip():
             return ""
         
+        # Mask numbers, URLs and citations; memory holds masked translations
+        masked_text, mask_values = self.masker.mask(text) if mask else (text, [])
 
         # Check translation memory
-        memory_key = text.strip().lower()
+        memory_key = masked_text.strip().lower()
         if memory_key in self.translation_memory:
-            return self.translation_memory[memory_key]
+            remembered = self.masker.unmask(self.translation_memory[memory_key], mask_values)
+            if remembered is not None:
+                return remembered
         
-        # Extract terminology for context
+        # Extract terminology for context; terms of the document glossary are already in the system prefix
+        document_terms = self.document_glossary.get(language_code, [])
         potential_terms = []
         if language_code in self.terminology_db:
             for term in self.terminology_db[language_code].keys():
                 if re.search(r'\b' + re.escape(term) + r'\b', text, re.IGNORECASE):
                     target_term = self.terminology_db[language_code][term]
                     potential_terms.append(f"{term} -> {target_term}")
+        potential_terms = [entry for entry in potential_terms if entry not in document_terms]
         
         try:
             # Skip simple symbols/short text
             if len(text.strip()) < 5 and not re.search(r'[a-zA-Z]', text):
                 return text
             
-            # Build prompt
+            # Build prompt: static instructions first (cacheable prefix), per-segment parts last
             sys_prompt = 'You are a translation engine only. Translate the text to the target language maintaining all formatting. Return ONLY the translated text with no explanations, and no comments. Never apologize or explain your translation.'
 
-            user_prompt = f'Translate the following text to {target_language}. Return ONLY the translated content. Keep all symbols, punctuation, and formatting exactly as they appear. Do not add any explanations, or comments before or after the translation.'
-            user_prompt += "\n\nIMPORTANT: If the text contains only symbols, formatting characters, or no text at all (like '----', '***', etc.), do not translate or explain anything - just return those exact symbols."
-            user_prompt += "这个是文献翻译，请使中文符合正常的翻译规范，符合文献表达的要求，其中文献的引用要求保留原文不需要翻译，例如 (Li et al., 2022; Shang et al., 2022; Shen et al., 2022)、(Mou, 2020)等。"
+            sys_prompt += f'\n\nTranslate the following text to {target_language}. Return ONLY the translated content. Keep all symbols, punctuation, and formatting exactly as they appear. Do not add any explanations, or comments before or after the translation.'
+            sys_prompt += "\n\nIMPORTANT: If the text contains only symbols, formatting characters, or no text at all (like '----', '***', etc.), do not translate or explain anything - just return those exact symbols."
+            sys_prompt += "\n\nIMPORTANT: Keep every placeholder such as ⟦0⟧ exactly as it is, each one exactly once."
+            sys_prompt += "这个是文献翻译，请使中文符合正常的翻译规范，符合文献表达的要求，其中文献的引用要求保留原文不需要翻译，例如 (Li et al., 2022; Shang et al., 2022; Shen et al., 2022)、(Mou, 2020)等。"
+            # Per-document glossary after the static part: still the same for every request of the document
+            if document_terms:
+                sys_prompt += f"\n\nIMPORTANT: Use the following terminology consistently:\n" + "\n".join(document_terms)
 
+            user_prompt = ""
             if potential_terms:
-                user_prompt += f"\n\nIMPORTANT: Use the following terminology consistently:\n" + "\n".join(
-                    potential_terms)
+                user_prompt += f"IMPORTANT: Also use this terminology:\n" + "\n".join(
+                    potential_terms) + "\n\n"
 
             if context:
-                user_prompt += f"\n\nFor consistency, here are some previous translations:\n{context}\n\n"
+                user_prompt += f"For consistency, here are some previous translations:\n{context}\n\n"
 
-            user_prompt += f"\nText to translate:\n{text}"
+            user_prompt += f"Text to translate:\n{masked_text}"
 
             # Request data
             data = {
@@ -180,7 +253,7 @@ class TranslationManager:
                         "content": [{"type": "text", "text": user_prompt}],
                     }
                 ],
-                "system": sys_prompt
+                "system": [{"type": "text", "text": sys_prompt, "cache_control": {"type": "ephemeral"}}]
             }
             
             headers = {
@@ -210,10 +283,21 @@ class TranslationManager:
                 # Apply terminology
                 translated_text = self.apply_terminology(translated_text, language_code)
                 
-                # Store in memory
-                self.translation_memory[memory_key] = translated_text
+                # Restore placeholders; if the model dropped or duplicated one, ask again without masking
+                restored = self.masker.unmask(translated_text, mask_values)
+                if restored is None:
+                    print("Placeholders were not preserved, retrying without masking")
+                    return self.translate_text(text, target_language, language_code, context, mask=False)
+                
+                # Store in memory (masked, so other numbers/URLs share the entry)
+                if not mask:
+                    masked_text, mask_values = self.masker.mask(text)
+                    memory_key = masked_text.strip().lower()
+                    translated_text = self.masker.mask_translation(restored, mask_values)
+                if translated_text is not None:
+                    self.translation_memory[memory_key] = translated_text
                 
-                return translated_text
+                return restored
             else:
                 print(f"Translation error: HTTP {response.status_code} - {response.text}")
                 return text
@@ -222,9 +306,108 @@ class TranslationManager:
             print(f"Translation error: {e}")
             return text
 
+class PackageWriter:
+    """Zip writer for .docx packages: raw passthrough of unchanged members, parallel deflate of modified ones"""
+    # Media that is already compressed gains nothing from deflate
+    STORED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'wdp', 'mp3', 'mp4', 'm4a', 'mov', 'zip', 'gz'}
+    
+    def __init__(self, output_path, compresslevel=6, max_workers=None):
+        self.output_path = output_path
+        self.compresslevel = compresslevel
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1)
+        self.entries = []
+    
+    def copy_raw(self, source_zip, info):
+        """Queue a member whose compressed bytes are copied unchanged from source_zip"""
+        self.entries.append({
+            'name': info.filename, 'method': info.compress_type, 'date_time': info.date_time,
+            'external_attr': info.external_attr, 'crc': info.CRC,
+            'compress_size': info.compress_size, 'file_size': info.file_size,
+            'source': (source_zip, info),
+        })
+    
+    def add(self, name, data, date_time=None, external_attr=None):
+        """Queue a modified member; deflate runs in the background (zlib releases the GIL)"""
+        extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+        method = zipfile.ZIP_STORED if extension in self.STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        self.entries.append({
+            'name': name, 'method': method, 'date_time': date_time or time.localtime()[:6],
+            'external_attr': (0o600 << 16) if external_attr is None else external_attr,
+            'future': self.executor.submit(self._compress, data, method),
+        })
+    
+    def _compress(self, data, method):
+        """Return (crc, compressed bytes, uncompressed size) for a member"""
+        if method == zipfile.ZIP_STORED:
+            return zlib.crc32(data), data, len(data)
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        return zlib.crc32(data), compressor.compress(data) + compressor.flush(), len(data)
+    
+    def _copy_raw_bytes(self, source_zip, info, out):
+        """Copy the compressed payload of a member straight from the source archive"""
+        fp = source_zip.fp
+        fp.seek(info.header_offset)
+        header = fp.read(30)
+        if header[:4] != b'PK\x03\x04':
+            raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        fp.seek(info.header_offset + 30 + name_length + extra_length)
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = fp.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated data for {info.filename}")
+            out.write(chunk)
+            remaining -= len(chunk)
+    
+    def close(self):
+        """Write all queued members and the central directory"""
+        try:
+            central_directory = []
+            with open(self.output_path, 'wb') as out:
+                for entry in self.entries:
+                    if 'future' in entry:
+                        entry['crc'], payload, entry['file_size'] = entry['future'].result()
+                        entry['compress_size'] = len(payload)
+                    
+                    offset = out.tell()
+                    if max(offset, entry['compress_size'], entry['file_size']) > 0xFFFFFFFF or len(self.entries) > 0xFFFF:
+                        raise zipfile.LargeZipFile("Package requires ZIP64")
+                    
+                    name = entry['name'].encode('utf-8')
+                    flags = 0x800 if not entry['name'].isascii() else 0
+                    year, month, day, hour, minute, second = entry['date_time']
+                    dos_date = (max(year, 1980) - 1980) << 9 | month << 5 | day
+                    dos_time = hour << 11 | minute << 5 | second // 2
+                    fields = (20, flags, entry['method'], dos_time, dos_date,
+                              entry['crc'], entry['compress_size'], entry['file_size'], len(name))
+                    
+                    out.write(struct.pack('<4s5H3L2H', b'PK\x03\x04', *fields, 0))
+                    out.write(name)
+                    if 'future' in entry:
+                        out.write(payload)
+                    else:
+                        self._copy_raw_bytes(*entry['source'], out)
+                    
+                    central_directory.append(struct.pack('<4sH5H3L5H2L', b'PK\x01\x02', 20, *fields,
+                                                         0, 0, 0, 0, entry['external_attr'], offset) + name)
+                
+                directory_offset = out.tell()
+                for record in central_directory:
+                    out.write(record)
+                directory_size = out.tell() - directory_offset
+                out.write(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, len(central_directory),
+                                      len(central_directory), directory_size, directory_offset, 0))
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
 class DocumentProcessor:
     def __init__(self, translator):
         self.translator = translator
+        self.clone_run_xml = True  # Copy raw w:rPr instead of python-docx property round-trips
+        self.coalesce_adjacent_runs = True  # Merge identically formatted runs before translation
+        self.run_stats = {'before': 0, 'after': 0}
+        self._feature_cache = {}  # Feature index per (path, mtime, size)
     
     def capture_run_properties(self, run):
         """
@@ -335,18 +518,91 @@ class DocumentProcessor:
         
         return run
 
+    def capture_run_rpr(self, run):
+        """
+        Capture the raw w:rPr element of a run (fast path, keeps every property)
+        """
+        return run._r.rPr
+    
+    def apply_run_rpr(self, run, rpr):
+        """
+        Deep-copy a captured w:rPr element onto a rebuilt run
+        """
+        run._r._remove_rPr()
+        if rpr is not None:
+            run._r.insert(0, copy.deepcopy(rpr))
+        return run
+    
+    def capture_run_formatting(self, run):
+        """Capture run formatting using the configured strategy"""
+        if self.clone_run_xml:
+            return self.capture_run_rpr(run)
+        return self.capture_run_properties(run)
+    
+    def apply_run_formatting(self, run, formatting):
+        """Apply run formatting captured by capture_run_formatting"""
+        if self.clone_run_xml:
+            return self.apply_run_rpr(run, formatting)
+        return self.apply_run_properties(run, formatting)
+    
+    def _run_merge_key(self, run):
+        """Return the formatting key of a text-only run, or None if the run must not be merged"""
+        w = f'{{{W_NS}}}'
+        rpr = None
+        for child in run:
+            if child.tag == w + 'rPr':
+                rpr = child
+            elif child.tag != w + 't':
+                return None
+        return etree.tostring(rpr) if rpr is not None else b''
+    
+    def coalesce_runs(self, p_element):
+        """Merge adjacent text-only runs with identical w:rPr in a w:p element"""
+        w = f'{{{W_NS}}}'
+        
+        # Spell-check markers split otherwise identical runs and carry no content
+        for proof_err in p_element.findall(w + 'proofErr'):
+            p_element.remove(proof_err)
+        
+        runs = p_element.findall(w + 'r')
+        self.run_stats['before'] += len(runs)
+        
+        previous, previous_key = None, None
+        for run in runs:
+            key = self._run_merge_key(run)
+            if key is not None and key == previous_key and run.getprevious() is previous:
+                texts = previous.findall(w + 't') + run.findall(w + 't')
+                merged_text = ''.join(t.text or '' for t in texts)
+                if texts:
+                    target = texts[0]
+                    if target.getparent() is not previous:
+                        previous.append(target)
+                    target.text = merged_text
+                    target.set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+                    for extra in previous.findall(w + 't')[1:]:
+                        previous.remove(extra)
+                p_element.remove(run)
+                continue
+            previous, previous_key = run, key
+        
+        self.run_stats['after'] += len(p_element.findall(w + 'r'))
+        return p_element
+    
     def process_paragraph(self, paragraph, target_language, language_code):
         """Process and translate paragraph with format preservation"""
         if not paragraph.text.strip():
             return paragraph
         
+        if self.coalesce_adjacent_runs:
+            self.coalesce_runs(paragraph._p)
+        
         # Store original formatting
         runs_formatting = []
         runs_text = []
         
         for run in paragraph.runs:
             runs_text.append(run.text)
-            runs_formatting.append(self.capture_run_properties(run))
+            runs_formatting.append(self.capture_run_formatting(run))
         
         if not runs_text:
             return paragraph
@@ -371,7 +627,7 @@ class DocumentProcessor:
             if original_total_len == 0:
                 run = paragraph.add_run(translated_text)
                 if runs_formatting:
-                    self.apply_run_properties(run, runs_formatting[0])
+                    self.apply_run_formatting(run, runs_formatting[0])
             else:
                 # Distribute translated text according to original proportions
                 run_proportions = [len(run_text) / original_total_len for run_text in runs_text]
@@ -386,7 +642,7 @@ class DocumentProcessor:
                     
                     if run_text:
                         new_run = paragraph.add_run(run_text)
-                        self.apply_run_properties(new_run, runs_formatting[i])
+                        self.apply_run_formatting(new_run, runs_formatting[i])
                     
                     start_pos = end_pos
         
@@ -395,8 +651,13 @@ class DocumentProcessor:
     def process_table(self, table, target_language, language_code):
         """Process and translate table content"""
         try:
+            # Merged cells return the same w:tc for every grid position they span
+            seen_cells = set()
             for row in table.rows:
                 for cell in row.cells:
+                    if cell._tc in seen_cells:
+                        continue
+                    seen_cells.add(cell._tc)
                     for para in cell.paragraphs:
                         try:
                             self.process_paragraph(para, target_language, language_code)
@@ -405,6 +666,75 @@ class DocumentProcessor:
         except Exception as e:
             print(f"Error processing table: {e}")
     
+    def scan_package(self, doc_path):
+        """Build a feature index of the package in one streaming pass, without extracting anything"""
+        stat = os.stat(doc_path)
+        cache_key = (os.path.abspath(doc_path), stat.st_mtime_ns, stat.st_size)
+        if cache_key in self._feature_cache:
+            return self._feature_cache[cache_key]
+        
+        w = f'{{{W_NS}}}'
+        counted_tags = {
+            w + 'tbl': 'tables',
+            w + 'txbxContent': 'text_boxes',
+            w + 'footnoteReference': 'footnote_refs',
+            w + 'endnoteReference': 'endnote_refs',
+            w + 'footnote': 'footnotes',
+            w + 'endnote': 'endnotes',
+            w + 'p': 'paragraphs',
+        }
+        features = {
+            'parts': {}, 'headers': [], 'footers': [],
+            'images': 0, 'image_bytes': 0, 'text_chars': 0,
+        }
+        features.update(dict.fromkeys(counted_tags.values(), 0))
+        
+        with zipfile.ZipFile(doc_path, 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                name = info.filename
+                if name.startswith('word/media/'):
+                    features['images'] += 1
+                    features['image_bytes'] += info.file_size
+                    continue
+                
+                match = re.match(r'^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$', name)
+                if not match:
+                    continue
+                if match.group(1).startswith('header'):
+                    features['headers'].append(name)
+                elif match.group(1).startswith('footer'):
+                    features['footers'].append(name)
+                
+                part = dict.fromkeys(counted_tags.values(), 0)
+                part['text_chars'] = 0
+                with zip_ref.open(info) as stream:
+                    for _, elem in etree.iterparse(stream, events=('end',), tag=list(counted_tags) + [w + 't']):
+                        if elem.tag == w + 't':
+                            part['text_chars'] += len(elem.text or '')
+                            continue
+                        # Separator and continuation notes are not real footnotes/endnotes
+                        if elem.tag in (w + 'footnote', w + 'endnote') and elem.get(w + 'type'):
+                            continue
+                        part[counted_tags[elem.tag]] += 1
+                        if elem.tag == w + 'p':
+                            elem.clear()
+                
+                features['parts'][name] = part
+                for key, count in part.items():
+                    features[key] += count
+        
+        self._feature_cache[cache_key] = features
+        return features
+    
+    def describe_features(self, features):
+        """One-line summary of a feature index"""
+        body = features['parts'].get('word/document.xml', {})
+        return (f"{body.get('tables', 0)} tables, {features['footnotes']} footnotes, "
+                f"{features['endnotes']} endnotes, {features['text_boxes']} text boxes, "
+                f"{len(features['headers'])} headers, {len(features['footers'])} footers, "
+                f"{features['images']} images, {features['text_chars']} characters "
+                f"(~{features['text_chars'] // 4} tokens)")
+    
     def has_tables(self, doc):
         """Check if document contains tables"""
         return len(doc.tables) > 0
@@ -412,23 +742,7 @@ class DocumentProcessor:
     def has_text_boxes(self, doc_path):
         """Check if document contains text boxes"""
         try:
-            with zipfile.ZipFile(doc_path, 'r') as zip_ref:
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    zip_ref.extractall(temp_dir)
-                    
-                    xml_paths = [
-                        os.path.join(temp_dir, 'word/document.xml'),
-                        os.path.join(temp_dir, 'word/header*.xml'),
-                        os.path.join(temp_dir, 'word/footer*.xml')
-                    ]
-                    
-                    for pattern in xml_paths:
-                        for xml_file in glob.glob(pattern) if '*' in pattern else [pattern]:
-                            if os.path.exists(xml_file):
-                                with open(xml_file, 'r', encoding='utf-8') as f:
-                                    if "<w:txbxContent" in f.read():
-                                        return True
-            return False
+            return self.scan_package(doc_path)['text_boxes'] > 0
         except Exception as e:
             print(f"Error checking for text boxes: {e}")
             return True  # Assume text boxes exist if check fails
@@ -443,40 +757,35 @@ class DocumentProcessor:
                 os.makedirs(original_dir, exist_ok=True)
                 os.makedirs(translated_dir, exist_ok=True)
                 
-                # Extract both documents
-                with zipfile.ZipFile(input_file, 'r') as zip_ref:
-                    zip_ref.extractall(original_dir)
-                
-                with zipfile.ZipFile(translated_file, 'r') as zip_ref:
-                    zip_ref.extractall(translated_dir)
-                
-                # Copy media folder
-                original_media_dir = os.path.join(original_dir, "word", "media")
-                translated_media_dir = os.path.join(translated_dir, "word", "media")
-                
-                if os.path.exists(original_media_dir):
-                    if os.path.exists(translated_media_dir):
-                        shutil.rmtree(translated_media_dir)
-                    
-                    shutil.copytree(original_media_dir, translated_media_dir)
-                    print(f"Copied media folder with {len(os.listdir(original_media_dir))} files")
-                
-                # Process relationships and content types
-                self._process_document_relationships(original_dir, translated_dir)
-                self._process_document_content_types(original_dir, translated_dir)
-                
-                # Process document structure to place images
-                self._process_document_structure(original_dir, translated_dir)
-                
-                # Repackage document
+                # Only these parts are edited; media is copied raw from the original package
+                xml_parts = ['word/_rels/document.xml.rels', '[Content_Types].xml', 'word/document.xml']
                 output_temp = translated_file + ".temp.docx"
                 
-                with zipfile.ZipFile(output_temp, 'w', zipfile.ZIP_DEFLATED) as zip_out:
-                    for root, _, files in os.walk(translated_dir):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, translated_dir)
-                            zip_out.write(file_path, arcname)
+                with zipfile.ZipFile(input_file, 'r') as original_zip, \
+                     zipfile.ZipFile(translated_file, 'r') as translated_zip:
+                    self._extract_parts(original_zip, xml_parts, original_dir)
+                    self._extract_parts(translated_zip, xml_parts, translated_dir)
+                    
+                    # Replace the media folder with the original one
+                    original_media = [name for name in original_zip.namelist() if name.startswith('word/media/')]
+                    raw_sources = {name: original_zip for name in original_media}
+                    modified_parts = {}
+                    if original_media:
+                        for name in translated_zip.namelist():
+                            if name.startswith('word/media/') and name not in raw_sources:
+                                modified_parts[name] = None
+                        print(f"Copied media folder with {len(original_media)} files")
+                    
+                    # Process relationships and content types
+                    self._process_document_relationships(original_dir, translated_dir)
+                    self._process_document_content_types(original_dir, translated_dir)
+                    
+                    # Process document structure to place images
+                    self._process_document_structure(original_dir, translated_dir)
+                    
+                    # Repackage document
+                    modified_parts.update(self._read_modified_parts(translated_zip, translated_dir, xml_parts))
+                    self._repackage(translated_zip, output_temp, modified_parts, raw_sources)
                 
                 # Replace original output
                 if os.path.exists(translated_file):
@@ -490,6 +799,70 @@ class DocumentProcessor:
             import traceback
             traceback.print_exc()
     
+    def _extract_parts(self, zip_ref, names, dest_dir):
+        """Extract only the named members (skips media and untouched parts)"""
+        existing = set(zip_ref.namelist())
+        for name in names:
+            if name in existing:
+                zip_ref.extract(name, dest_dir)
+    
+    def _read_modified_parts(self, source_zip, temp_dir, names):
+        """Return {name: bytes} for extracted parts whose content differs from the source package"""
+        modified = {}
+        existing = set(source_zip.namelist())
+        for name in names:
+            path = os.path.join(temp_dir, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            if name not in existing or source_zip.read(name) != data:
+                modified[name] = data
+        return modified
+    
+    def _repackage(self, source_zip, output_file, modified_parts, raw_sources=None):
+        """Write source_zip to output_file, replacing modified parts and copying the rest as raw bytes"""
+        raw_sources = raw_sources or {}
+        existing = set(source_zip.namelist())
+        try:
+            writer = PackageWriter(output_file)
+            for info in source_zip.infolist():
+                name = info.filename
+                if name in modified_parts:
+                    if modified_parts[name] is not None:
+                        writer.add(name, modified_parts[name], info.date_time, info.external_attr)
+                elif name in raw_sources:
+                    writer.copy_raw(raw_sources[name], raw_sources[name].getinfo(name))
+                else:
+                    writer.copy_raw(source_zip, info)
+            
+            for name, data in modified_parts.items():
+                if name not in existing and data is not None:
+                    writer.add(name, data)
+            for name, other_zip in raw_sources.items():
+                if name not in existing and name not in modified_parts:
+                    writer.copy_raw(other_zip, other_zip.getinfo(name))
+            
+            writer.close()
+        except zipfile.LargeZipFile:
+            # Fall back to zipfile (with ZIP64) for very large packages
+            with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zip_out:
+                for info in source_zip.infolist():
+                    name = info.filename
+                    if name in modified_parts:
+                        if modified_parts[name] is not None:
+                            zip_out.writestr(info, modified_parts[name])
+                    elif name in raw_sources:
+                        zip_out.writestr(info, raw_sources[name].read(name))
+                    else:
+                        zip_out.writestr(info, source_zip.read(name))
+                for name, data in modified_parts.items():
+                    if name not in existing and data is not None:
+                        zip_out.writestr(name, data)
+                for name, other_zip in raw_sources.items():
+                    if name not in existing and name not in modified_parts:
+                        zip_out.writestr(name, other_zip.read(name))
+    
     def _process_document_relationships(self, original_dir, translated_dir):
         """Process document relationships to maintain image references"""
         original_rels_file = os.path.join(original_dir, "word", "_rels", "document.xml.rels")
@@ -679,130 +1052,103 @@ class DocumentProcessor:
             import traceback
             traceback.print_exc()
     
+    # Compiled once: text-box handling runs these for every paragraph and run of every part
+    TXBX_NAMESPACES = {'w': W_NS}
+    TXBX_PARAGRAPHS = etree.XPath('//w:txbxContent/descendant::w:p', namespaces=TXBX_NAMESPACES)
+    TXBX_RUNS = etree.XPath('.//w:r', namespaces=TXBX_NAMESPACES)
+    TXBX_TEXTS = etree.XPath('./w:t', namespaces=TXBX_NAMESPACES)
+    REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+    
+    def _relationship_targets(self, zip_ref, part_name, type_suffixes):
+        """Part names a part refers to through relationships whose type ends with one of type_suffixes"""
+        directory, base = posixpath.split(part_name)
+        rels_name = posixpath.join(directory, '_rels', base + '.rels')
+        if rels_name not in zip_ref.namelist():
+            return []
+        targets = []
+        for rel in etree.fromstring(zip_ref.read(rels_name)).iter(self.REL_NS + 'Relationship'):
+            if rel.get('TargetMode') == 'External' or not rel.get('Type', '').endswith(type_suffixes):
+                continue
+            target = rel.get('Target', '')
+            if target.startswith('/'):
+                targets.append(target.lstrip('/'))
+            else:
+                targets.append(posixpath.normpath(posixpath.join(directory, target)))
+        return targets
+    
+    def text_box_parts(self, zip_ref):
+        """Main document part plus its header and footer parts, found through the package relationships"""
+        main_parts = self._relationship_targets(zip_ref, '', ('/officeDocument',)) or ['word/document.xml']
+        parts = []
+        for main_part in main_parts:
+            parts.append(main_part)
+            parts += self._relationship_targets(zip_ref, main_part, ('/header', '/footer'))
+        existing = set(zip_ref.namelist())
+        return [name for name in dict.fromkeys(parts) if name in existing]
+    
     def process_text_boxes(self, doc_path, output_path, target_language, language_code):
         """Process text boxes using direct XML manipulation"""
         try:
-            with tempfile.TemporaryDirectory() as temp_dir:
-                # Extract document
-                with zipfile.ZipFile(doc_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
-                
-                # Process XML files that might contain text boxes
-                xml_files = ['word/document.xml', 'word/header1.xml', 'word/header2.xml', 'word/header3.xml', 
-                            'word/footer1.xml', 'word/footer2.xml', 'word/footer3.xml']
-                
-                namespaces = {
-                    'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main',
-                    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
-                    'pic': 'http://schemas.openxmlformats.org/drawingml/2006/picture',
-                    'wp': 'http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing'
-                }
-                
-                for xml_file in xml_files:
-                    xml_path = os.path.join(temp_dir, xml_file)
-                    if not os.path.exists(xml_path):
-                        continue
-                    
+            modified_parts = {}
+            with zipfile.ZipFile(doc_path, 'r') as source_zip:
+                for xml_file in self.text_box_parts(source_zip):
                     try:
-                        # Parse XML
-                        tree = etree.parse(xml_path)
-                        root = tree.getroot()
-                        
-                        # Find text boxes
-                        textbox_contents = root.xpath('//w:txbxContent', namespaces=namespaces)
+                        root = etree.fromstring(source_zip.read(xml_file))
+                
+                        # One traversal per part: every text-box paragraph, each listed once
+                        paragraphs = self.TXBX_PARAGRAPHS(root)
+                        if not paragraphs:
+                            continue
+                        print(f"Found {len(root.xpath('//w:txbxContent', namespaces=self.TXBX_NAMESPACES))} "
+                              f"text boxes in {xml_file}")
+                
+                        changed = False
+                        for paragraph in paragraphs:
+                            if self.coalesce_adjacent_runs:
+                                self.coalesce_runs(paragraph)
+                
+                            # Runs and their text nodes, collected once and reused for the write-back
+                            runs = []
+                            for run in self.TXBX_RUNS(paragraph):
+                                text_elems = self.TXBX_TEXTS(run)
+                                run_text = ''.join(t.text or '' for t in text_elems)
+                                if run_text:
+                                    runs.append((text_elems, run_text))
+                            paragraph_text = ''.join(run_text for _, run_text in runs)
+                            if not paragraph_text.strip():
+                                continue
+                    
+                            # Translate paragraph
+                            context = self.translator.collect_context(paragraph_text, language_code)
+                            translated_text = self.translator.translate_text(
+                                paragraph_text, target_language, language_code, context)
+                            if translated_text == paragraph_text or not translated_text.strip():
+                                continue
                         
-                        if textbox_contents:
-                            print(f"Found {len(textbox_contents)} text boxes in {xml_file}")
-                            
-                            for textbox_content in textbox_contents:
-                                # Process paragraphs in text box
-                                paragraphs = textbox_content.xpath('.//w:p', namespaces=namespaces)
-                                
-                                for paragraph in paragraphs:
-                                    text_elements = paragraph.xpath('.//w:t', namespaces=namespaces)
-                                    paragraph_text = ''.join(text_elem.text or '' for text_elem in text_elements)
-                                    
-                                    if paragraph_text.strip():
-                                        # Get runs with formatting
-                                        runs = paragraph.xpath('.//w:r', namespaces=namespaces)
-                                        run_texts = []
-                                        run_formats = []
-                                        
-                                        for run in runs:
-                                            run_text_elements = run.xpath('.//w:t', namespaces=namespaces)
-                                            run_text = ''.join(t.text or '' for t in run_text_elements)
-                                            
-                                            if run_text:
-                                                run_texts.append(run_text)
-                                                
-                                                # Capture formatting
-                                                format_props = {
-                                                    'bold': bool(run.xpath('.//w:b', namespaces=namespaces)),
-                                                    'italic': bool(run.xpath('.//w:i', namespaces=namespaces)),
-                                                    'underline': bool(run.xpath('.//w:u', namespaces=namespaces)),
-                                                    'color': run.xpath('.//w:color/@val', namespaces=namespaces)[0] 
-                                                            if run.xpath('.//w:color/@val', namespaces=namespaces) else None,
-                                                    'font': run.xpath('.//w:rFonts/@ascii', namespaces=namespaces)[0]
-                                                            if run.xpath('.//w:rFonts/@ascii', namespaces=namespaces) else None,
-                                                    'size': run.xpath('.//w:sz/@val', namespaces=namespaces)[0]
-                                                            if run.xpath('.//w:sz/@val', namespaces=namespaces) else None
-                                                }
-                                                
-                                                run_formats.append((run, format_props))
-                                        
-                                        # Translate paragraph
-                                        context = self.translator.collect_context(paragraph_text, language_code)
-                                        translated_text = self.translator.translate_text(
-                                            paragraph_text, target_language, language_code, context)
-                                        
-                                        # Apply translation if successful
-                                        if translated_text != paragraph_text and translated_text.strip():
-                                            original_total_len = sum(len(text) for text in run_texts)
-                                            
-                                            if original_total_len > 0:
-                                                # Distribute translated text based on original proportions
-                                                run_proportions = [len(text) / original_total_len for text in run_texts]
-                                                translated_total_len = len(translated_text)
-                                                start_pos = 0
-                                                
-                                                for i, (run, _) in enumerate(run_formats):
-                                                    proportion = run_proportions[i]
-                                                    char_count = round(translated_total_len * proportion)
-                                                    
-                                                    end_pos = translated_total_len if i == len(run_formats) - 1 \
-                                                            else min(start_pos + char_count, translated_total_len)
-                                                    
-                                                    new_text = translated_text[start_pos:end_pos]
-                                                    
-                                                    # Update text element
-                                                    text_elems = run.xpath('.//w:t', namespaces=namespaces)
-                                                    if text_elems:
-                                                        text_elems[0].text = new_text
-                                                        for text_elem in text_elems[1:]:
-                                                            text_elem.text = ""
-                                                    
-                                                    start_pos = end_pos
-                                            elif run_formats:
-                                                # Update first run if original is empty
-                                                text_elems = run_formats[0][0].xpath('.//w:t', namespaces=namespaces)
-                                                if text_elems:
-                                                    text_elems[0].text = translated_text
+                            # Distribute translated text based on original proportions
+                            original_total_len = len(paragraph_text)
+                            translated_total_len = len(translated_text)
+                            start_pos = 0
+                            for i, (text_elems, run_text) in enumerate(runs):
+                                char_count = round(translated_total_len * len(run_text) / original_total_len)
+                                end_pos = translated_total_len if i == len(runs) - 1 \
+                                    else min(start_pos + char_count, translated_total_len)
+                                text_elems[0].text = translated_text[start_pos:end_pos]
+                                for text_elem in text_elems[1:]:
+                                    text_elem.text = ""
+                                start_pos = end_pos
+                            changed = True
                         
-                        # Save updated XML
-                        tree.write(xml_path, encoding='UTF-8', xml_declaration=True)
+                        if changed:
+                            modified_parts[xml_file] = etree.tostring(root, encoding='UTF-8', xml_declaration=True)
                         
                     except Exception as e:
                         print(f"Error processing {xml_file}: {e}")
                 
                 # Repackage document
-                with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as docx_file:
-                    for root, _, files in os.walk(temp_dir):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, temp_dir)
-                            docx_file.write(file_path, arcname)
+                self._repackage(source_zip, output_path, modified_parts)
                 
-                print(f"Updated document saved to {output_path}")
+            print(f"Updated document saved to {output_path}")
                 
         except Exception as e:
             print(f"Error processing text boxes: {e}")
@@ -830,11 +1176,16 @@ class DocumentTranslator:
                     language_code   # Language code
                 )
         
+        # Index the package once; the stages below are skipped when it shows nothing to do
+        features = self.processor.scan_package(input_file)
+        print(f"Document features: {self.processor.describe_features(features)}")
+        
         # Process each target language
         for language_name, language_code in LANGUAGES.items():
             try:
                 # Clear translation memory for new language
                 self.translator.translation_memory = {}
+                self.processor.run_stats = {'before': 0, 'after': 0}
                 
                 print(f"\nTranslating to {language_name}...")
                 
@@ -847,6 +1198,11 @@ class DocumentTranslator:
                 
                 # Load document
                 doc = docx.Document(input_file)
+                document_texts = [para.text for para in doc.paragraphs]
+                document_texts += [cell.text for table in doc.tables for row in table.rows for cell in row.cells]
+                for section in doc.sections:
+                    document_texts += [para.text for para in section.header.paragraphs + section.footer.paragraphs]
+                self.translator.set_document_glossary(document_texts, language_code)
                 
                 # Translate paragraphs
                 print("Processing paragraphs...")
@@ -858,7 +1214,7 @@ class DocumentTranslator:
                 
                 # Translate tables if present
                 print("Checking for tables...")
-                if self.processor.has_tables(doc):
+                if features['parts'].get('word/document.xml', {}).get('tables', 0) > 0:
                     print("Processing tables...")
                     for table in tqdm(doc.tables, desc="Tables"):
                         try:
@@ -867,22 +1223,24 @@ class DocumentTranslator:
                             print(f"Error processing table: {e}")
                 
                 # Process headers and footers
-                print("Processing headers and footers...")
-                try:
-                    for section in doc.sections:
-                        for para in section.header.paragraphs:
-                            self.processor.process_paragraph(para, language_name, language_code)
-                        
-                        for table in section.header.tables:
-                            self.processor.process_table(table, language_name, language_code)
+                if features['headers'] or features['footers']:
+                    print("Processing headers and footers...")
+                    try:
+                        # Linked sections share one header/footer part; visit each part once
+                        seen_parts = set()
+                        for section in doc.sections:
+                            for header_footer in (section.header, section.footer):
+                                if header_footer.part in seen_parts:
+                                    continue
+                                seen_parts.add(header_footer.part)
                         
-                        for para in section.footer.paragraphs:
-                            self.processor.process_paragraph(para, language_name, language_code)
+                                for para in header_footer.paragraphs:
+                                    self.processor.process_paragraph(para, language_name, language_code)
                         
-                        for table in section.footer.tables:
-                            self.processor.process_table(table, language_name, language_code)
-                except Exception as e:
-                    print(f"Error processing headers/footers: {e}")
+                                for table in header_footer.tables:
+                                    self.processor.process_table(table, language_name, language_code)
+                    except Exception as e:
+                        print(f"Error processing headers/footers: {e}")
                 
                 # Save intermediate document
                 temp_output_file = output_file + ".temp.docx"
@@ -891,7 +1249,7 @@ class DocumentTranslator:
                 
                 # Part 2: Process text boxes
                 print("Checking for text boxes...")
-                if self.processor.has_text_boxes(temp_output_file):
+                if self.processor.has_text_boxes(input_file):
                     try:
                         print("Processing text boxes...")
                         self.processor.process_text_boxes(temp_output_file, output_file, language_name, language_code)
@@ -913,12 +1271,18 @@ class DocumentTranslator:
                             os.remove(output_file)
                         os.rename(temp_output_file, output_file)
                 
+                # Report run coalescing
+                run_stats = self.processor.run_stats
+                if run_stats['before']:
+                    print(f"Run coalescing: {run_stats['before']} runs -> {run_stats['after']} runs")
+                
                 # Preserve images
-                try:
-                    print("Preserving images...")
-                    self.processor.preserve_images(input_file, output_file)
-                except Exception as e:
-                    print(f"Error preserving images: {e}")
+                if features['images']:
+                    try:
+                        print("Preserving images...")
+                        self.processor.preserve_images(input_file, output_file)
+                    except Exception as e:
+                        print(f"Error preserving images: {e}")
                 
                 # Print terminology statistics
                 if language_code in self.translator.terminology_db:
@@ -956,6 +1320,4 @@ def main():
     translator.translate_document(input_file, output_dir, google_sheet_url)
 
 if __name__ == "__main__":
-    # Import glob for file pattern matching
-    import glob
     main()
@@ -0,0 +1,302 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import docx
+from docx.enum.text import WD_COLOR_INDEX
+from docx.shared import Pt, RGBColor
+from lxml import etree
+import 文档翻译_纯净版 as translation
+
+try:
+    import resource  # Peak RSS; not available on Windows
+except ImportError:
+    resource = None
+
+W_NS = translation.W_NS
+W = f'{{{W_NS}}}'
+V_NS = "urn:schemas-microsoft-com:vml"
+
+# Benchmark cases: name -> generator settings
+CASES = {
+    'small': dict(paragraphs=50, runs_per_paragraph=3, tables=1, footnotes=2, text_boxes=1, images=1),
+    'medium': dict(paragraphs=500, runs_per_paragraph=4, tables=5, footnotes=20, text_boxes=5, images=3),
+    'large': dict(paragraphs=3000, runs_per_paragraph=4, tables=20, footnotes=100, text_boxes=10, images=5),
+    'fragmented': dict(paragraphs=500, runs_per_paragraph=24, tables=2, footnotes=10, text_boxes=2, images=1),
+}
+
+WORDS = ("camera", "motion", "detection", "privacy", "mode", "supports", "recording", "storage", "cloud",
+         "local", "night", "vision", "alerts", "device", "hub", "zigbee", "battery", "automation", "scene",
+         "sensor", "temperature", "humidity", "schedule", "notification", "firmware", "update", "the", "with")
+
+def make_png(width=64, height=64, seed=0):
+    """Build an uncompressed-content RGB PNG of the given size"""
+    rng = random.Random(seed)
+    rows = b''.join(b'\x00' + bytes(rng.randrange(256) for _ in range(width * 3)) for _ in range(height))
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b''))
+
+def make_sentence(rng, words=12):
+    sentence = ' '.join(rng.choice(WORDS) for _ in range(words))
+    return sentence[0].upper() + sentence[1:] + '.'
+
+def generate_document(path, paragraphs=100, runs_per_paragraph=4, tables=1, footnotes=0, text_boxes=0, images=0,
+                      repeat_ratio=0.3, seed=1):
+    """Write a synthetic .docx with fragmented runs, merged tables, headers/footers, footnotes, text boxes and images"""
+    rng = random.Random(seed)
+    doc = docx.Document()
+    pool = [make_sentence(rng) for _ in range(max(paragraphs // 10, 1))]
+    
+    for i in range(paragraphs):
+        # Part of the text repeats, as boilerplate does in real manuals
+        text = rng.choice(pool) if rng.random() < repeat_ratio else make_sentence(rng, rng.randint(6, 30))
+        para = doc.add_paragraph()
+        words = text.split(' ')
+        step = max(len(words) // runs_per_paragraph, 1)
+        for j in range(0, len(words), step):
+            run = para.add_run(' '.join(words[j:j + step]) + ' ')
+            # Alternate formatting so runs cannot all be coalesced
+            run.bold = (j // step) % 2 == 0
+            run.font.size = Pt(10 + (j // step) % 3)
+            if (j // step) % 4 == 3:
+                run.font.highlight_color = WD_COLOR_INDEX.YELLOW
+            run.font.color.rgb = RGBColor(0x20, 0x20, 0x20)
+        if images and i % max(paragraphs // images, 1) == 0 and i // max(paragraphs // images, 1) < images:
+            doc.add_picture(io.BytesIO(make_png(seed=i)))
+    
+    for t in range(tables):
+        table = doc.add_table(rows=4, cols=4)
+        table.cell(0, 0).merge(table.cell(0, 3))
+        table.cell(0, 0).text = f"Specification table {t + 1}"
+        table.cell(1, 0).merge(table.cell(2, 0))
+        for r in range(1, 4):
+            for c in range(4):
+                if table.cell(r, c).text == '':
+                    table.cell(r, c).text = make_sentence(rng, 4)
+    
+    for s, section in enumerate(doc.sections):
+        section.header.paragraphs[0].text = f"Product manual - section {s + 1}"
+        section.footer.paragraphs[0].text = "Copyright notice and support information"
+    
+    doc.save(path)
+    if footnotes or text_boxes:
+        _add_notes_and_text_boxes(path, footnotes, text_boxes, rng)
+    return path
+
+def _add_notes_and_text_boxes(path, footnotes, text_boxes, rng):
+    """Inject footnotes.xml, footnote references and VML text boxes, which python-docx cannot create"""
+    with zipfile.ZipFile(path) as source:
+        members = [(info, source.read(info.filename)) for info in source.infolist()]
+    
+    parts = {info.filename: data for info, data in members}
+    root = etree.fromstring(parts['word/document.xml'])
+    body_paragraphs = [p for p in root.iter(W + 'p') if p.find(W + 'r') is not None]
+    
+    for n in range(1, footnotes + 1):
+        para = body_paragraphs[(n * 7) % len(body_paragraphs)]
+        run = etree.SubElement(para, W + 'r')
+        rpr = etree.SubElement(run, W + 'rPr')
+        etree.SubElement(rpr, W + 'vertAlign').set(W + 'val', 'superscript')
+        etree.SubElement(run, W + 'footnoteReference').set(W + 'id', str(n))
+    
+    for n in range(text_boxes):
+        para = body_paragraphs[(n * 13 + 3) % len(body_paragraphs)]
+        run = etree.SubElement(para, W + 'r')
+        shape = etree.SubElement(etree.SubElement(run, W + 'pict'), f'{{{V_NS}}}shape', nsmap={'v': V_NS})
+        content = etree.SubElement(etree.SubElement(shape, f'{{{V_NS}}}textbox'), W + 'txbxContent')
+        box_para = etree.SubElement(content, W + 'p')
+        for word in make_sentence(rng, 8).split(' ')[:4]:
+            etree.SubElement(etree.SubElement(box_para, W + 'r'), W + 't').text = word + ' '
+    parts['word/document.xml'] = etree.tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True)
+    
+    if footnotes:
+        notes = ['<w:footnote w:type="separator" w:id="-1"><w:p><w:r><w:separator/></w:r></w:p></w:footnote>']
+        for n in range(1, footnotes + 1):
+            sentence = make_sentence(rng, 10).split(' ')
+            notes.append(f'<w:footnote w:id="{n}"><w:p><w:r><w:t xml:space="preserve">{" ".join(sentence[:5])} </w:t></w:r>'
+                         f'<w:r><w:rPr><w:i/></w:rPr><w:t>{" ".join(sentence[5:])}</w:t></w:r></w:p></w:footnote>')
+        parts['word/footnotes.xml'] = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                                       f'<w:footnotes xmlns:w="{W_NS}">{"".join(notes)}</w:footnotes>').encode('utf-8')
+        parts['word/_rels/document.xml.rels'] = parts['word/_rels/document.xml.rels'].replace(
+            b'</Relationships>',
+            b'<Relationship Id="rIdBenchFootnotes" Target="footnotes.xml" Type="http://schemas.openxmlformats.org/'
+            b'officeDocument/2006/relationships/footnotes"/></Relationships>')
+        parts['[Content_Types].xml'] = parts['[Content_Types].xml'].replace(
+            b'</Types>',
+            b'<Override PartName="/word/footnotes.xml" ContentType="application/vnd.openxmlformats-officedocument.'
+            b'wordprocessingml.footnotes+xml"/></Types>')
+    
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as target:
+        for info, _ in members:
+            target.writestr(info, parts[info.filename])
+        if 'word/footnotes.xml' in parts and 'word/footnotes.xml' not in {info.filename for info, _ in members}:
+            target.writestr('word/footnotes.xml', parts['word/footnotes.xml'])
+
+class OfflineTranslationManager(translation.TranslationManager):
+    """TranslationManager whose API is a deterministic local function, optionally with simulated latency"""
+    latency = 0.0
+    
+    class _Response:
+        status_code = 200
+        
+        def __init__(self, content, prompt):
+            self.content = content
+            self.prompt = prompt
+        
+        def json(self):
+            return {"choices": [{"message": {"content": self.content}}],
+                    "usage": {"prompt_tokens": len(self.prompt) // 4, "completion_tokens": len(self.content) // 4}}
+    
+    def send_request(self, headers, data):
+        if self.latency:
+            time.sleep(self.latency)
+        prompt = data["messages"][-1]["content"][-1]["text"]
+        text = prompt.split("Text to translate:\n", 1)[-1]
+        parts = self.BATCH_MARKER.split(text)
+        if len(parts) > 1:
+            # Numbered batch: answer marker by marker so the [[n]] markers survive
+            return self._Response("\n".join(f"[[{number}]] {self.fake_translation(piece.strip())}"
+                                            for number, piece in zip(parts[1::2], parts[2::2])), prompt)
+        return self._Response(self.fake_translation(text), prompt)
+    
+    @staticmethod
+    def fake_translation(text):
+        # Reversed text, with placeholders put back the right way round so they survive unmasking
+        reversed_text = re.sub(r'⟧(\d+)⟦', lambda match: f'⟦{match.group(1)[::-1]}⟧', text[::-1])
+        return f"[{len(text)}] {reversed_text}"
+
+def _run_case(name, settings, workdir, latency):
+    """Generate one document and translate it offline; runs in a fresh process so peak RSS is per case"""
+    input_file = generate_document(os.path.join(workdir, f"{name}.docx"), **settings)
+    output_dir = os.path.join(workdir, f"{name}_out")
+    
+    translator = translation.DocumentTranslator()
+    manager = OfflineTranslationManager(rate_limiter=translation.RateLimiter(0))
+    manager.latency = latency
+    translator.translator = manager
+    translator.processor.translator = manager
+    manager.interactive = False
+    translation.configure_progress(manager.progress)  # Console only, at the default level
+    
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        outputs = translator.translate_document(input_file, output_dir)
+    wall_seconds = time.perf_counter() - start
+    
+    metrics = manager.metrics.to_dict()
+    peak_rss_kb = None
+    if resource is not None:
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if platform.system() == 'Darwin':
+            peak_rss_kb //= 1024  # bytes on macOS
+    return {
+        'case': name,
+        'settings': settings,
+        'wall_seconds': wall_seconds,
+        'stage_seconds': metrics['stage_seconds'],
+        'requests': sum(entry['count'] for entry in metrics['request_latency'].values()),
+        'memory_hit_ratio': metrics['memory_hit_ratio'],
+        'peak_rss_kb': peak_rss_kb,
+        'input_bytes': os.path.getsize(input_file),
+        'output_bytes': sum(os.path.getsize(path) for path in outputs),
+        'outputs': len(outputs),
+    }
+
+def git_revision():
+    """Current commit of the working tree, if it is a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmarks(case_names, output_json, latency=0.0, keep_files=False):
+    """Run the selected cases and write the results as JSON"""
+    workdir = tempfile.mkdtemp(prefix='translation_bench_')
+    results = []
+    try:
+        for name in case_names:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                result = pool.submit(_run_case, name, CASES[name], workdir, latency).result()
+            results.append(result)
+            stages = ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in
+                               sorted(result['stage_seconds'].items(), key=lambda item: item[1], reverse=True)[:4])
+            rss = f"{result['peak_rss_kb'] / 1024:.0f} MB" if result['peak_rss_kb'] else 'n/a'
+            print(f"✓ {name}: {result['wall_seconds']:.2f}s, peak RSS {rss}, "
+                  f"output {result['output_bytes'] / 1024:.0f} KB, {result['requests']} requests ({stages})")
+    finally:
+        if keep_files:
+            print(f"Benchmark files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    report = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'latency': latency,
+        'results': results,
+    }
+    with open(output_json, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output_json}")
+    return report
+
+def compare_reports(baseline_json, report):
+    """Print per-case changes against a previous results file"""
+    with open(baseline_json, 'r', encoding='utf-8') as f:
+        baseline = {result['case']: result for result in json.load(f)['results']}
+    print(f"\nComparison with {baseline_json}:")
+    for result in report['results']:
+        old = baseline.get(result['case'])
+        if old is None:
+            print(f"  {result['case']}: no baseline")
+            continue
+        change = (result['wall_seconds'] - old['wall_seconds']) / old['wall_seconds'] if old['wall_seconds'] else 0
+        print(f"  {result['case']}: {old['wall_seconds']:.2f}s → {result['wall_seconds']:.2f}s ({change:+.1%})")
+        for stage, seconds in sorted(result['stage_seconds'].items()):
+            old_seconds = old['stage_seconds'].get(stage, 0.0)
+            print(f"    {stage}: {old_seconds:.2f}s → {seconds:.2f}s")
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of translate_document with an offline translator")
+    parser.add_argument('cases', nargs='*', default=list(CASES), help=f"Cases to run (default: all of {', '.join(CASES)})")
+    parser.add_argument('--output', default='benchmark_results.json', help="Results JSON file")
+    parser.add_argument('--compare', default=None, help="Previous results JSON to compare against")
+    parser.add_argument('--latency', type=float, default=0.0, help="Simulated seconds per API request")
+    parser.add_argument('--keep-files', action='store_true', help="Keep the generated documents and outputs")
+    parser.add_argument('--generate', default=None, help="Only write the first case's document to this path")
+    args = parser.parse_args()
+    
+    unknown = [name for name in args.cases if name not in CASES]
+    if unknown:
+        print(f"✗ Unknown cases: {', '.join(unknown)}")
+        return
+    
+    if args.generate:
+        generate_document(args.generate, **CASES[args.cases[0]])
+        print(f"✓ Generated {args.generate}")
+        return
+    
+    report = run_benchmarks(args.cases, args.output, args.latency, args.keep_files)
+    if args.compare:
+        compare_reports(args.compare, report)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,33 @@
+import argparse
+import bisect
+import collections
+import copy
+import difflib
 import docx
+import glob
+import hashlib
+import json
+import multiprocessing
 import requests
 import time
 import os
+import queue
 import re
 import shutil
+import socket
+import sqlite3
+import struct
+import sys
 import tempfile
+import threading
+import uuid
 import zipfile
+import zlib
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from docx.oxml.parser import parse_xml
+from docx.table import Table
+from docx.text.paragraph import Paragraph
 from lxml import etree
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
@@ -22,14 +44,794 @@ LANGUAGES = {
     "Spanish": "ES",
 }
 
-class TranslationManager:
+# WordprocessingML namespace
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+class RateLimiter:
+    """Minimum interval between API calls; pass multiprocessing proxies to enforce it across processes"""
+    def __init__(self, min_interval=1.0, lock=None, last_call=None):
+        self.min_interval = min_interval
+        self.lock = lock if lock is not None else threading.Lock()
+        self.last_call = last_call  # Shared Value proxy, or None to track the last call locally
+        self._local_last_call = 0
+    
+    def wait(self, on_wait=None):
+        """Block until the next call is allowed, then claim that slot"""
+        with self.lock:
+            last_call = self.last_call.value if self.last_call is not None else self._local_last_call
+            wait_time = self.min_interval - (time.time() - last_call)
+            if wait_time > 0:
+                if on_wait:
+                    on_wait(wait_time)
+                time.sleep(wait_time)
+            
+            now = time.time()
+            if self.last_call is not None:
+                self.last_call.value = now
+            else:
+                self._local_last_call = now
+    
+    def try_acquire(self):
+        """Claim the next call slot only if it is free right now; never blocks"""
+        with self.lock:
+            last_call = self.last_call.value if self.last_call is not None else self._local_last_call
+            now = time.time()
+            if now - last_call < self.min_interval:
+                return False
+            if self.last_call is not None:
+                self.last_call.value = now
+            else:
+                self._local_last_call = now
+            return True
+
+class JobStore:
+    """SQLite job store for document x language jobs, claimed by workers on several nodes under leases"""
+    def __init__(self, db_path, max_attempts=3):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            # Rollback journal rather than WAL: WAL needs shared memory, which network filesystems lack
+            conn.execute('PRAGMA journal_mode=DELETE')
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'id INTEGER PRIMARY KEY, document TEXT, output_dir TEXT, language_name TEXT, '
+                         'language_code TEXT, status TEXT, worker TEXT, lease_expires REAL, attempts INTEGER, '
+                         'outputs TEXT, error TEXT, updated REAL, UNIQUE (document, language_code))')
+            conn.execute('CREATE TABLE IF NOT EXISTS rate_budget (id INTEGER PRIMARY KEY, next_slot REAL)')
+            conn.execute('INSERT OR IGNORE INTO rate_budget (id, next_slot) VALUES (1, 0)')
+    
+    def _connect(self):
+        # One short-lived connection per operation: safe across threads, processes and nodes
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _ClosingConnection(conn)
+    
+    def enqueue(self, documents, output_dir, languages):
+        """Add one job per document and language; jobs already in the store are left alone"""
+        added = 0
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for document in documents:
+                for language_name, language_code in languages.items():
+                    cursor = conn.execute(
+                        'INSERT OR IGNORE INTO jobs (document, output_dir, language_name, language_code, status, '
+                        'attempts, updated) VALUES (?, ?, ?, ?, ?, 0, ?)',
+                        (os.path.abspath(document), os.path.abspath(output_dir), language_name, language_code,
+                         'pending', now))
+                    added += cursor.rowcount
+            conn.execute('COMMIT')
+        return added
+    
+    def claim(self, worker_id, lease_seconds):
+        """Lease the next pending job (or one whose lease expired) to worker_id; None if there is none"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            # A node that died on the last attempt leaves a running row nobody may reclaim: close it out
+            conn.execute("UPDATE jobs SET status = 'failed', error = 'lease expired', updated = ? "
+                         "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                         (now, now, self.max_attempts))
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'pending' OR (status = 'running' AND lease_expires < ?)) "
+                "AND attempts < ? ORDER BY id LIMIT 1", (now, self.max_attempts)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                         "updated = ? WHERE id = ?", (worker_id, now + lease_seconds, now, row['id']))
+            conn.execute('COMMIT')
+        job = dict(row)
+        job['attempts'] += 1
+        return job
+    
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        """Extend the lease; False means the job was reassigned to another worker"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE jobs SET lease_expires = ?, updated = ? "
+                                  "WHERE id = ? AND worker = ? AND status = 'running'",
+                                  (now + lease_seconds, now, job_id, worker_id))
+            return cursor.rowcount == 1
+    
+    def complete(self, job_id, worker_id, staged_outputs):
+        """Publish staged outputs and mark the job done, only if worker_id still holds the lease"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT output_dir FROM jobs WHERE id = ? AND worker = ? AND status = 'running'",
+                               (job_id, worker_id)).fetchone()
+            if row is None:
+                conn.execute('ROLLBACK')
+                return False
+            # Moving the files while holding the write lock makes publishing exactly-once
+            outputs = []
+            try:
+                for staged in staged_outputs:
+                    final_path = os.path.join(row['output_dir'], os.path.basename(staged))
+                    os.replace(staged, final_path)
+                    outputs.append(final_path)
+            except OSError as e:
+                # Files already moved stay published: record them with the job instead of rolling back
+                conn.execute("UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+                             "outputs = ?, error = ?, updated = ? WHERE id = ?",
+                             (self.max_attempts, json.dumps(outputs),
+                              f"partial publish ({len(outputs)} of {len(staged_outputs)} outputs): {e}"[:500],
+                              time.time(), job_id))
+                conn.execute('COMMIT')
+                return False
+            conn.execute("UPDATE jobs SET status = 'done', outputs = ?, error = NULL, updated = ? WHERE id = ?",
+                         (json.dumps(outputs), time.time(), job_id))
+            conn.execute('COMMIT')
+        return True
+    
+    def fail(self, job_id, worker_id, error):
+        """Release a failed job for another attempt, or mark it failed after max_attempts"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, "
+                         "error = ?, updated = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                         (self.max_attempts, str(error)[:500], time.time(), job_id, worker_id))
+    
+    def counts(self):
+        """Number of jobs per status"""
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+    
+    def reserve_slot(self, min_interval):
+        """Claim the next global API call slot; returns seconds to wait before using it"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            next_slot = conn.execute('SELECT next_slot FROM rate_budget WHERE id = 1').fetchone()[0]
+            now = time.time()
+            slot = max(now, next_slot)
+            conn.execute('UPDATE rate_budget SET next_slot = ? WHERE id = 1', (slot + min_interval,))
+            conn.execute('COMMIT')
+        return slot - now
+
+    def try_reserve_slot(self, min_interval):
+        """Claim the global API call slot only if it is free right now"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            next_slot = conn.execute('SELECT next_slot FROM rate_budget WHERE id = 1').fetchone()[0]
+            now = time.time()
+            if next_slot > now:
+                conn.execute('ROLLBACK')
+                return False
+            conn.execute('UPDATE rate_budget SET next_slot = ? WHERE id = 1', (now + min_interval,))
+            conn.execute('COMMIT')
+        return True
+
+class _ClosingConnection:
+    """Context manager that closes (not just commits) an sqlite3 connection"""
+    def __init__(self, conn):
+        self.conn = conn
+    
+    def __enter__(self):
+        return self.conn
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.conn.in_transaction:
+            self.conn.execute('ROLLBACK')
+        self.conn.close()
+
+class StoreRateLimiter:
+    """RateLimiter counterpart whose call budget is shared by every node using the same JobStore"""
+    def __init__(self, job_store, min_interval=1.0):
+        self.job_store = job_store
+        self.min_interval = min_interval
+    
+    def wait(self, on_wait=None):
+        wait_time = self.job_store.reserve_slot(self.min_interval)
+        if wait_time > 0:
+            if on_wait:
+                on_wait(wait_time)
+            time.sleep(wait_time)
+    
+    def try_acquire(self):
+        return self.job_store.try_reserve_slot(self.min_interval)
+
+class ResponseSanitizer:
+    """Compiled cleanup rules for API responses: drop chatter lines, strip explanation blocks, count rule hits"""
+    # Lines containing one of these are assistant chatter, not translation
+    DROP_LINE_RULES = {
+        'sorry': r"I'm sorry", 'apology': r"I apologize", 'here_is': r"Here is the translation",
+        'translated_text': r"Translated text", 'please_note': r"Please note", 'cannot': r"I cannot",
+        'would': r"I would", 'customer_greeting': r"Dear Valued Customer", 'sign_off': r"Best regards",
+        'customer_team': r"The Customer Service Team",
+    }
+    # Explanation blocks before or after the translation
+    STRIP_RULES = {
+        'leading_note': r"^(?:I'm sorry|I apologize|Sorry|Note|Please note).*?\n\n",
+        'trailing_note': r"\n\n(?:I'm sorry|I apologize|Sorry|Note|Please note).*?$",
+        'preamble': r"^(?:Here is|Here's|The following is|This is) the translation.*?\n\n",
+        'label': r"^Translated text:.*?\n\n",
+    }
+    LETTER = re.compile(r'[a-zA-Z]')
+    
+    def __init__(self, drop_line_rules=None, strip_rules=None):
+        self.drop_line_rules = dict(self.DROP_LINE_RULES if drop_line_rules is None else drop_line_rules)
+        self.strip_rules = dict(self.STRIP_RULES if strip_rules is None else strip_rules)
+        self.compile()
+    
+    def compile(self):
+        """Compile every rule; call again after changing the rules"""
+        self._drop_line = [(name, re.compile(pattern, re.IGNORECASE))
+                           for name, pattern in self.drop_line_rules.items()]
+        self._strip = [(name, re.compile(pattern, re.IGNORECASE | re.DOTALL))
+                       for name, pattern in self.strip_rules.items()]
+    
+    def add_rule(self, name, pattern, drop_line=False):
+        """Add (or replace) a rule, e.g. for one language or model"""
+        (self.drop_line_rules if drop_line else self.strip_rules)[name] = pattern
+        self.compile()
+    
+    def sanitize(self, translated_text, original_text, metrics=None):
+        """Clean one response; the hits and time of each rule go to metrics"""
+        lines = translated_text.split('\n')
+        for name, rule in self._drop_line:
+            start = time.perf_counter()
+            kept = [line for line in lines if not rule.search(line)]
+            if metrics:
+                metrics.observe_rule(name, time.perf_counter() - start, len(lines) - len(kept))
+            lines = kept
+        translated_text = '\n'.join(lines)
+        
+        if not translated_text.strip() and original_text.strip():
+            return original_text
+        if not self.LETTER.search(original_text) and len(original_text.strip()) < 3:
+            return original_text
+        
+        # Each rule runs once, in order, like the legacy chain: a note before a preamble goes first,
+        # and text left at the start afterwards is translation, even if it begins with "Note"
+        for name, rule in self._strip:
+            start = time.perf_counter()
+            translated_text, hits = rule.subn('', translated_text)
+            if metrics:
+                metrics.observe_rule(name, time.perf_counter() - start, hits)
+        return translated_text
+
+class HedgePolicy:
+    """When to send a duplicate of a slow API request: after a latency percentile, within a budget"""
+    def __init__(self, percentile=95, budget=0.05, min_samples=20, window=200):
+        self.percentile = percentile
+        self.budget = budget  # Hedges allowed per observed request
+        self.min_samples = min_samples
+        self.latencies = collections.deque(maxlen=window)
+        self.requests = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+    
+    def observe(self, seconds):
+        """Record the latency of a successful request"""
+        with self.lock:
+            self.latencies.append(seconds)
+            self.requests += 1
+    
+    def delay(self):
+        """Seconds to wait before hedging, or None while there is too little history"""
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+    
+    def try_spend(self):
+        """Take one hedge from the budget; False when the budget is used up"""
+        with self.lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+    
+    def refund(self):
+        """Return a hedge that was taken but not sent"""
+        with self.lock:
+            self.hedges -= 1
+
+class SharedTranslationMemory:
+    """SQLite-backed translation memory shared by worker processes and kept between runs"""
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS memory ('
+                          'language TEXT, key TEXT, translation TEXT, PRIMARY KEY (language, key))')
+        self.conn.commit()
+    
+    def get(self, language_code, key):
+        """Return the stored translation, or None"""
+        with self.lock:
+            row = self.conn.execute('SELECT translation FROM memory WHERE language = ? AND key = ?',
+                                    (language_code, key)).fetchone()
+        return row[0] if row else None
+    
+    def put(self, language_code, key, translation):
+        """Store a translation"""
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO memory (language, key, translation) VALUES (?, ?, ?)',
+                              (language_code, key, translation))
+            self.conn.commit()
+
+class TranslationMetrics:
+    """Counters, request latency histograms and per-stage timings, exportable as JSON or Prometheus text"""
+    LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    COUNTERS = ('retries', 'rate_limited', 'memory_hits', 'memory_misses', 'context_hits', 'context_misses',
+                'prompt_tokens', 'completion_tokens', 'cache_read_tokens', 'cache_write_tokens', 'hedged', 'hedge_wins',
+                'segment_errors')
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.latency = {}  # status -> {'buckets': [...], 'sum': seconds, 'count': n}
+        self.stages = {}   # stage -> seconds
+        self.rule_hits = {}     # sanitizer rule -> responses it changed
+        self.rule_seconds = {}  # sanitizer rule -> seconds
+        self._last_lap = time.perf_counter()
+    
+    def __getstate__(self):
+        # Shard workers send their metrics back to the parent process
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+    
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+    
+    def observe_request(self, status, seconds):
+        """Record one API request's latency under its HTTP status (or 'error')"""
+        with self.lock:
+            entry = self.latency.setdefault(str(status), {'buckets': [0] * len(self.LATENCY_BUCKETS), 'sum': 0.0,
+                                                          'count': 0})
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= bound:
+                    entry['buckets'][i] += 1
+            entry['sum'] += seconds
+            entry['count'] += 1
+    
+    def observe_rule(self, rule, seconds, hits=0):
+        """Record one run of a response sanitizer rule: its time and how often it fired"""
+        with self.lock:
+            self.rule_seconds[rule] = self.rule_seconds.get(rule, 0.0) + seconds
+            if hits:
+                self.rule_hits[rule] = self.rule_hits.get(rule, 0) + hits
+    
+    def mark(self):
+        """Start timing the next stage from now"""
+        self._last_lap = time.perf_counter()
+    
+    def lap(self, stage):
+        """Charge the time since the previous mark/lap to stage"""
+        now = time.perf_counter()
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last_lap
+        self._last_lap = now
+    
+    def merge(self, other):
+        """Add another metrics object into this one"""
+        with self.lock:
+            for name, value in other.counters.items():
+                self.counters[name] += value
+            for status, source in other.latency.items():
+                entry = self.latency.setdefault(status, {'buckets': [0] * len(self.LATENCY_BUCKETS), 'sum': 0.0,
+                                                         'count': 0})
+                entry['buckets'] = [a + b for a, b in zip(entry['buckets'], source['buckets'])]
+                entry['sum'] += source['sum']
+                entry['count'] += source['count']
+            for stage, seconds in other.stages.items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            for rule, hits in other.rule_hits.items():
+                self.rule_hits[rule] = self.rule_hits.get(rule, 0) + hits
+            for name, seconds in other.rule_seconds.items():
+                self.rule_seconds[name] = self.rule_seconds.get(name, 0.0) + seconds
+    
+    @staticmethod
+    def _ratio(hits, misses):
+        return hits / (hits + misses) if hits + misses else 0.0
+    
+    def to_dict(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'memory_hit_ratio': self._ratio(self.counters['memory_hits'], self.counters['memory_misses']),
+                'context_hit_ratio': self._ratio(self.counters['context_hits'], self.counters['context_misses']),
+                'request_latency': {status: {'buckets': dict(zip(map(str, self.LATENCY_BUCKETS), entry['buckets'])),
+                                             'sum': entry['sum'], 'count': entry['count']}
+                                    for status, entry in self.latency.items()},
+                'stage_seconds': dict(self.stages),
+                'sanitizer': {'rule_hits': dict(self.rule_hits), 'rule_seconds': dict(self.rule_seconds)},
+            }
+    
+    def to_prometheus(self, prefix='doc_translation'):
+        """Render in the Prometheus text exposition format"""
+        data = self.to_dict()
+        counters = data['counters']
+        lines = [f'# HELP {prefix}_request_seconds Translation API request latency',
+                 f'# TYPE {prefix}_request_seconds histogram']
+        for status, entry in sorted(data['request_latency'].items()):
+            for bound, count in entry['buckets'].items():
+                lines.append(f'{prefix}_request_seconds_bucket{{status="{status}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_request_seconds_bucket{{status="{status}",le="+Inf"}} {entry["count"]}')
+            lines.append(f'{prefix}_request_seconds_sum{{status="{status}"}} {entry["sum"]:.6f}')
+            lines.append(f'{prefix}_request_seconds_count{{status="{status}"}} {entry["count"]}')
+        lines += [f'# TYPE {prefix}_retries_total counter', f'{prefix}_retries_total {counters["retries"]}',
+                  f'# TYPE {prefix}_rate_limited_total counter',
+                  f'{prefix}_rate_limited_total {counters["rate_limited"]}',
+                  f'# TYPE {prefix}_hedged_requests_total counter',
+                  f'{prefix}_hedged_requests_total {counters["hedged"]}',
+                  f'# TYPE {prefix}_hedge_wins_total counter',
+                  f'{prefix}_hedge_wins_total {counters["hedge_wins"]}',
+                  f'# TYPE {prefix}_memory_lookups_total counter',
+                  f'{prefix}_memory_lookups_total{{result="hit"}} {counters["memory_hits"]}',
+                  f'{prefix}_memory_lookups_total{{result="miss"}} {counters["memory_misses"]}',
+                  f'# TYPE {prefix}_context_lookups_total counter',
+                  f'{prefix}_context_lookups_total{{result="hit"}} {counters["context_hits"]}',
+                  f'{prefix}_context_lookups_total{{result="miss"}} {counters["context_misses"]}',
+                  f'# TYPE {prefix}_tokens_total counter',
+                  f'{prefix}_tokens_total{{direction="in"}} {counters["prompt_tokens"]}',
+                  f'{prefix}_tokens_total{{direction="out"}} {counters["completion_tokens"]}',
+                  f'{prefix}_tokens_total{{direction="cache_read"}} {counters["cache_read_tokens"]}',
+                  f'{prefix}_tokens_total{{direction="cache_write"}} {counters["cache_write_tokens"]}',
+                  f'# TYPE {prefix}_stage_seconds_total counter']
+        for stage, seconds in sorted(data['stage_seconds'].items()):
+            lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {seconds:.6f}')
+        lines.append(f'# TYPE {prefix}_sanitizer_rule_hits_total counter')
+        for rule, hits in sorted(data['sanitizer']['rule_hits'].items()):
+            lines.append(f'{prefix}_sanitizer_rule_hits_total{{rule="{rule}"}} {hits}')
+        lines.append(f'# TYPE {prefix}_sanitizer_seconds_total counter')
+        for rule, seconds in sorted(data['sanitizer']['rule_seconds'].items()):
+            lines.append(f'{prefix}_sanitizer_seconds_total{{rule="{rule}"}} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
+    
+    def summary(self):
+        """One-line summary for the console"""
+        data = self.to_dict()
+        requests_made = sum(entry['count'] for entry in data['request_latency'].values())
+        slowest = sorted(data['stage_seconds'].items(), key=lambda item: item[1], reverse=True)[:3]
+        return (f"{requests_made} requests, {data['counters']['retries']} retries, "
+                f"{data['counters']['hedged']} hedged ({data['counters']['hedge_wins']} won), "
+                f"memory hit ratio {data['memory_hit_ratio']:.1%}, "
+                f"tokens {data['counters']['prompt_tokens']} in ({data['counters']['cache_read_tokens']} cached) / "
+                f"{data['counters']['completion_tokens']} out; "
+                f"slowest stages: " + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in slowest))
+
+class ProgressReporter:
+    """Progress and event stream: stage, segment and throttled progress events with an ETA, sent to subscribers"""
+    LEVELS = {'debug': 0, 'info': 1, 'warning': 2}
+    
+    def __init__(self, interval=0.5):
+        self.interval = interval  # Minimum seconds between 'progress' events
+        self.subscribers = []     # (callback, minimum level)
+        self.lock = threading.Lock()
+        self.context = {}
+        self._reset_counts(0, 0)
+    
+    def subscribe(self, callback, level='info'):
+        self.subscribers.append((callback, self.LEVELS[level]))
+    
+    def emit(self, event, level='info', **fields):
+        """Send one event to every subscriber listening at this level"""
+        if not self.subscribers:
+            return
+        payload = {'event': event, 'level': level, 'time': time.time(), **self.context, **fields}
+        for callback, min_level in self.subscribers:
+            if self.LEVELS[level] >= min_level:
+                try:
+                    callback(payload)
+                except Exception:
+                    pass  # A broken consumer must not stop the translation
+    
+    def message(self, text, level='warning'):
+        self.emit('message', level, text=text)
+    
+    def stage(self, name, text=None, **fields):
+        self.emit('stage', stage=name, text=text, **fields)
+    
+    def _reset_counts(self, total_segments, total_chars):
+        self.total_segments, self.total_chars = total_segments, total_chars
+        self.done_segments = self.done_chars = 0
+        self.started = time.time()
+        self._last_emit = 0.0
+    
+    def begin(self, total_segments, total_chars, **context):
+        """Start tracking a unit of work (one language of one document)"""
+        with self.lock:
+            self.context = context
+            self._reset_counts(total_segments, total_chars)
+        self._emit_progress(force=True)
+    
+    def advance(self, chars, segments=1):
+        with self.lock:
+            self.done_segments += segments
+            self.done_chars += chars
+        self._emit_progress(force=self.done_segments >= self.total_segments)
+    
+    def _emit_progress(self, force=False):
+        now = time.time()
+        with self.lock:
+            if not force and now - self._last_emit < self.interval:
+                return
+            self._last_emit = now
+            elapsed = now - self.started
+            # ETA from remaining characters at the throughput observed so far
+            rate = self.done_chars / elapsed if elapsed > 0 else 0.0
+            remaining = max(self.total_chars - self.done_chars, 0)
+            eta = remaining / rate if rate > 0 else None
+            fields = {'segments_done': self.done_segments, 'segments_total': self.total_segments,
+                      'chars_done': self.done_chars, 'chars_total': self.total_chars,
+                      'chars_per_second': rate, 'eta_seconds': eta}
+        self.emit('progress', **fields)
+
+class ConsoleProgress:
+    """Console consumer of ProgressReporter events"""
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+    
+    def __call__(self, event):
+        kind = event['event']
+        if kind in ('message', 'stage', 'segment', 'request', 'rate_limit') and event.get('text'):
+            print(event['text'])
+        elif kind == 'progress' and not self.verbose:
+            eta = event['eta_seconds']
+            eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '--:--:--'
+            print(f"  [{event.get('language', '')}] {event['segments_done']}/{event['segments_total']} segments, "
+                  f"{event['chars_done']:,}/{event['chars_total']:,} chars, "
+                  f"{event['chars_per_second']:,.0f} chars/s, ETA {eta_text}")
+
+class JsonLinesProgress:
+    """Writes every event as one JSON line (to a file path, or stdout for '-')"""
+    STDOUT_LOCK = threading.Lock()  # Shared by every consumer writing to stdout (daemon workers)
+    
+    def __init__(self, path):
+        self.lock = self.STDOUT_LOCK if path == '-' else threading.Lock()
+        # The real stdout: configure_progress sends plain prints to stderr while events use stdout
+        self.stream = sys.__stdout__ if path == '-' else open(path, 'a', encoding='utf-8')
+    
+    def __call__(self, event):
+        line = json.dumps(event, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+class TranslationJournal:
+    """Append-only JSON-lines journal of completed segments, flushed as each result arrives"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+    
+    @staticmethod
+    def document_hash(doc_path):
+        """SHA-256 of the source document, so a journal is never replayed against a changed file"""
+        digest = hashlib.sha256()
+        with open(doc_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def open(self, resume=False):
+        """Open for appending; a fresh (non-resume) run starts an empty journal"""
+        if resume and os.path.exists(self.path):
+            # A crash can leave a partial last line; cut it so the next record starts on a line of its own
+            with open(self.path, 'rb+') as f:
+                data = f.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    f.truncate(end)
+        self.file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+    
+    def load(self, doc_hash, language_code):
+        """Replay the journal: {segment id: translation} for this document and language"""
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Partial last line from a crash
+                if entry.get('doc') == doc_hash and entry.get('lang') == language_code:
+                    entries[entry['segment']] = entry['translation']
+        return entries
+    
+    def record(self, doc_hash, language_code, segment_id, translation):
+        """Append one completed segment and force it to disk"""
+        if self.file is None:
+            return
+        line = json.dumps({'doc': doc_hash, 'lang': language_code,
+                           'segment': segment_id, 'translation': translation}, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+    
+    def close(self, remove=False):
+        """Close the journal; remove=True deletes it once the run finished and there is nothing to resume"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if remove and os.path.exists(self.path):
+            os.remove(self.path)
+
+class SegmentClassifier:
+    """Decide per segment whether to translate it, skip it (nothing to translate) or pass it through (other script)"""
+    # (first code point, last code point, script), sorted by first code point
+    SCRIPT_RANGES = [
+        (0x0041, 0x005A, 'latin'), (0x0061, 0x007A, 'latin'), (0x00C0, 0x024F, 'latin'),
+        (0x0370, 0x03FF, 'greek'), (0x0400, 0x052F, 'cyrillic'), (0x0590, 0x05FF, 'hebrew'),
+        (0x0600, 0x06FF, 'arabic'), (0x0750, 0x077F, 'arabic'), (0x0900, 0x097F, 'devanagari'),
+        (0x0E00, 0x0E7F, 'thai'), (0x1100, 0x11FF, 'hangul'), (0x1E00, 0x1EFF, 'latin'),
+        (0x3040, 0x309F, 'kana'), (0x30A0, 0x30FF, 'kana'), (0x3400, 0x4DBF, 'han'), (0x4E00, 0x9FFF, 'han'),
+        (0xAC00, 0xD7AF, 'hangul'), (0xF900, 0xFAFF, 'han'), (0xFB50, 0xFDFF, 'arabic'), (0xFE70, 0xFEFF, 'arabic'),
+    ]
+    # Scripts a target language is written in; anything not listed is written in Latin script
+    TARGET_SCRIPTS = {
+        'ZH': {'han'}, 'JA': {'han', 'kana'}, 'KO': {'hangul', 'han'}, 'RU': {'cyrillic'}, 'UK': {'cyrillic'},
+        'BG': {'cyrillic'}, 'AR': {'arabic'}, 'HE': {'hebrew'}, 'EL': {'greek'}, 'TH': {'thai'}, 'HI': {'devanagari'},
+    }
+    # Tokens that never need translation: URLs, e-mail addresses, quantities with units, part/model numbers, code
+    NON_TRANSLATABLE = re.compile(r"""
+        (?P<url>\b(?:https?://|www\.)\S+)
+      | (?P<email>\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b)
+      | (?P<numeric>[-+]?\d+(?:[.,:/]\d+)*\s*(?:mm|cm|km|kg|mg|mAh|Ah|kWh|kW|mW|W|V|mA|A|GHz|MHz|kHz|Hz|dB|fps
+                    |Mbps|Kbps|TB|GB|MB|KB|°C|°F|°|%|ms|s|min|h|px|p|K|m|g)?(?![A-Za-z0-9]))
+      | (?P<part_number>\b(?=[A-Za-z0-9-]*\d)(?=[A-Za-z0-9-]*[A-Za-z])[A-Za-z0-9]+(?:-[A-Za-z0-9]+)*\b)
+      | (?P<code>\b\w+(?:(?:\.|::|->)\w+)+(?:\(\))?|\b\w+_\w+\b|\b\w+\(\)|[{}\[\]<>=;]+)
+    """, re.VERBOSE)
+    WORD = re.compile(r'[A-Za-zÀ-ɏ]{2,}')
+    
     def __init__(self):
+        self._starts = [start for start, _, _ in self.SCRIPT_RANGES]
+        self._script_cache = {}
+    
+    def script_of(self, char):
+        """Script of one character, or None for digits, punctuation and symbols"""
+        script = self._script_cache.get(char, False)
+        if script is False:
+            code_point = ord(char)
+            i = bisect.bisect_right(self._starts, code_point) - 1
+            script = None
+            if i >= 0 and code_point <= self.SCRIPT_RANGES[i][1]:
+                script = self.SCRIPT_RANGES[i][2]
+            self._script_cache[char] = script
+        return script
+    
+    def classify(self, text, language_code=None):
+        """Return (decision, reason): ('translate', None), ('skip', reason) or ('passthrough', reason)"""
+        stripped = text.strip()
+        if not stripped:
+            return 'skip', 'empty'
+        
+        # One pass over the characters counts letters per script
+        counts = {}
+        for char in stripped:
+            script = self.script_of(char)
+            if script is not None:
+                counts[script] = counts.get(script, 0) + 1
+        latin = counts.get('latin', 0)
+        
+        # Chinese content stays as it is (the source documents are English)
+        if counts.get('han', 0) / len(stripped) > 0.1:
+            return 'passthrough', 'chinese'
+        target_scripts = self.TARGET_SCRIPTS.get((language_code or '').upper(), {'latin'})
+        if 'latin' not in target_scripts and sum(counts.get(script, 0) for script in target_scripts) >= max(latin, 1):
+            return 'passthrough', 'target_script'
+        if not counts:
+            return 'skip', 'numeric' if any(char.isdigit() for char in stripped) else 'symbols'
+        if not latin:
+            return 'translate', None  # Text in another script the API can still translate
+        
+        # Latin text: is a word left once URLs, quantities, part numbers and code are removed?
+        reasons = []
+        def strip_token(match):
+            reasons.append(match.lastgroup)
+            return ' '
+        remainder = self.NON_TRANSLATABLE.sub(strip_token, stripped)
+        if self.WORD.search(remainder):
+            return 'translate', None
+        if not reasons:
+            return 'skip', 'symbols'
+        return 'skip', reasons[0] if len(set(reasons)) == 1 else 'mixed'
+
+class PlaceholderMasker:
+    """Swap numbers, units, URLs, citations and inline code for indexed placeholders around translation"""
+    PATTERN = re.compile(r"""
+        (?P<citation>\((?:[A-Z][\w'\-]+(?:\ (?:et\ al\.|and|&)(?:\ [A-Z][\w'\-]+)?)*,\ \d{4}[a-z]?(?:;\ *)?)+\)
+                   |\[\d+(?:\s*[,–-]\s*\d+)*\])
+      | (?P<url>\b(?:https?://|www\.)[^\s<>"]*[^\s<>".,;:!?)])
+      | (?P<email>\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b)
+      | (?P<code>`[^`\n]+`)
+      | (?P<number>(?<![\w.])[-+]?\d+(?:[.,:/]\d+)*
+                   (?:\s?(?:mm|cm|km|kg|mg|mAh|Ah|kWh|kW|W|V|mA|GHz|MHz|kHz|Hz|dB|fps|Mbps|TB|GB|MB|KB|°C|°F|ms|px)
+                   (?![A-Za-z])|%)?(?![\w]))
+    """, re.VERBOSE)
+    PLACEHOLDER = re.compile(r'⟦(\d+)⟧')
+    
+    @staticmethod
+    def placeholder(index):
+        return f'⟦{index}⟧'
+    
+    def mask(self, text):
+        """Return (masked text, original values in placeholder order)"""
+        values = []
+        def replace(match):
+            values.append(match.group(0))
+            return self.placeholder(len(values) - 1)
+        return self.PATTERN.sub(replace, text), values
+    
+    def unmask(self, text, values):
+        """Restore placeholders; None unless every placeholder survived exactly once"""
+        found = [int(index) for index in self.PLACEHOLDER.findall(text)]
+        if sorted(found) != list(range(len(values))):
+            return None
+        return self.PLACEHOLDER.sub(lambda match: values[int(match.group(1))], text)
+    
+    def mask_translation(self, translation, values):
+        """Put placeholders back into a literal translation; None if a value is not found in it"""
+        # Longest values first, whole tokens only ("1" is not inside "10" or "2021"), never inside a placeholder
+        for index, value in sorted(enumerate(values), key=lambda item: len(item[1]), reverse=True):
+            taken = [match.span() for match in self.PLACEHOLDER.finditer(translation)]
+            pattern = re.compile(r'(?<![\w.])' + re.escape(value) + r'(?![\w]|[.,:/]\d)')
+            match = next((match for match in pattern.finditer(translation)
+                          if not any(start < match.end() and match.start() < end for start, end in taken)), None)
+            if match is None:
+                return None
+            translation = translation[:match.start()] + self.placeholder(index) + translation[match.end():]
+        return translation
+
+class TranslationManager:
+    def __init__(self, memory_store=None, rate_limiter=None):
         self.translation_memory = {}
+        self.memory_lock = threading.Lock()  # Segment workers read translation_memory while others add to it
         self.terminology_db = {}
         self.consecutive_failures = 0
         self.total_attempts = 0
         self.total_successes = 0
-        self.last_api_call_time = 0  # Track last API call for rate limiting
+        self.stats_lock = threading.Lock()  # Guards the counters above and cost_history (segment workers share them)
+        self.memory_store = memory_store  # Optional SharedTranslationMemory (batch mode)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.session = requests.Session()  # Reuse connections across requests
+        self.interactive = True  # Ask before continuing after repeated failures
+        self.journal = None  # Optional TranslationJournal for crash-safe resume
+        self.document_glossary = {}  # language code -> glossary lines of the current document (prompt prefix)
+        self.journal_doc_hash = None
+        self.metrics = TranslationMetrics()
+        self.classifier = SegmentClassifier()
+        self.masker = PlaceholderMasker()
+        self.mask_placeholders = True  # Numbers, URLs, citations and code travel as placeholders
+        self.progress = ProgressReporter()
+        self.progress.subscribe(ConsoleProgress())
+        self.hedge = None  # Optional HedgePolicy: duplicate requests that outlive the usual latency
+        self.cost_history = {}  # 'body'/'footnote' -> [characters, seconds] of successful translations
+        self.sanitizer = ResponseSanitizer()
+        self.offline = False  # Memory only: misses are collected in offline_misses instead of calling the API
+        self.offline_misses = []
+        self.sanitizers = {}  # language code or model id -> ResponseSanitizer overriding the default
+        self.hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='hedge')  # Threads start on demand
     
     def load_terminology(self, sheet_url, source_lang_col, target_lang_col, language_code):
         """Load terminology from Google Sheets"""
@@ -106,7 +908,9 @@ class TranslationManager:
             return None
         
         matched_entries = []
-        for source, translation in self.translation_memory.items():
+        with self.memory_lock:
+            entries = list(self.translation_memory.items())
+        for source, translation in entries:
             score = sum(1 for word in words if word in source.lower())
             if score > 0:
                 matched_entries.append((source, translation, score))
@@ -128,48 +932,405 @@ class TranslationManager:
         
         return "\n\n".join(context)
     
-    def verify_translation(self, translated_text, original_text):
+    def mask(self, text):
+        """Return (masked text, placeholder values); the text itself when masking is off"""
+        if not self.mask_placeholders:
+            return text, []
+        return self.masker.mask(text)
+    
+    def memory_key(self, text):
+        """Return the translation memory key for a source text"""
+        return self.mask(text)[0].strip().lower()
+    
+    def lookup_memory(self, text, language_code=None, record=True):
+        """Return the remembered translation for text, or None"""
+        translation = self._lookup_memory(text, language_code)
+        if record:
+            self.metrics.count('memory_hits' if translation is not None else 'memory_misses')
+        return translation
+    
+    def _lookup_memory(self, text, language_code):
+        # Memory holds masked translations; this text's own values go back into the placeholders
+        masked_text, values = self.mask(text)
+        memory_key = masked_text.strip().lower()
+        translation = self.translation_memory.get(memory_key)
+        if translation is None and self.memory_store is not None and language_code:
+            translation = self.memory_store.get(language_code, memory_key)
+            if translation is not None:
+                with self.memory_lock:
+                    self.translation_memory[memory_key] = translation
+        if translation is None:
+            return None
+        return self.masker.unmask(translation, values)
+    
+    def remember(self, memory_key, translation, language_code):
+        """Store a translation in memory (and in the shared store, if any)"""
+        with self.memory_lock:
+            self.translation_memory[memory_key] = translation
+        if self.memory_store is not None:
+            self.memory_store.put(language_code, memory_key, translation)
+        if self.journal is not None:
+            self.journal.record(self.journal_doc_hash, language_code, memory_key, translation)
+    
+    def sanitizer_for(self, language_code):
+        """Response sanitizer for a language, else for the model, else the default"""
+        return self.sanitizers.get(language_code) or self.sanitizers.get(MODEL_ID) or self.sanitizer
+    
+    def verify_translation(self, translated_text, original_text, language_code=None):
         """Clean and verify translation"""
-        english_indicators = [
-            "I'm sorry", "I apologize", "Here is the translation",
-            "Translated text", "Please note", "I cannot", "I would",
-            "Dear Valued Customer", "Best regards", "The Customer Service Team"
-        ]
-        
-        for phrase in english_indicators:
-            if phrase.lower() in translated_text.lower():
-                clean_lines = [line for line in translated_text.split('\n') 
-                              if not any(indicator.lower() in line.lower() 
-                                        for indicator in english_indicators)]
-                translated_text = '\n'.join(clean_lines)
+        return self.sanitizer_for(language_code).sanitize(translated_text, original_text, self.metrics)
+    
+    def is_passthrough(self, text, language_code=None):
+        """Check whether text is returned as-is without an API call (see SegmentClassifier)"""
+        return self.classifier.classify(text, language_code)[0] != 'translate'
+    
+    def set_document_glossary(self, texts, language_code):
+        """Collect the glossary entries used anywhere in a document, for the shared prompt prefix"""
+        terms = self.terminology_db.get(language_code, {})
+        used = set()
+        for text in texts:
+            for term in terms:
+                if term not in used and re.search(r'\b' + re.escape(term) + r'\b', text, re.IGNORECASE):
+                    used.add(term)
+        # Sorted so the prefix is byte-identical for every request of the document
+        self.document_glossary[language_code] = [f"{term} -> {terms[term]}" for term in sorted(used)]
+    
+    def build_prompt(self, text, target_language, language_code, context=None, is_footnote=False, batch=False):
+        """Return (static prefix, per-segment suffix) for one translation request
         
-        if not translated_text.strip() and original_text.strip():
-            return original_text
+        The prefix depends only on the document, language and footnote mode, so the provider can cache it.
+        """
+        if is_footnote:
+            sys_prompt = 'You are a translation engine specialized in footnotes. Translate the footnote text to the target language maintaining all formatting and academic/reference style. Return ONLY the translated text with no explanations, no English, and no comments.'
+            instructions = f'Translate the following footnote text to {target_language}. Maintain the scholarly and reference tone typical of footnotes. Return ONLY the translated footnote content. Keep all symbols, punctuation, and formatting exactly as they appear.'
+        else:
+            sys_prompt = f'You are a professional translation engine. Translate text from English to {target_language} maintaining all formatting. Return ONLY the translated text with no explanations, no English text, and no comments. Never apologize or explain your translation.'
+            if target_language == "Spanish":
+                instructions = f'Translate the following English text to {target_language}. Use neutral Spanish that is appropriate for technical/marketing documentation. Return ONLY the Spanish translation. Keep all symbols, punctuation, and formatting exactly as they appear. Do not add any explanations, English text, or comments before or after the translation.'
+            else:
+                instructions = f'Translate the following text to {target_language}. Return ONLY the translated content. Keep all symbols, punctuation, and formatting exactly as they appear. Do not add any explanations, English text, or comments before or after the translation.'
         
-        if not re.search(r'[a-zA-Z]', original_text) and len(original_text.strip()) < 3:
-            return original_text
+        prefix = sys_prompt + "\n\n" + instructions
+        prefix += "\n\nIMPORTANT: If the text contains only symbols, formatting characters, or no text at all (like '----', '***', etc.), do not translate or explain anything - just return those exact symbols."
+        prefix += "\n\nIMPORTANT: Keep every placeholder such as ⟦0⟧ exactly as it is, each one exactly once."
+        if batch:
+            prefix += ("\n\nIMPORTANT: The text is a numbered list of separate segments, each starting with a marker "
+                       "like [[1]]. Translate every segment on its own and start it with the same marker, "
+                       "in the same order. Do not merge, split or skip segments.")
+        
+        document_terms = self.document_glossary.get(language_code, [])
+        if document_terms:
+            prefix += f"\n\nIMPORTANT: Use the following terminology consistently:\n" + "\n".join(document_terms)
+        
+        # Terms of this segment that the document glossary does not already cover
+        potential_terms = []
+        if language_code in self.terminology_db:
+            for term in self.terminology_db[language_code].keys():
+                if re.search(r'\b' + re.escape(term) + r'\b', text, re.IGNORECASE):
+                    target_term = self.terminology_db[language_code][term]
+                    potential_terms.append(f"{term} -> {target_term}")
+        potential_terms = [entry for entry in potential_terms if entry not in document_terms]
+        
+        suffix = ""
+        if potential_terms:
+            suffix += f"IMPORTANT: Also use this terminology:\n" + "\n".join(potential_terms) + "\n\n"
+        
+        if context:
+            suffix += f"For consistency, here are some previous translations:\n{context}\n\n"
+        
+        suffix += f"Text to translate:\n{text}"
+        return prefix, suffix
+        
+    def build_request(self, prefix, suffix):
+        """Request body with the static prefix as a cacheable system block and the segment as the user turn"""
+        return {
+            "model": MODEL_ID,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [{"type": "text", "text": suffix}],
+                }
+            ],
+            "system": [{"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}}]
+        }
+    
+    def send_request(self, headers, data):
+        """POST one request body to the translation API and return the response"""
+        return self.session.post(API_URL, headers=headers, json=data, timeout=60)
+    
+    def send_hedged(self, headers, data):
+        """send_request, duplicated once if it is still running at the hedge delay; the first good answer wins"""
+        delay = self.hedge.delay() if self.hedge else None
+        if delay is None:
+            return self.send_request(headers, data)
+        # The primary gets its own thread so concurrency is never capped by the hedge pool
+        primary = Future()
+        primary.set_running_or_notify_cancel()
+        
+        def run_primary():
+            try:
+                primary.set_result(self.send_request(headers, data))
+            except BaseException as e:
+                primary.set_exception(e)
+        
+        threading.Thread(target=run_primary, daemon=True).start()
+        pending = {primary}
+        done, pending = wait(pending, timeout=delay)
+        if not done and self.hedge.try_spend():
+            # A hedge is extra load: send it only if the rate limiter has a slot free right now
+            if self.rate_limiter.try_acquire():
+                self.metrics.count('hedged')
+                self.progress.emit('request', 'debug', text=f"  ⇉ No answer after {delay:.1f}s, sending a hedge request",
+                                   hedge=True)
+                pending.add(self.hedge_pool.submit(self.send_request, headers, data))
+            else:
+                self.hedge.refund()
+        
+        # Prefer the first 200; otherwise report the last outcome once nothing is left running
+        outcome = None
+        while pending or done:
+            for future in done:
+                if future.exception() is None and future.result().status_code == 200:
+                    for other in pending:
+                        # Not-yet-started duplicates are dropped; a request in flight finishes unread
+                        other.cancel()
+                    if future is not primary:
+                        self.metrics.count('hedge_wins')
+                    return future.result()
+                outcome = future
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        return outcome.result()
+    
+    def record_usage(self, result):
+        """Add the token usage of one API response to the metrics"""
+        usage = result.get("usage") or {}
+        self.metrics.count('prompt_tokens', usage.get("prompt_tokens", usage.get("input_tokens", 0)))
+        self.metrics.count('completion_tokens', usage.get("completion_tokens", usage.get("output_tokens", 0)))
+        # Anthropic-style and OpenAI-style cache usage fields
+        cached = usage.get("cache_read_input_tokens",
+                           (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0))
+        self.metrics.count('cache_read_tokens', cached or 0)
+        self.metrics.count('cache_write_tokens', usage.get("cache_creation_input_tokens") or 0)
+    
+    def batch_chunks(self, texts, max_items=20, max_chars=6000):
+        """Split texts into groups small enough for one batched request"""
+        chunks, current, size = [], [], 0
+        for text in texts:
+            if current and (len(current) >= max_items or size + len(text) > max_chars):
+                chunks.append(current)
+                current, size = [], 0
+            current.append(text)
+            size += len(text)
+        if current:
+            chunks.append(current)
+        return chunks
+    
+    BATCH_MARKER = re.compile(r'\[\[(\d+)\]\][ \t]*')
+    
+    def translate_batch(self, texts, target_language, language_code, is_footnote=False):
+        """Translate several segments in one request as a numbered list; returns how many were translated
+        
+        Results go to translation memory. The request backs off and retries like translate_text; segments the
+        response does not return cleanly fall back to translate_text one by one, but a request that still
+        fails leaves the group untranslated rather than multiplying the load on a struggling API.
+        """
+        pending = [text for text in dict.fromkeys(texts)
+                   if text.strip() and not self.is_passthrough(text, language_code)
+                   and self.lookup_memory(text, language_code, record=False) is None]
+        if not pending:
+            return 0
+        if len(pending) == 1:
+            return int(self.translate_text(pending[0], target_language, language_code, is_footnote=is_footnote)
+                       != pending[0])
+        
+        masked = [self.mask(text) for text in pending]
+        numbered = "\n".join(f"[[{i}]] {masked_text.strip()}" for i, (masked_text, _) in enumerate(masked, 1))
+        self.progress.emit('segment', 'debug', text=f"Translating batch of {len(pending)} segments")
+        
+        translated, failed = 0, []
+        pieces = {}
+        with self.stats_lock:
+            self.total_attempts += 1
+        prefix, suffix = self.build_prompt(numbered, target_language, language_code, None, is_footnote, batch=True)
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f'Bearer {API_KEY}'
+        }
+        response, _, _ = self.send_with_retries(headers, self.build_request(prefix, suffix))
+        if response is None or response.status_code != 200:
+            with self.stats_lock:
+                self.consecutive_failures += 1
+            self.progress.message(f"  ⚠ Batch request failed; {len(pending)} segments left untranslated")
+            return 0
+        try:
+            result = response.json()
+            self.record_usage(result)
+            content = result["choices"][0]["message"]["content"]
+            parts = self.BATCH_MARKER.split(content)
+            # parts: [preamble, number, text, number, text, ...]
+            for number, piece in zip(parts[1::2], parts[2::2]):
+                pieces.setdefault(int(number), piece.strip())
+            with self.stats_lock:
+                self.total_successes += 1
+                self.consecutive_failures = 0
+        except Exception as e:
+            self.progress.message(f"  ⚠ Batch response could not be read: {str(e)[:100]}")
+        
+        for i, (text, (masked_text, values)) in enumerate(zip(pending, masked), 1):
+            piece = pieces.get(i)
+            if piece:
+                piece = self.apply_terminology(self.verify_translation(piece, masked_text, language_code),
+                                               language_code)
+                restored = self.masker.unmask(piece, values)
+                if restored is not None and piece.strip():
+                    self.remember(self.memory_key(text), piece, language_code)
+                    translated += 1
+                    continue
+            failed.append(text)
+        
+        if failed:
+            self.progress.message(f"  ⚠ {len(failed)} of {len(pending)} batched segments came back incomplete. "
+                                  f"Translating them one by one...")
+            for text in failed:
+                context = self.collect_context(text, language_code)
+                if self.translate_text(text, target_language, language_code, context, is_footnote) != text:
+                    translated += 1
+        return translated
+    
+    def estimate_cost(self, text, is_footnote=False):
+        """Expected seconds to translate text, from the observed seconds per character of its kind"""
+        with self.stats_lock:
+            history = list(self.cost_history.get('footnote' if is_footnote else 'body') or [0, 0.0])
+            if not history[0]:
+                # No history yet: fall back to all kinds, then to plain length
+                history = [sum(entry[0] for entry in self.cost_history.values()),
+                           sum(entry[1] for entry in self.cost_history.values())]
+        seconds_per_char = history[1] / history[0] if history[0] else 1.0
+        return len(text) * seconds_per_char
+    
+    def send_with_retries(self, headers, data, max_retries=3, retry_count=0):
+        """POST one request with rate limiting, backing off and retrying on 429, 502, other errors and timeouts
+        
+        Returns (response, attempt index, seconds) for a 200 or 401 response, or (None, max_retries, 0.0)
+        once the attempts are used up. retry_count continues a count the caller has started.
+        """
+        retry_delay = 5  # Increased from 3 to reduce request frequency
+        while retry_count < max_retries:
+            try:
+                if retry_count:
+                    self.metrics.count('retries')
+                # Rate limiting: minimum interval between API calls (shared across workers in batch mode)
+                self.rate_limiter.wait(lambda wait_time: self.progress.emit(
+                    'rate_limit', 'debug', text=f"  ⏳ Rate limiting: waiting {wait_time:.1f}s...", seconds=wait_time))
+                self.progress.emit('request', 'debug', text=f"  → API request (attempt {retry_count + 1}/{max_retries})",
+                                   attempt=retry_count + 1)
+                request_start = time.perf_counter()
+                try:
+                    response = self.send_hedged(headers, data)
+                except Exception:
+                    self.metrics.observe_request('error', time.perf_counter() - request_start)
+                    raise
+                elapsed = time.perf_counter() - request_start
+                self.metrics.observe_request(response.status_code, elapsed)
+                
+                if response.status_code == 200:
+                    if self.hedge:
+                        self.hedge.observe(elapsed)
+                    return response, retry_count, elapsed
+                
+                elif response.status_code == 502:
+                    # Handle 502 errors with longer delays (from 4.0 version)
+                    retry_count += 1
+                    self.progress.message(f"  ⚠ Server error (502). Retry attempt {retry_count}/{max_retries} in {retry_delay:.1f}s...")
+                    if retry_count < max_retries:
+                        time.sleep(retry_delay)
+                        retry_delay *= 1.5  # More aggressive delay increase for 502 errors
+                    continue
+                
+                elif response.status_code == 429:
+                    retry_count += 1
+                    self.metrics.count('rate_limited')
+                    self.progress.message(f"  ⚠ Rate limit exceeded. Retrying in {retry_delay * 2:.1f}s...")
+                    if retry_count < max_retries:
+                        time.sleep(retry_delay * 2)  # Longer delay for rate limits
+                        retry_delay *= 1.5
+                    continue
+                
+                elif response.status_code == 401:
+                    self.progress.message(f"  ✗ Authentication failed (401). Check API key.")
+                    return response, retry_count, elapsed
+                
+                else:
+                    # Handle other HTTP errors with shorter delays (from 4.0 version)
+                    retry_count += 1
+                    shorter_delay = retry_delay / 2
+                    self.progress.message(f"  ⚠ HTTP {response.status_code} error. Retry attempt {retry_count}/{max_retries} in {shorter_delay:.1f}s...")
+                    if retry_count < max_retries:
+                        time.sleep(shorter_delay)
+                    continue
             
-        return translated_text
+            except requests.exceptions.ConnectionError as e:
+                retry_count += 1
+                self.progress.message(f"  ✗ Network connection failed: {str(e)[:100]}...")
+                if retry_count < max_retries:
+                    self.progress.message(f"  ⏳ Retrying in {retry_delay:.1f}s...")
+                    time.sleep(retry_delay)
+                    retry_delay *= 1.5
+                continue
+            
+            except requests.exceptions.Timeout as e:
+                retry_count += 1
+                self.progress.message(f"  ✗ Request timeout: {str(e)[:100]}...")
+                if retry_count < max_retries:
+                    self.progress.message(f"  ⏳ Retrying in {retry_delay:.1f}s...")
+                    time.sleep(retry_delay)
+                    retry_delay *= 1.3
+                continue
+            
+            except requests.exceptions.RequestException as e:
+                retry_count += 1
+                self.progress.message(f"  ✗ Request error: {str(e)[:100]}...")
+                if retry_count < max_retries:
+                    self.progress.message(f"  ⏳ Retrying in {retry_delay:.1f}s...")
+                    time.sleep(retry_delay)
+                    retry_delay *= 1.5  # Increased from 1.4 to reduce request frequency
+                continue
+            
+            except Exception as e:
+                retry_count += 1
+                self.progress.message(f"  ✗ Unexpected error: {str(e)[:100]}...")
+                if retry_count < max_retries:
+                    self.progress.message(f"  ⏳ Retrying in {retry_delay:.1f}s...")
+                    time.sleep(retry_delay)
+                    retry_delay *= 1.5  # Increased from 1.2
+                continue
+        return None, max_retries, 0.0
     
     def translate_text(self, text, target_language, language_code, context=None, is_footnote=False):
         """Translate text using API with context and terminology support"""
         if not text.strip():
             return ""
         
-        # Skip Chinese content
-        chinese_char_count = len(re.findall(r'[\u4e00-\u9fff]', text))
-        text_length = len(text.strip())
-        if chinese_char_count > 0 and chinese_char_count / text_length > 0.1:
+        if self.is_passthrough(text, language_code):
             return text
 
         # Check translation memory
-        memory_key = text.strip().lower()
-        if memory_key in self.translation_memory:
-            return self.translation_memory[memory_key]
+        memory_key = self.memory_key(text)
+        # Callers have already looked this text up; do not count it twice
+        remembered = self.lookup_memory(text, language_code, record=False)
+        if remembered is not None:
+            return remembered
+        
+        if self.offline:
+            # Shard workers may not call the API; the parent translates what they report
+            self.offline_misses.append(text)
+            return text
         
         # Show translation progress (simplified for clean version)
         text_preview = text[:50] + "..." if len(text) > 50 else text
-        print(f"Translating: {text_preview}")
+        self.progress.emit('segment', 'debug', text=f"Translating: {text_preview}")
         
         # Enhanced consecutive failures check with rate limiting protection
         if self.consecutive_failures >= 5:  # Reduced threshold from 10 to 5 for faster intervention
@@ -183,182 +1344,94 @@ class TranslationManager:
                 print(f"Implementing {cooling_period}s cooling-off period to avoid rate limits...")
                 time.sleep(cooling_period)
             
-            user_choice = input("Continue translation? (y/n): ").strip().lower()
-            if user_choice != 'y':
-                print("Translation stopped by user.")
-                return text
+            if not self.interactive:
+                print("Continuing automatically (non-interactive mode).")
+                with self.stats_lock:
+                    self.consecutive_failures = 0
             else:
-                self.consecutive_failures = 0  # Reset counter if user chooses to continue
-        
-        # Extract terminology for context
-        potential_terms = []
-        if language_code in self.terminology_db:
-            for term in self.terminology_db[language_code].keys():
-                if re.search(r'\b' + re.escape(term) + r'\b', text, re.IGNORECASE):
-                    target_term = self.terminology_db[language_code][term]
-                    potential_terms.append(f"{term} -> {target_term}")
+                user_choice = input("Continue translation? (y/n): ").strip().lower()
+                if user_choice != 'y':
+                    print("Translation stopped by user.")
+                    return text
+                else:
+                    with self.stats_lock:
+                        self.consecutive_failures = 0  # Reset counter if user chooses to continue
         
         try:
-            if len(text.strip()) < 3 and not re.search(r'[a-zA-Z]', text):
-                return text
-            
-            # Build prompt
-            if is_footnote:
-                sys_prompt = 'You are a translation engine specialized in footnotes. Translate the footnote text to the target language maintaining all formatting and academic/reference style. Return ONLY the translated text with no explanations, no English, and no comments.'
-                user_prompt = f'Translate the following footnote text to {target_language}. Maintain the scholarly and reference tone typical of footnotes. Return ONLY the translated footnote content. Keep all symbols, punctuation, and formatting exactly as they appear.'
-            else:
-                sys_prompt = f'You are a professional translation engine. Translate text from English to {target_language} maintaining all formatting. Return ONLY the translated text with no explanations, no English text, and no comments. Never apologize or explain your translation.'
-                if target_language == "Spanish":
-                    user_prompt = f'Translate the following English text to {target_language}. Use neutral Spanish that is appropriate for technical/marketing documentation. Return ONLY the Spanish translation. Keep all symbols, punctuation, and formatting exactly as they appear. Do not add any explanations, English text, or comments before or after the translation.'
-                else:
-                    user_prompt = f'Translate the following text to {target_language}. Return ONLY the translated content. Keep all symbols, punctuation, and formatting exactly as they appear. Do not add any explanations, English text, or comments before or after the translation.'
-            
-            user_prompt += "\n\nIMPORTANT: If the text contains only symbols, formatting characters, or no text at all (like '----', '***', etc.), do not translate or explain anything - just return those exact symbols."
-            
-            if potential_terms:
-                user_prompt += f"\n\nIMPORTANT: Use the following terminology consistently:\n" + "\n".join(potential_terms)
-            
-            if context:
-                user_prompt += f"\n\nFor consistency, here are some previous translations:\n{context}\n\n"
-            
-            user_prompt += f"\nText to translate:\n{text}"
+            masked_text, mask_values = self.mask(text)
+            prefix, suffix = self.build_prompt(masked_text, target_language, language_code, context, is_footnote)
+            self.metrics.count('context_hits' if context else 'context_misses')
             
             # Request data
-            data = {
-                "model": MODEL_ID,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": [{"type": "text", "text": user_prompt}],
-                    }
-                ],
-                "system": sys_prompt
-            }
+            data = self.build_request(prefix, suffix)
             
             headers = {
                 'Content-Type': 'application/json',
                 'Authorization': f'Bearer {API_KEY}'
             }
             
-            # Rate limiting: Ensure minimum interval between API calls
-            min_interval = 1.0  # Minimum 1 second between API calls
-            time_since_last_call = time.time() - self.last_api_call_time
-            if time_since_last_call < min_interval:
-                wait_time = min_interval - time_since_last_call
-                print(f"  ⏳ Rate limiting: waiting {wait_time:.1f}s...")
-                time.sleep(wait_time)
-            
             # API request with enhanced retry logic (adopted from 4.0 version)
             max_retries = 3  # Reduced from 5 to minimize API call frequency
-            retry_delay = 5  # Increased from 3 to reduce request frequency
             retry_count = 0
-            self.total_attempts += 1
+            with self.stats_lock:
+                self.total_attempts += 1
 
             while retry_count < max_retries:
+                response, retry_count, elapsed = self.send_with_retries(headers, data, max_retries, retry_count)
+                if response is None:
+                    break
+                if response.status_code == 401:
+                    with self.stats_lock:
+                        self.consecutive_failures += 1
+                    return text
+                with self.stats_lock:
+                    history = self.cost_history.setdefault('footnote' if is_footnote else 'body', [0, 0.0])
+                    history[0] += len(text)
+                    history[1] += elapsed
+                
                 try:
-                    print(f"  → API request (attempt {retry_count + 1}/{max_retries})")
-                    self.last_api_call_time = time.time()  # Record API call time
-                    response = requests.post(API_URL, headers=headers, json=data, timeout=60)
+                    result = response.json()
+                    translated_text = result["choices"][0]["message"]["content"]
+                except Exception as e:
+                    retry_count += 1
+                    self.progress.message(f"  ✗ Unreadable response: {str(e)[:100]}...")
+                    continue
+                self.progress.emit('segment', 'debug', text="  ✓ Translation successful", status='done')
+                self.record_usage(result)
                     
-                    if response.status_code == 200:
-                        result = response.json()
-                        translated_text = result["choices"][0]["message"]["content"]
-                        print(f"  ✓ Translation successful")
+                # Clean and verify translation
+                translated_text = self.verify_translation(translated_text, text, language_code)
                         
-                        # Clean and verify translation
-                        translated_text = self.verify_translation(translated_text, text)
-                        explanation_patterns = [
-                            r'^(I\'m sorry|I apologize|Sorry|Note|Please note).*?\n\n',
-                            r'\n\n(I\'m sorry|I apologize|Sorry|Note|Please note).*?$',
-                            r'^(Here is|Here\'s|The following is|This is) the translation.*?\n\n',
-                            r'^Translated text:.*?\n\n'
-                        ]
-                        
-                        for pattern in explanation_patterns:
-                            translated_text = re.sub(pattern, '', translated_text, flags=re.IGNORECASE | re.DOTALL)
+                # Apply terminology
+                translated_text = self.apply_terminology(translated_text, language_code)
 
-                        # Apply terminology
-                        translated_text = self.apply_terminology(translated_text, language_code)
-                        
-                        # Store in memory
-                        self.translation_memory[memory_key] = translated_text
-                        
-                        # Update success counters
-                        self.total_successes += 1
-                        self.consecutive_failures = 0  # Reset consecutive failures on success
-                        
-                        return translated_text
-                    
-                    elif response.status_code == 502:
-                        # Handle 502 errors with longer delays (from 4.0 version)
-                        retry_count += 1
-                        print(f"  ⚠ Server error (502). Retry attempt {retry_count}/{max_retries} in {retry_delay:.1f}s...")
-                        if retry_count < max_retries:
-                            time.sleep(retry_delay)
-                            retry_delay *= 1.5  # More aggressive delay increase for 502 errors
-                        continue
-                    
-                    elif response.status_code == 429:
-                        retry_count += 1
-                        print(f"  ⚠ Rate limit exceeded. Retrying in {retry_delay * 2:.1f}s...")
-                        if retry_count < max_retries:
-                            time.sleep(retry_delay * 2)  # Longer delay for rate limits
-                            retry_delay *= 1.5
-                        continue
-                        
-                    elif response.status_code == 401:
-                        print(f"  ✗ Authentication failed (401). Check API key.")
-                        self.consecutive_failures += 1
-                        return text
-                        
-                    else:
-                        # Handle other HTTP errors with shorter delays (from 4.0 version)
-                        retry_count += 1
-                        shorter_delay = retry_delay / 2
-                        print(f"  ⚠ HTTP {response.status_code} error. Retry attempt {retry_count}/{max_retries} in {shorter_delay:.1f}s...")
-                        if retry_count < max_retries:
-                            time.sleep(shorter_delay)
-                        continue
-                        
-                except requests.exceptions.ConnectionError as e:
+                # Restore placeholders; if the model dropped or duplicated one, ask again without masking
+                restored = self.masker.unmask(translated_text, mask_values)
+                if restored is None:
                     retry_count += 1
-                    print(f"  ✗ Network connection failed: {str(e)[:100]}...")
-                    if retry_count < max_retries:
-                        print(f"  ⏳ Retrying in {retry_delay:.1f}s...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 1.5
+                    self.progress.message("  ⚠ Placeholders were not preserved. Retrying without masking...")
+                    masked_text, mask_values = text, []
+                    data = self.build_request(*self.build_prompt(text, target_language, language_code,
+                                                                 context, is_footnote))
                     continue
                     
-                except requests.exceptions.Timeout as e:
-                    retry_count += 1
-                    print(f"  ✗ Request timeout: {str(e)[:100]}...")
-                    if retry_count < max_retries:
-                        print(f"  ⏳ Retrying in {retry_delay:.1f}s...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 1.3
-                    continue
+                # Store in memory (masked, so other numbers/URLs share the entry)
+                if not mask_values:  # Literal translation: mask it for storage if the text has values
+                    translated_text = self.masker.mask_translation(restored, self.mask(text)[1])
+                if translated_text is not None:
+                    self.remember(memory_key, translated_text, language_code)
                     
-                except requests.exceptions.RequestException as e:
-                    retry_count += 1
-                    print(f"  ✗ Request error: {str(e)[:100]}...")
-                    if retry_count < max_retries:
-                        print(f"  ⏳ Retrying in {retry_delay:.1f}s...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 1.5  # Increased from 1.4 to reduce request frequency
-                    continue
+                # Update success counters
+                with self.stats_lock:
+                    self.total_successes += 1
+                    self.consecutive_failures = 0  # Reset consecutive failures on success
                     
-                except Exception as e:
-                    retry_count += 1
-                    print(f"  ✗ Unexpected error: {str(e)[:100]}...")
-                    if retry_count < max_retries:
-                        print(f"  ⏳ Retrying in {retry_delay:.1f}s...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 1.5  # Increased from 1.2
-                    continue
+                return restored
 
             # All retries failed - enhanced error reporting
-            print(f"  ❌ Translation failed after {max_retries} attempts for text: '{text[:50]}...'. Using original text.")
-            self.consecutive_failures += 1
+            self.progress.message(f"  ❌ Translation failed after {max_retries} attempts for text: '{text[:50]}...'. Using original text.")
+            with self.stats_lock:
+                self.consecutive_failures += 1
             return text
 
         except Exception:
@@ -367,14 +1440,148 @@ class TranslationManager:
     def clear_memory(self):
         """Clear translation memory"""
         self.translation_memory = {}
-        self.consecutive_failures = 0
-        self.total_attempts = 0
-        self.total_successes = 0
-        self.last_api_call_time = 0  # Reset API call timing
+        with self.stats_lock:
+            self.consecutive_failures = 0
+            self.total_attempts = 0
+            self.total_successes = 0
+
+class TranslationPlan:
+    """Flat table of (location, text) segments extracted before any API call"""
+    def __init__(self):
+        self.segments = []   # (location, text) in document order
+        self.unique = {}     # memory key -> (first source text, first location)
+    
+    def add(self, location, text, key):
+        """Record a segment and register its text for deduplication"""
+        self.segments.append((location, text))
+        if key not in self.unique:
+            self.unique[key] = (text, location)
+    
+    @property
+    def total_count(self):
+        return len(self.segments)
+    
+    @property
+    def unique_count(self):
+        return len(self.unique)
+    
+    @property
+    def dedup_ratio(self):
+        """Share of segments served by another occurrence of the same text"""
+        if not self.segments:
+            return 0.0
+        return 1 - self.unique_count / self.total_count
+    
+    def summary(self):
+        return (f"{self.total_count} segments, {self.unique_count} unique "
+                f"({self.dedup_ratio:.1%} duplicates)")
+
+class PackageWriter:
+    """Zip writer for .docx packages: raw passthrough of unchanged members, parallel deflate of modified ones"""
+    # Media that is already compressed gains nothing from deflate
+    STORED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'webp', 'wdp', 'mp3', 'mp4', 'm4a', 'mov', 'zip', 'gz'}
+    
+    def __init__(self, output_path, compresslevel=6, max_workers=None):
+        self.output_path = output_path
+        self.compresslevel = compresslevel
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1)
+        self.entries = []
+    
+    def copy_raw(self, source_zip, info):
+        """Queue a member whose compressed bytes are copied unchanged from source_zip"""
+        self.entries.append({
+            'name': info.filename, 'method': info.compress_type, 'date_time': info.date_time,
+            'external_attr': info.external_attr, 'crc': info.CRC,
+            'compress_size': info.compress_size, 'file_size': info.file_size,
+            'source': (source_zip, info),
+        })
+    
+    def add(self, name, data, date_time=None, external_attr=None):
+        """Queue a modified member; deflate runs in the background (zlib releases the GIL)"""
+        extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+        method = zipfile.ZIP_STORED if extension in self.STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        self.entries.append({
+            'name': name, 'method': method, 'date_time': date_time or time.localtime()[:6],
+            'external_attr': (0o600 << 16) if external_attr is None else external_attr,
+            'future': self.executor.submit(self._compress, data, method),
+        })
+    
+    def _compress(self, data, method):
+        """Return (crc, compressed bytes, uncompressed size) for a member"""
+        if method == zipfile.ZIP_STORED:
+            return zlib.crc32(data), data, len(data)
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        return zlib.crc32(data), compressor.compress(data) + compressor.flush(), len(data)
+    
+    def _copy_raw_bytes(self, source_zip, info, out):
+        """Copy the compressed payload of a member straight from the source archive"""
+        fp = source_zip.fp
+        fp.seek(info.header_offset)
+        header = fp.read(30)
+        if header[:4] != b'PK\x03\x04':
+            raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        fp.seek(info.header_offset + 30 + name_length + extra_length)
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = fp.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated data for {info.filename}")
+            out.write(chunk)
+            remaining -= len(chunk)
+    
+    def close(self):
+        """Write all queued members and the central directory"""
+        try:
+            central_directory = []
+            with open(self.output_path, 'wb') as out:
+                for entry in self.entries:
+                    if 'future' in entry:
+                        entry['crc'], payload, entry['file_size'] = entry['future'].result()
+                        entry['compress_size'] = len(payload)
+                    
+                    offset = out.tell()
+                    if max(offset, entry['compress_size'], entry['file_size']) > 0xFFFFFFFF or len(self.entries) > 0xFFFF:
+                        raise zipfile.LargeZipFile("Package requires ZIP64")
+                    
+                    name = entry['name'].encode('utf-8')
+                    flags = 0x800 if not entry['name'].isascii() else 0
+                    year, month, day, hour, minute, second = entry['date_time']
+                    dos_date = (max(year, 1980) - 1980) << 9 | month << 5 | day
+                    dos_time = hour << 11 | minute << 5 | second // 2
+                    fields = (20, flags, entry['method'], dos_time, dos_date,
+                              entry['crc'], entry['compress_size'], entry['file_size'], len(name))
+                    
+                    out.write(struct.pack('<4s5H3L2H', b'PK\x03\x04', *fields, 0))
+                    out.write(name)
+                    if 'future' in entry:
+                        out.write(payload)
+                    else:
+                        self._copy_raw_bytes(*entry['source'], out)
+                    
+                    central_directory.append(struct.pack('<4sH5H3L5H2L', b'PK\x01\x02', 20, *fields,
+                                                         0, 0, 0, 0, entry['external_attr'], offset) + name)
+                
+                directory_offset = out.tell()
+                for record in central_directory:
+                    out.write(record)
+                directory_size = out.tell() - directory_offset
+                out.write(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, len(central_directory),
+                                      len(central_directory), directory_size, directory_offset, 0))
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
 
 class DocumentProcessor:
     def __init__(self, translator):
         self.translator = translator
+        self.clone_run_xml = True  # Copy raw w:rPr instead of python-docx property round-trips
+        self.coalesce_adjacent_runs = True  # Merge identically formatted runs before translation
+        self.run_stats = {'before': 0, 'after': 0}
+        self._feature_cache = {}  # Feature index per (path, mtime, size)
+        self.shard_min_blocks = 200  # Smaller bodies are not worth the process round-trip
+        self.skip_counts = {}  # Pre-filter reason -> unique segments skipped by the last translate_plan
+        self.segment_workers = 1  # Concurrent API requests per plan; >1 dispatches longest segments first
+        self.batch_kinds = ('footnote', 'endnote')  # Segment kinds sent as numbered batches
     
     def capture_run_properties(self, run):
         """Capture all run properties with robust color handling"""
@@ -468,20 +1675,103 @@ class DocumentProcessor:
                 except Exception:
                     pass
         
-        return run
-
+        return run
+
+    def capture_run_rpr(self, run):
+        """Capture the raw w:rPr element of a run (fast path, keeps every property)"""
+        return run._r.rPr
+    
+    def apply_run_rpr(self, run, rpr):
+        """Deep-copy a captured w:rPr element onto a rebuilt run"""
+        run._r._remove_rPr()
+        if rpr is not None:
+            run._r.insert(0, copy.deepcopy(rpr))
+        return run
+    
+    def capture_run_formatting(self, run):
+        """Capture run formatting using the configured strategy"""
+        if self.clone_run_xml:
+            return self.capture_run_rpr(run)
+        return self.capture_run_properties(run)
+    
+    def apply_run_formatting(self, run, formatting):
+        """Apply run formatting captured by capture_run_formatting"""
+        if self.clone_run_xml:
+            return self.apply_run_rpr(run, formatting)
+        return self.apply_run_properties(run, formatting)
+    
+    def _run_merge_key(self, run):
+        """Return the formatting key of a text-only run, or None if the run must not be merged"""
+        w = f'{{{W_NS}}}'
+        rpr = None
+        for child in run:
+            if child.tag == w + 'rPr':
+                rpr = child
+            elif child.tag != w + 't':
+                return None
+        return etree.tostring(rpr) if rpr is not None else b''
+    
+    @staticmethod
+    def split_proportionally(translation, lengths):
+        """Cut a translation into pieces sized like the original runs (the last piece takes the rest)"""
+        total = sum(lengths)
+        if not total:
+            return [translation] + [''] * (len(lengths) - 1)
+        pieces, start = [], 0
+        for i, length in enumerate(lengths):
+            end = len(translation) if i == len(lengths) - 1 \
+                else min(start + round(len(translation) * length / total), len(translation))
+            pieces.append(translation[start:end])
+            start = end
+        return pieces
+    
+    def coalesce_runs(self, p_element):
+        """Merge adjacent text-only runs with identical w:rPr in a w:p element"""
+        w = f'{{{W_NS}}}'
+        
+        # Spell-check markers split otherwise identical runs and carry no content
+        for proof_err in p_element.findall(w + 'proofErr'):
+            p_element.remove(proof_err)
+        
+        runs = p_element.findall(w + 'r')
+        self.run_stats['before'] += len(runs)
+        
+        previous, previous_key = None, None
+        for run in runs:
+            key = self._run_merge_key(run)
+            if key is not None and key == previous_key and run.getprevious() is previous:
+                texts = previous.findall(w + 't') + run.findall(w + 't')
+                merged_text = ''.join(t.text or '' for t in texts)
+                if texts:
+                    target = texts[0]
+                    if target.getparent() is not previous:
+                        previous.append(target)
+                    target.text = merged_text
+                    target.set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+                    for extra in previous.findall(w + 't')[1:]:
+                        previous.remove(extra)
+                p_element.remove(run)
+                continue
+            previous, previous_key = run, key
+        
+        self.run_stats['after'] += len(p_element.findall(w + 'r'))
+        return p_element
+    
     def process_paragraph(self, paragraph, target_language, language_code):
         """Process and translate paragraph with format preservation"""
         if not paragraph.text.strip():
             return paragraph
         
+        if self.coalesce_adjacent_runs:
+            self.coalesce_runs(paragraph._p)
+        
         # Store original formatting
         runs_formatting = []
         runs_text = []
         
         for run in paragraph.runs:
             runs_text.append(run.text)
-            runs_formatting.append(self.capture_run_properties(run))
+            runs_formatting.append(self.capture_run_formatting(run))
         
         if not runs_text:
             return paragraph
@@ -490,8 +1780,11 @@ class DocumentProcessor:
         text = paragraph.text
         
         if text.strip():
-            context = self.translator.collect_context(text, language_code)
-            translated_text = self.translator.translate_text(text, target_language, language_code, context)
+            # Write-back: translate_plan already counted this text's memory lookup
+            translated_text = self.translator.lookup_memory(text, language_code, record=False)
+            if translated_text is None:
+                context = self.translator.collect_context(text, language_code)
+                translated_text = self.translator.translate_text(text, target_language, language_code, context)
             
             if not translated_text or (translated_text == text and len(text.strip()) < 3 and not re.search(r'[a-zA-Z]', text)):
                 return paragraph
@@ -502,7 +1795,7 @@ class DocumentProcessor:
                 
                 if runs_formatting:
                     try:
-                        self.apply_run_properties(new_run, runs_formatting[0])
+                        self.apply_run_formatting(new_run, runs_formatting[0])
                     except Exception:
                         pass
         
@@ -511,16 +1804,415 @@ class DocumentProcessor:
     def process_table(self, table, target_language, language_code):
         """Process and translate table content"""
         try:
-            for row in table.rows:
-                for cell in row.cells:
-                    for para in cell.paragraphs:
-                        try:
-                            self.process_paragraph(para, target_language, language_code)
-                        except Exception:
-                            pass
+            for _, para in self.iter_table_paragraphs(table):
+                try:
+                    self.process_paragraph(para, target_language, language_code)
+                except Exception:
+                    pass
         except Exception:
             pass
     
+    def process_blocks(self, blocks, target_language, language_code):
+        """Translate top-level body blocks (w:p / w:tbl) in place; return (paragraph count, table count)"""
+        paragraph_count = table_count = 0
+        for block in blocks:
+            if block.tag == f'{{{W_NS}}}tbl':
+                self.process_table(Table(block, None), target_language, language_code)
+                table_count += 1
+            else:
+                paragraph = Paragraph(block, None)
+                if paragraph.text.strip():
+                    self.process_paragraph(paragraph, target_language, language_code)
+                    paragraph_count += 1
+        return paragraph_count, table_count
+    
+    def process_body_sharded(self, doc, target_language, language_code, workers):
+        """Split the body into contiguous shards, process them on worker processes and stitch them back in order"""
+        body = doc.element.body
+        blocks = [child for child in body if child.tag in (f'{{{W_NS}}}p', f'{{{W_NS}}}tbl')]
+        if len(blocks) < self.shard_min_blocks or workers < 2:
+            return self.process_blocks(blocks, target_language, language_code)
+        
+        # A few shards per worker keeps the pool busy when shard costs differ
+        shard_count = min(len(blocks), workers * 4)
+        shard_size = -(-len(blocks) // shard_count)
+        shards = [blocks[i:i + shard_size] for i in range(0, len(blocks), shard_size)]
+        options = (self.clone_run_xml, self.coalesce_adjacent_runs)
+        
+        paragraph_count = table_count = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_process_body_shard, [etree.tostring(block) for block in shard],
+                                   target_language, language_code, self.translator.translation_memory,
+                                   self.translator.terminology_db, options)
+                       for shard in shards]
+            redo = []
+            for shard, future in zip(shards, futures):
+                shard_xml, counts, run_stats, misses, metrics = future.result()
+                self.translator.metrics.merge(metrics)
+                if misses:
+                    # Shards never call the API; shards with misses are redone here, under the rate limit
+                    redo.append(shard)
+                    continue
+                for block, xml in zip(shard, shard_xml):
+                    body.replace(block, parse_xml(xml))
+                paragraph_count += counts[0]
+                table_count += counts[1]
+                self.run_stats['before'] += run_stats['before']
+                self.run_stats['after'] += run_stats['after']
+        for shard in redo:
+            counts = self.process_blocks(shard, target_language, language_code)
+            paragraph_count += counts[0]
+            table_count += counts[1]
+        return paragraph_count, table_count
+    
+    def iter_table_paragraphs(self, table, location=()):
+        """Yield (location, paragraph) for every paragraph in the table's cells"""
+        # Merged cells return the same w:tc for every grid position they span
+        seen_cells = set()
+        for r, row in enumerate(table.rows):
+            for c, cell in enumerate(row.cells):
+                if cell._tc in seen_cells:
+                    continue
+                seen_cells.add(cell._tc)
+                for p, para in enumerate(cell.paragraphs):
+                    yield location + (r, c, p), para
+    
+    def iter_header_footer_paragraphs(self, doc):
+        """Yield (location, paragraph) for header and footer paragraphs and tables"""
+        # Linked sections share one header/footer part; visit each part once
+        seen_parts = set()
+        for s, section in enumerate(doc.sections):
+            for kind, header_footer in (('header', section.header), ('footer', section.footer)):
+                if header_footer.part in seen_parts:
+                    continue
+                seen_parts.add(header_footer.part)
+                for p, para in enumerate(header_footer.paragraphs):
+                    yield (kind, s, p), para
+                for t, table in enumerate(header_footer.tables):
+                    yield from self.iter_table_paragraphs(table, (kind + '_table', s, t))
+    
+    def iter_document_paragraphs(self, doc, include_headers=True):
+        """Yield (location, paragraph) for body, table, header and footer paragraphs"""
+        for i, para in enumerate(doc.paragraphs):
+            yield ('body', i), para
+        for t, table in enumerate(doc.tables):
+            yield from self.iter_table_paragraphs(table, ('table', t))
+        if include_headers:
+            yield from self.iter_header_footer_paragraphs(doc)
+    
+    def is_translatable_note_text(self, text):
+        """Check whether a footnote/endnote w:t text is worth translating"""
+        return not (not text.strip() or
+                    len(text.strip()) < 3 or
+                    re.match(r'^[\d\s\.\-_]+$', text.strip()) or
+                    not re.search(r'[a-zA-Z]', text))
+    
+    def iter_note_paragraphs(self, root):
+        """Yield (note id, paragraph index, w:p, text) for the translatable paragraphs of a notes part"""
+        w = f'{{{W_NS}}}'
+        namespaces = {'w': W_NS}
+        for note in root:
+            # Separator and continuation notes are not real footnotes/endnotes
+            if note.tag not in (w + 'footnote', w + 'endnote') or note.get(w + 'type'):
+                continue
+            for i, p_element in enumerate(note.iter(w + 'p')):
+                text = ''.join(p_element.xpath('.//w:r/w:t/text()', namespaces=namespaces))
+                if self.is_translatable_note_text(text):
+                    yield note.get(w + 'id'), i, p_element, text
+    
+    def iter_note_segments(self, doc_path):
+        """Yield (location, text) for translatable footnote and endnote paragraphs"""
+        with zipfile.ZipFile(doc_path, 'r') as zip_ref:
+            file_list = zip_ref.namelist()
+            for file_path, note_type in [('word/footnotes.xml', 'footnote'), ('word/endnotes.xml', 'endnote')]:
+                if file_path not in file_list:
+                    continue
+                parser = etree.XMLParser(strip_cdata=False, recover=True)
+                root = etree.fromstring(zip_ref.read(file_path), parser)
+                for note_id, i, _, text in self.iter_note_paragraphs(root):
+                    yield (note_type, note_id, i), text
+    
+    def apply_note_translation(self, p_element, text, translation):
+        """Spread a note paragraph's translation over its text runs in proportion, keeping each run's markup"""
+        w = f'{{{W_NS}}}'
+        if self.coalesce_adjacent_runs:
+            self.coalesce_runs(p_element)
+        text_runs = [run for run in p_element.iter(w + 'r') if run.find(w + 't') is not None]
+        if not text_runs:
+            return False
+        leading = text[:len(text) - len(text.lstrip())]
+        trailing = text[len(text.rstrip()):]
+        run_texts = [run.findall(w + 't') for run in text_runs]
+        pieces = self.split_proportionally(leading + translation.strip() + trailing,
+                                           [sum(len(t.text or '') for t in texts) for texts in run_texts])
+        for run, texts, piece in zip(text_runs, run_texts, pieces):
+            for t in texts[1:]:
+                run.remove(t)
+            if piece:
+                texts[0].text = piece
+                texts[0].set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+                continue
+            run.remove(texts[0])
+            # Runs left with nothing but properties are dropped; note marks, tabs and breaks stay
+            if all(child.tag == w + 'rPr' for child in run):
+                run.getparent().remove(run)
+        return True
+    
+    def build_plan(self, doc, doc_path, include_notes=True, include_headers=True):
+        """Extract every segment of the document into a deduplicated TranslationPlan"""
+        plan = TranslationPlan()
+        for location, para in self.iter_document_paragraphs(doc, include_headers):
+            text = para.text
+            if text.strip():
+                plan.add(location, text, self.translator.memory_key(text))
+        
+        if include_notes:
+            try:
+                for location, text in self.iter_note_segments(doc_path):
+                    plan.add(location, text, self.translator.memory_key(text))
+            except Exception as e:
+                print(f"  ⚠ Could not extract footnotes: {str(e)[:100]}")
+        
+        return plan
+    
+    def paragraph_segments(self, doc, include_headers=True):
+        """(location, text) of every non-empty body, table, header and footer paragraph"""
+        return [(location, para.text) for location, para in self.iter_document_paragraphs(doc, include_headers)
+                if para.text.strip()]
+    
+    def build_carry_over(self, previous_source, previous_output, report):
+        """Map memory keys of the unchanged paragraphs in a revision diff to their previous translations"""
+        # Raw indices differ (preserve_images adds image paragraphs to the output), so the text paragraphs
+        # of each area (body, table cell, header...) are paired in order, and only when their counts agree
+        source_areas, output_areas = {}, {}
+        for areas, path in ((source_areas, previous_source), (output_areas, previous_output)):
+            for location, text in self.paragraph_segments(docx.Document(path)):
+                areas.setdefault(location[:-1], []).append((location, text))
+        translated = {}
+        for area, segments in source_areas.items():
+            outputs = output_areas.get(area, [])
+            if len(outputs) != len(segments):
+                self.translator.progress.message(f"  ⚠ Previous output does not line up with its source in "
+                                                 f"{'/'.join(map(str, area))}; not carrying it over")
+                continue
+            translated.update((location, output_text) for (location, _), (_, output_text) in zip(segments, outputs))
+        
+        unchanged = set(report['unchanged_locations'])
+        carry_over = {}
+        for location, text in (segment for segments in source_areas.values() for segment in segments):
+            # Only paragraphs the diff aligned as equal; output == source means that translation had failed
+            if location in unchanged and location in translated and translated[location] != text:
+                # Memory holds masked translations
+                masked_translation = self.translator.masker.mask_translation(translated[location],
+                                                                             self.translator.mask(text)[1])
+                if masked_translation is not None:
+                    carry_over.setdefault(self.translator.memory_key(text), masked_translation)
+        return carry_over
+    
+    def diff_revisions(self, previous_source, input_file):
+        """Align the paragraphs of two source revisions by content hash and order"""
+        old_segments = self.paragraph_segments(docx.Document(previous_source))
+        new_segments = self.paragraph_segments(docx.Document(input_file))
+        old_keys = [self.translator.memory_key(text) for _, text in old_segments]
+        new_keys = [self.translator.memory_key(text) for _, text in new_segments]
+        
+        report = {'unchanged': 0, 'modified': 0, 'inserted': 0, 'deleted': 0, 'changes': [],
+                  'unchanged_locations': []}  # Locations in the previous source
+        matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                report['unchanged'] += i2 - i1
+                report['unchanged_locations'].extend(location for location, _ in old_segments[i1:i2])
+                continue
+            if tag == 'replace':
+                paired = min(i2 - i1, j2 - j1)
+                report['modified'] += paired
+                report['deleted'] += (i2 - i1) - paired
+                report['inserted'] += (j2 - j1) - paired
+                for k in range(paired):
+                    report['changes'].append(('modified', new_segments[j1 + k][0],
+                                              old_segments[i1 + k][1], new_segments[j1 + k][1]))
+                old_rest, new_rest = range(i1 + paired, i2), range(j1 + paired, j2)
+            else:
+                old_rest, new_rest = range(i1, i2), range(j1, j2)
+                report['deleted' if tag == 'delete' else 'inserted'] += (i2 - i1) + (j2 - j1)
+            for i in old_rest:
+                report['changes'].append(('deleted', old_segments[i][0], old_segments[i][1], ''))
+            for j in new_rest:
+                report['changes'].append(('inserted', new_segments[j][0], '', new_segments[j][1]))
+        return report
+    
+    def write_change_report(self, report, report_path):
+        """Write a plain-text change report of a revision diff"""
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(f"Unchanged: {report['unchanged']}  Modified: {report['modified']}  "
+                    f"Inserted: {report['inserted']}  Deleted: {report['deleted']}\n\n")
+            for kind, location, old_text, new_text in report['changes']:
+                f.write(f"[{kind}] {'/'.join(str(part) for part in location)}\n")
+                if old_text:
+                    f.write(f"  - {old_text}\n")
+                if new_text:
+                    f.write(f"  + {new_text}\n")
+    
+    def translate_plan(self, plan, target_language, language_code):
+        """Translate each unique text of a plan once; the stages then fan results out from memory"""
+        translated = 0
+        self.skip_counts = {}
+        pending = [(text, location) for text, location in plan.unique.values()
+                   if self.translator.lookup_memory(text, language_code) is None]
+        self.translator.set_document_glossary([text for text, _ in plan.unique.values()], language_code)
+        progress = self.translator.progress
+        progress.begin(len(pending), sum(len(text) for text, _ in pending), language=target_language)
+        work, batches = [], {}
+        for text, location in pending:
+            decision, reason = self.translator.classifier.classify(text, language_code)
+            if decision != 'translate':
+                self.skip_counts[reason] = self.skip_counts.get(reason, 0) + 1
+                progress.advance(len(text))
+                continue
+            is_footnote = location[0] in ('footnote', 'endnote')
+            if location[0] in self.batch_kinds:
+                batches.setdefault(is_footnote, []).append(text)
+            else:
+                work.append(([text], is_footnote, False))
+        # Footnotes, endnotes and cell strings travel as numbered batches, one request per chunk
+        for is_footnote, texts in batches.items():
+            work += [(chunk, is_footnote, True) for chunk in self.translator.batch_chunks(texts)]
+        
+        def translate_one(texts, is_footnote, batched):
+            try:
+                if batched:
+                    return self.translator.translate_batch(texts, target_language, language_code, is_footnote)
+                context = self.translator.collect_context(texts[0], language_code)
+                self.translator.translate_text(texts[0], target_language, language_code, context, is_footnote)
+                return 1
+            except Exception as e:
+                # Not fatal (write-back translates what is missing), but never silent
+                self.translator.metrics.count('segment_errors')
+                progress.message(f"  ⚠ Segment translation failed: {type(e).__name__}: {str(e)[:100]}")
+                return 0
+            finally:
+                progress.advance(sum(len(text) for text in texts))
+        
+        if self.segment_workers <= 1 or len(work) <= 1:
+            return sum(translate_one(*item) for item in work)
+        
+        # Longest processing time first: expensive segments start early instead of straggling at the end.
+        # Results land in translation memory, so the stages still write them back in document order.
+        work.sort(key=lambda item: self.translator.estimate_cost(''.join(item[0]), item[1]), reverse=True)
+        interactive = self.translator.interactive
+        self.translator.interactive = False  # Workers cannot share one console prompt
+        try:
+            with ThreadPoolExecutor(max_workers=self.segment_workers) as executor:
+                futures = [executor.submit(translate_one, *item) for item in work]
+                translated = sum(future.result() for future in futures)
+        finally:
+            self.translator.interactive = interactive
+        return translated
+    
+    def estimate_plan(self, plan, target_language, language_code):
+        """Dry-run translate_plan: count requests, memory hits and tokens without calling the API"""
+        estimate = {'requests': 0, 'memory_hits': 0, 'skipped': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self.translator.set_document_glossary([text for text, _ in plan.unique.values()], language_code)
+        batches = {}
+        for key, (text, location) in plan.unique.items():
+            if self.translator.is_passthrough(text, language_code):
+                estimate['skipped'] += 1
+                continue
+            if self.translator.lookup_memory(text, language_code, record=False) is not None:
+                estimate['memory_hits'] += 1
+                continue
+            is_footnote = location[0] in ('footnote', 'endnote')
+            if location[0] in self.batch_kinds:
+                batches.setdefault(is_footnote, []).append(text)
+                continue
+            context = self.translator.collect_context(text, language_code)
+            prefix, suffix = self.translator.build_prompt(text, target_language, language_code, context, is_footnote)
+            # ~4 characters per token, as in describe_features
+            estimate['requests'] += 1
+            estimate['prompt_tokens'] += (len(prefix) + len(suffix)) // 4
+            estimate['completion_tokens'] += len(text) // 4 + 1
+            # Stand-in translation so later context lookups grow as they would in a real run
+            self.translator.translation_memory[key] = self.translator.mask(text)[0]
+        for is_footnote, texts in batches.items():
+            for chunk in self.translator.batch_chunks(texts):
+                numbered = "\n".join(f"[[{i}]] {text.strip()}" for i, text in enumerate(chunk, 1))
+                prefix, suffix = self.translator.build_prompt(numbered, target_language, language_code, None,
+                                                              is_footnote, batch=True)
+                estimate['requests'] += 1
+                estimate['prompt_tokens'] += (len(prefix) + len(suffix)) // 4
+                estimate['completion_tokens'] += len(numbered) // 4 + 1
+        return estimate
+    
+    def scan_package(self, doc_path):
+        """Build a feature index of the package in one streaming pass, without extracting anything"""
+        stat = os.stat(doc_path)
+        cache_key = (os.path.abspath(doc_path), stat.st_mtime_ns, stat.st_size)
+        if cache_key in self._feature_cache:
+            return self._feature_cache[cache_key]
+        
+        w = f'{{{W_NS}}}'
+        counted_tags = {
+            w + 'tbl': 'tables',
+            w + 'txbxContent': 'text_boxes',
+            w + 'footnoteReference': 'footnote_refs',
+            w + 'endnoteReference': 'endnote_refs',
+            w + 'footnote': 'footnotes',
+            w + 'endnote': 'endnotes',
+            w + 'p': 'paragraphs',
+        }
+        features = {
+            'parts': {}, 'headers': [], 'footers': [],
+            'images': 0, 'image_bytes': 0, 'text_chars': 0,
+        }
+        features.update(dict.fromkeys(counted_tags.values(), 0))
+        
+        with zipfile.ZipFile(doc_path, 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                name = info.filename
+                if name.startswith('word/media/'):
+                    features['images'] += 1
+                    features['image_bytes'] += info.file_size
+                    continue
+                
+                match = re.match(r'^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$', name)
+                if not match:
+                    continue
+                if match.group(1).startswith('header'):
+                    features['headers'].append(name)
+                elif match.group(1).startswith('footer'):
+                    features['footers'].append(name)
+                
+                part = dict.fromkeys(counted_tags.values(), 0)
+                part['text_chars'] = 0
+                with zip_ref.open(info) as stream:
+                    for _, elem in etree.iterparse(stream, events=('end',), tag=list(counted_tags) + [w + 't']):
+                        if elem.tag == w + 't':
+                            part['text_chars'] += len(elem.text or '')
+                            continue
+                        # Separator and continuation notes are not real footnotes/endnotes
+                        if elem.tag in (w + 'footnote', w + 'endnote') and elem.get(w + 'type'):
+                            continue
+                        part[counted_tags[elem.tag]] += 1
+                        if elem.tag == w + 'p':
+                            elem.clear()
+                
+                features['parts'][name] = part
+                for key, count in part.items():
+                    features[key] += count
+        
+        self._feature_cache[cache_key] = features
+        return features
+    
+    def describe_features(self, features):
+        """One-line summary of a feature index"""
+        body = features['parts'].get('word/document.xml', {})
+        return (f"{body.get('tables', 0)} tables, {features['footnotes']} footnotes, "
+                f"{features['endnotes']} endnotes, {features['text_boxes']} text boxes, "
+                f"{len(features['headers'])} headers, {len(features['footers'])} footers, "
+                f"{features['images']} images, {features['text_chars']} characters "
+                f"(~{features['text_chars'] // 4} tokens)")
+    
     def has_tables(self, doc):
         """Check if document contains tables"""
         return len(doc.tables) > 0
@@ -528,18 +2220,10 @@ class DocumentProcessor:
     def has_footnotes(self, doc_path):
         """Check if document contains footnotes"""
         try:
-            with zipfile.ZipFile(doc_path, 'r') as zip_ref:
-                file_list = zip_ref.namelist()
-                
-                has_footnote_files = any(f in file_list for f in ['word/footnotes.xml', 'word/endnotes.xml'])
-                
-                if has_footnote_files and 'word/document.xml' in file_list:
-                    doc_content = zip_ref.read('word/document.xml').decode('utf-8')
-                    has_footnote_refs = ('<w:footnoteReference' in doc_content or 
-                                       '<w:endnoteReference' in doc_content)
-                    return has_footnote_refs
-                
-                return False
+            features = self.scan_package(doc_path)
+            body = features['parts'].get('word/document.xml', {})
+            has_notes = features['footnotes'] + features['endnotes'] > 0
+            return has_notes and body.get('footnote_refs', 0) + body.get('endnote_refs', 0) > 0
         except Exception:
             return False
 
@@ -555,12 +2239,15 @@ class DocumentProcessor:
                 os.makedirs(original_dir, exist_ok=True)
                 os.makedirs(translated_dir, exist_ok=True)
                 
-                # Extract documents
+                # Extract only the parts this step reads or rewrites
+                note_parts = ['word/footnotes.xml', 'word/endnotes.xml',
+                              'word/_rels/footnotes.xml.rels', 'word/_rels/endnotes.xml.rels',
+                              'word/document.xml']
                 with zipfile.ZipFile(original_file, 'r') as zip_ref:
-                    zip_ref.extractall(original_dir)
+                    self._extract_parts(zip_ref, note_parts, original_dir)
                 
                 with zipfile.ZipFile(translated_file, 'r') as zip_ref:
-                    zip_ref.extractall(translated_dir)
+                    self._extract_parts(zip_ref, note_parts, translated_dir)
                 
                 # Process footnote files
                 footnote_files = [
@@ -578,47 +2265,37 @@ class DocumentProcessor:
                         continue
                     
                     try:
+                        os.makedirs(os.path.dirname(translated_footnote_path), exist_ok=True)
                         shutil.copy2(original_footnote_path, translated_footnote_path)
                         
                         parser = etree.XMLParser(strip_cdata=False, recover=True)
                         tree = etree.parse(translated_footnote_path, parser)
                         root = tree.getroot()
                         
-                        namespaces = {
-                            'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
-                        }
+                        # Whole note paragraphs; anything the plan did not cover is sent in batches
+                        paragraphs = list(self.iter_note_paragraphs(root))
+                        missing = [text for _, _, _, text in paragraphs
+                                   if self.translator.lookup_memory(text, language_code, record=False) is None]
+                        for chunk in self.translator.batch_chunks(list(dict.fromkeys(missing))):
+                            try:
+                                self.translator.translate_batch(chunk, target_language, language_code,
+                                                                is_footnote=True)
+                            except Exception:
+                                pass
                         
-                        text_elements = root.xpath('//w:t', namespaces=namespaces)
                         translations_made = 0
-                        
-                        import re
-                        for i, text_elem in enumerate(text_elements):
-                            if text_elem.text is None:
-                                continue
-                                
-                            original_text = text_elem.text
-                            
-                            if (not original_text.strip() or 
-                                len(original_text.strip()) < 3 or
-                                re.match(r'^[\d\s\.\-_]+$', original_text.strip()) or
-                                not re.search(r'[a-zA-Z]', original_text)):
-                                continue
-                            
+                        for _, _, p_element, original_text in paragraphs:
                             try:
-                                context = self.translator.collect_context(original_text, language_code)
-                                translated_text = self.translator.translate_text(
-                                    original_text, target_language, language_code, context, is_footnote=True
-                                )
-                                
-                                if translated_text != original_text and translated_text.strip():
-                                    text_elem.text = translated_text
-                                    translations_made += 1
-                                    
+                                translated_text = self.translator.lookup_memory(original_text, language_code,
+                                                                                record=False)
+                                if translated_text and translated_text.strip() != original_text.strip():
+                                    if self.apply_note_translation(p_element, original_text, translated_text):
+                                        translations_made += 1
                             except Exception:
                                 pass
                         
                         if translations_made > 0:
-                            print(f"Translated {translations_made} footnote texts.")
+                            print(f"Translated {translations_made} {note_type} paragraphs.")
                         
                         if translations_made > 0:
                             tree.write(translated_footnote_path, encoding='utf-8', xml_declaration=True, 
@@ -696,12 +2373,9 @@ class DocumentProcessor:
                 
                 # Repackage document
                 if total_translations > 0:
-                    with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=6) as docx_file:
-                        for root_dir, _, files in os.walk(translated_dir):
-                            for file in files:
-                                file_path = os.path.join(root_dir, file)
-                                arcname = os.path.relpath(file_path, translated_dir)
-                                docx_file.write(file_path, arcname)
+                    with zipfile.ZipFile(translated_file, 'r') as translated_zip:
+                        modified_parts = self._read_modified_parts(translated_zip, translated_dir, note_parts)
+                        self._repackage(translated_zip, output_file, modified_parts)
                     
                     return True
                 else:
@@ -715,16 +2389,7 @@ class DocumentProcessor:
     def has_text_boxes(self, doc_path):
         """Check if document contains text boxes"""
         try:
-            with zipfile.ZipFile(doc_path, 'r') as zip_ref:
-                xml_files = ['word/document.xml', 'word/header1.xml', 'word/header2.xml', 'word/header3.xml', 
-                            'word/footer1.xml', 'word/footer2.xml', 'word/footer3.xml']
-                
-                for xml_file in xml_files:
-                    if xml_file in zip_ref.namelist():
-                        content = zip_ref.read(xml_file).decode('utf-8')
-                        if '<w:txbxContent>' in content:
-                            return True
-                return False
+            return self.scan_package(doc_path)['text_boxes'] > 0
         except Exception:
             return False
 
@@ -738,37 +2403,34 @@ class DocumentProcessor:
                 os.makedirs(original_dir, exist_ok=True)
                 os.makedirs(translated_dir, exist_ok=True)
                 
-                # Extract both documents
-                with zipfile.ZipFile(input_file, 'r') as zip_ref:
-                    zip_ref.extractall(original_dir)
-                
-                with zipfile.ZipFile(translated_file, 'r') as zip_ref:
-                    zip_ref.extractall(translated_dir)
-                
-                # Copy media folder
-                original_media_dir = os.path.join(original_dir, "word", "media")
-                translated_media_dir = os.path.join(translated_dir, "word", "media")
-                
-                if os.path.exists(original_media_dir):
-                    if os.path.exists(translated_media_dir):
-                        shutil.rmtree(translated_media_dir)
-                    
-                    shutil.copytree(original_media_dir, translated_media_dir)
-                
-                # Process relationships and content types
-                self._process_document_relationships(original_dir, translated_dir)
-                self._process_document_content_types(original_dir, translated_dir)
-                self._process_document_structure(original_dir, translated_dir)
-                
-                # Repackage document
+                # Only these parts are edited; media is copied raw from the original package
+                xml_parts = ['word/_rels/document.xml.rels', '[Content_Types].xml', 'word/document.xml']
                 output_temp = translated_file + ".temp.docx"
                 
-                with zipfile.ZipFile(output_temp, 'w', zipfile.ZIP_DEFLATED) as zip_out:
-                    for root, _, files in os.walk(translated_dir):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            arcname = os.path.relpath(file_path, translated_dir)
-                            zip_out.write(file_path, arcname)
+                with zipfile.ZipFile(input_file, 'r') as original_zip, \
+                     zipfile.ZipFile(translated_file, 'r') as translated_zip:
+                    self._extract_parts(original_zip, xml_parts, original_dir)
+                    self._extract_parts(translated_zip, xml_parts, translated_dir)
+                    
+                    # Replace the media folder with the original one
+                    original_media = [name for name in original_zip.namelist() if name.startswith('word/media/')]
+                    raw_sources = {name: original_zip for name in original_media}
+                    modified_parts = {}
+                    if original_media:
+                        for name in translated_zip.namelist():
+                            if name.startswith('word/media/') and name not in raw_sources:
+                                modified_parts[name] = None
+                    
+                    # Process relationships and content types
+                    self._process_document_relationships(original_dir, translated_dir)
+                    self._process_document_content_types(original_dir, translated_dir)
+                    
+                    # Process document structure to place images
+                    self._process_document_structure(original_dir, translated_dir)
+                    
+                    # Repackage document
+                    modified_parts.update(self._read_modified_parts(translated_zip, translated_dir, xml_parts))
+                    self._repackage(translated_zip, output_temp, modified_parts, raw_sources)
                 
                 # Replace original output
                 if os.path.exists(translated_file):
@@ -778,6 +2440,70 @@ class DocumentProcessor:
         except Exception:
             pass
     
+    def _extract_parts(self, zip_ref, names, dest_dir):
+        """Extract only the named members (skips media and untouched parts)"""
+        existing = set(zip_ref.namelist())
+        for name in names:
+            if name in existing:
+                zip_ref.extract(name, dest_dir)
+    
+    def _read_modified_parts(self, source_zip, temp_dir, names):
+        """Return {name: bytes} for extracted parts whose content differs from the source package"""
+        modified = {}
+        existing = set(source_zip.namelist())
+        for name in names:
+            path = os.path.join(temp_dir, name)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            if name not in existing or source_zip.read(name) != data:
+                modified[name] = data
+        return modified
+    
+    def _repackage(self, source_zip, output_file, modified_parts, raw_sources=None):
+        """Write source_zip to output_file, replacing modified parts and copying the rest as raw bytes"""
+        raw_sources = raw_sources or {}
+        existing = set(source_zip.namelist())
+        try:
+            writer = PackageWriter(output_file)
+            for info in source_zip.infolist():
+                name = info.filename
+                if name in modified_parts:
+                    if modified_parts[name] is not None:
+                        writer.add(name, modified_parts[name], info.date_time, info.external_attr)
+                elif name in raw_sources:
+                    writer.copy_raw(raw_sources[name], raw_sources[name].getinfo(name))
+                else:
+                    writer.copy_raw(source_zip, info)
+            
+            for name, data in modified_parts.items():
+                if name not in existing and data is not None:
+                    writer.add(name, data)
+            for name, other_zip in raw_sources.items():
+                if name not in existing and name not in modified_parts:
+                    writer.copy_raw(other_zip, other_zip.getinfo(name))
+            
+            writer.close()
+        except zipfile.LargeZipFile:
+            # Fall back to zipfile (with ZIP64) for very large packages
+            with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zip_out:
+                for info in source_zip.infolist():
+                    name = info.filename
+                    if name in modified_parts:
+                        if modified_parts[name] is not None:
+                            zip_out.writestr(info, modified_parts[name])
+                    elif name in raw_sources:
+                        zip_out.writestr(info, raw_sources[name].read(name))
+                    else:
+                        zip_out.writestr(info, source_zip.read(name))
+                for name, data in modified_parts.items():
+                    if name not in existing and data is not None:
+                        zip_out.writestr(name, data)
+                for name, other_zip in raw_sources.items():
+                    if name not in existing and name not in modified_parts:
+                        zip_out.writestr(name, other_zip.read(name))
+    
     def _process_document_relationships(self, original_dir, translated_dir):
         """Process document relationships to maintain image references"""
         original_rels_file = os.path.join(original_dir, "word", "_rels", "document.xml.rels")
@@ -946,88 +2672,294 @@ class DocumentProcessor:
         except Exception:
             pass
 
+class XlsxProcessor(DocumentProcessor):
+    """Workbook counterpart of DocumentProcessor: each xl/sharedStrings.xml entry is one segment"""
+    S_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    
+    def __init__(self, translator):
+        super().__init__(translator)
+        self.batch_kinds = ('shared_string',)  # Cell strings are short: send them as numbered batches
+    
+    def shared_strings_part(self, zip_ref):
+        """Name of the shared strings part, found through the workbook relationships; None if absent"""
+        existing = set(zip_ref.namelist())
+        rels_name = 'xl/_rels/workbook.xml.rels'
+        if rels_name in existing:
+            ns = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+            for rel in etree.fromstring(zip_ref.read(rels_name)).iter(ns + 'Relationship'):
+                if rel.get('Type', '').endswith('/sharedStrings'):
+                    target = rel.get('Target', '')
+                    name = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+                    if name in existing:
+                        return name
+        return 'xl/sharedStrings.xml' if 'xl/sharedStrings.xml' in existing else None
+    
+    def scan_package(self, doc_path):
+        """Feature index of a workbook: shared strings, their characters and the embedded images"""
+        stat = os.stat(doc_path)
+        cache_key = (os.path.abspath(doc_path), stat.st_mtime_ns, stat.st_size)
+        if cache_key in self._feature_cache:
+            return self._feature_cache[cache_key]
+        
+        features = {'parts': {}, 'shared_strings': 0, 'images': 0, 'image_bytes': 0, 'text_chars': 0}
+        with zipfile.ZipFile(doc_path, 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                if info.filename.startswith('xl/media/'):
+                    features['images'] += 1
+                    features['image_bytes'] += info.file_size
+            part = self.shared_strings_part(zip_ref)
+            if part:
+                with zip_ref.open(part) as stream:
+                    for _, si in etree.iterparse(stream, events=('end',), tag=f'{{{self.S_NS}}}si'):
+                        features['shared_strings'] += 1
+                        features['text_chars'] += sum(len(t.text or '') for t in self.shared_string_texts(si))
+                        si.clear()
+                features['parts'][part] = {'shared_strings': features['shared_strings'],
+                                           'text_chars': features['text_chars']}
+        
+        self._feature_cache[cache_key] = features
+        return features
+    
+    def shared_string_texts(self, si):
+        """w:t-like text nodes of one shared string: plain <t> or the <t> of each rich-text run, no phonetics"""
+        s = f'{{{self.S_NS}}}'
+        return [t for t in si.iter(s + 't') if t.getparent().tag != s + 'rPh']
+    
+    def build_workbook_plan(self, zip_ref, part):
+        """Stream the shared strings into a TranslationPlan without keeping the parsed part"""
+        plan = TranslationPlan()
+        with zip_ref.open(part) as stream:
+            for index, (_, si) in enumerate(etree.iterparse(stream, events=('end',), tag=f'{{{self.S_NS}}}si')):
+                text = ''.join(t.text or '' for t in self.shared_string_texts(si))
+                if text.strip():
+                    plan.add(('shared_string', index), text, self.translator.memory_key(text))
+                si.clear()
+                while si.getprevious() is not None:
+                    del si.getparent()[0]
+        return plan
+    
+    def apply_shared_string(self, si, text, translation):
+        """Write a translation into a shared string; rich text is spread over its runs in proportion"""
+        nodes = self.shared_string_texts(si)
+        if not nodes:
+            return False
+        leading = text[:len(text) - len(text.lstrip())]
+        trailing = text[len(text.rstrip()):]
+        pieces = self.split_proportionally(leading + translation.strip() + trailing,
+                                           [len(t.text or '') for t in nodes])
+        for t, piece in zip(nodes, pieces):
+            if piece or t.getparent() is si:
+                t.text = piece
+                t.set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+            else:
+                # A rich-text run left without text is dropped with its formatting
+                si.remove(t.getparent())
+        return True
+    
+    def translate_shared_strings(self, zip_ref, part, language_code):
+        """Return (new part bytes, strings translated) using the translations in memory"""
+        s = f'{{{self.S_NS}}}'
+        tree = etree.parse(zip_ref.open(part))
+        translated = 0
+        for si in tree.getroot().iter(s + 'si'):
+            text = ''.join(t.text or '' for t in self.shared_string_texts(si))
+            if not text.strip():
+                continue
+            # Write-back: translate_plan already counted this text's memory lookup
+            translation = self.translator.lookup_memory(text, language_code, record=False)
+            if translation and translation.strip() != text.strip():
+                if self.apply_shared_string(si, text, translation):
+                    translated += 1
+        return etree.tostring(tree, encoding='UTF-8', xml_declaration=True, standalone=True), translated
+
 class DocumentTranslator:
-    def __init__(self):
-        self.translator = TranslationManager()
+    def __init__(self, memory_store=None, rate_limiter=None):
+        self.translator = TranslationManager(memory_store, rate_limiter)
         self.processor = DocumentProcessor(self.translator)
+        self.workbook_processor = XlsxProcessor(self.translator)
+        self.shard_workers = None  # Worker processes for the body of very large documents
+        self.export_metrics = False  # Write <name>.metrics.json / .prom next to the outputs
+        self.metrics_total = TranslationMetrics()  # All jobs run by this translator
     
-    def translate_document(self, input_file, output_dir, google_sheet_url=None):
-        """Translate document to all target languages"""
+    def load_terminology(self, google_sheet_url):
+        """Load terminology for all target languages"""
+        print("Loading terminology...")
+        for language_name, language_code in LANGUAGES.items():
+            self.translator.load_terminology(
+                google_sheet_url,
+                "English",
+                language_name,
+                language_code
+            )
+        print("Terminology loaded.")
+    
+    def translate_document(self, input_file, output_dir, google_sheet_url=None, resume=False,
+                           previous_source=None, previous_output_dir=None, languages=None):
+        """Translate document to all target languages and return the output files (resume=True replays the segment journal)
+        
+        With previous_source, translations of unchanged paragraphs are carried over from the
+        previous outputs in previous_output_dir and only inserted or modified text is sent to the API.
+        languages restricts the run to a subset of LANGUAGES. .xlsx workbooks go to translate_workbook.
+        """
+        if input_file.lower().endswith('.xlsx'):
+            if previous_source:
+                print("⚠ Incremental mode is not supported for workbooks; translating in full")
+            return self.translate_workbook(input_file, output_dir, google_sheet_url, resume, languages)
+        return self.run_journaled(input_file, output_dir, resume, languages, lambda: self._translate_document(
+            input_file, output_dir, google_sheet_url, resume, previous_source, previous_output_dir, languages))
+        
+    def run_journaled(self, input_file, output_dir, resume, languages, run):
+        """Call run() with a segment journal attached, so an interrupted run can resume
+        
+        The journal is deleted once every language produced an output, and kept otherwise.
+        """
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        # Keyed by the absolute input path too: a recursive batch may hold a/report.docx and b/report.docx
+        path_key = hashlib.sha1(os.path.abspath(input_file).encode('utf-8')).hexdigest()[:10]
+        journal = TranslationJournal(os.path.join(output_dir, f"{base_name}.{path_key}.journal.jsonl"))
+        doc_hash = journal.document_hash(input_file)
+        journal.open(resume)
+        self.translator.journal, self.translator.journal_doc_hash = journal, doc_hash
+        outputs = []
+        try:
+            outputs = run()
+        finally:
+            journal.close(remove=len(outputs) == len(languages or LANGUAGES))
+            self.translator.journal = None
+        return outputs
+    
+    def _translate_document(self, input_file, output_dir, google_sheet_url, resume, previous_source,
+                            previous_output_dir, languages):
         print("Starting document translation...")
+        metrics = self.translator.metrics = TranslationMetrics()
         
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
         
         # Load terminology if provided
         if google_sheet_url:
-            print("Loading terminology...")
-            for language_name, language_code in LANGUAGES.items():
-                self.translator.load_terminology(
-                    google_sheet_url, 
-                    "English",
-                    language_name,
-                    language_code
-                )
-            print("Terminology loaded.")
+            self.load_terminology(google_sheet_url)
+        
+        # Index the package once; the stages below are skipped when it shows nothing to do
+        features = self.processor.scan_package(input_file)
+        has_tables = features['parts'].get('word/document.xml', {}).get('tables', 0) > 0
+        has_headers = bool(features['headers'] or features['footers'])
+        has_footnotes = self.processor.has_footnotes(input_file)
+        print(f"Document features: {self.processor.describe_features(features)}")
+        
+        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        journal, doc_hash = self.translator.journal, self.translator.journal_doc_hash
+        
+        # Incremental mode: diff against the previous revision of the source
+        if previous_source:
+            previous_base = os.path.splitext(os.path.basename(previous_source))[0]
+            previous_output_dir = previous_output_dir or output_dir
+            report = self.processor.diff_revisions(previous_source, input_file)
+            report_path = os.path.join(output_dir, f"{base_name}.changes.txt")
+            self.processor.write_change_report(report, report_path)
+            print(f"Revision changes: {report['unchanged']} unchanged, {report['modified']} modified, "
+                  f"{report['inserted']} inserted, {report['deleted']} deleted → {report_path}")
         
         # Process each target language
-        for language_name, language_code in LANGUAGES.items():
+        outputs = []
+        for language_name, language_code in (languages or LANGUAGES).items():
             try:
-                print(f"\n=== Translating to {language_name} ===")
+                progress = self.translator.progress
+                progress.stage('language', f"\n=== Translating to {language_name} ===", language=language_name)
                 self.translator.clear_memory()
+                self.processor.run_stats = {'before': 0, 'after': 0}
+                
+                if resume:
+                    replayed = journal.load(doc_hash, language_code)
+                    self.translator.translation_memory.update(replayed)
+                    print(f"Resumed {len(replayed)} segments from journal.")
+                
+                if previous_source:
+                    previous_output = os.path.join(previous_output_dir, f"{previous_base}_{language_code}.docx")
+                    if os.path.exists(previous_output):
+                        carry_over = self.processor.build_carry_over(previous_source, previous_output, report)
+                        self.translator.translation_memory.update(carry_over)
+                        print(f"Carried over {len(carry_over)} translations from {previous_output}")
+                    else:
+                        print(f"⚠ No previous output {previous_output}, translating in full")
                 
                 # Prepare output file
                 base_name = os.path.splitext(os.path.basename(input_file))[0]
                 output_file = os.path.join(output_dir, f"{base_name}_{language_code}.docx")
                 
                 # Step 1: Load and translate main content
-                print("Translating main content...")
+                progress.stage('body', "Translating main content...")
+                metrics.mark()
                 doc = docx.Document(input_file)
                 
+                # Extract every segment and translate each unique text once
+                plan = self.processor.build_plan(doc, input_file, include_notes=has_footnotes,
+                                                 include_headers=has_headers)
+                print(f"Translation plan: {plan.summary()}")
+                metrics.lap('parse')
+                translated = self.processor.translate_plan(plan, language_name, language_code)
+                skip_counts = self.processor.skip_counts
+                if skip_counts:
+                    print(f"Pre-filter: {sum(skip_counts.values())} of {plan.unique_count} unique segments need no "
+                          f"translation ({', '.join(f'{reason} {count}' for reason, count in sorted(skip_counts.items()))})")
+                metrics.lap('translate')
+                if previous_source:
+                    print(f"Translated {translated} new or modified segments.")
+                
                 # Translate main paragraphs
-                paragraph_count = 0
-                for para in doc.paragraphs:
-                    if para.text.strip():
-                        self.processor.process_paragraph(para, language_name, language_code)
-                        paragraph_count += 1
-                print(f"Main content completed: {paragraph_count} paragraphs translated.")
+                if self.shard_workers:
+                    # Paragraphs and tables of the body are rebuilt in shards on worker processes
+                    paragraph_count, table_count = self.processor.process_body_sharded(
+                        doc, language_name, language_code, self.shard_workers)
+                    print(f"Main content completed: {paragraph_count} paragraphs and {table_count} tables translated "
+                          f"({self.shard_workers} shard workers).")
+                else:
+                    paragraph_count = 0
+                    for para in doc.paragraphs:
+                        if para.text.strip():
+                            self.processor.process_paragraph(para, language_name, language_code)
+                            paragraph_count += 1
+                    print(f"Main content completed: {paragraph_count} paragraphs translated.")
+                metrics.lap('body')
                 
                 # Translate tables
-                if self.processor.has_tables(doc):
-                    print("Translating tables...")
+                if has_tables and not self.shard_workers:
+                    progress.stage('tables', "Translating tables...")
                     table_count = 0
                     for table in doc.tables:
                         self.processor.process_table(table, language_name, language_code)
                         table_count += 1
                     print(f"Tables completed: {table_count} tables translated.")
+                    metrics.lap('tables')
                 
                 # Translate headers and footers
-                print("Translating headers and footers...")
-                for section in doc.sections:
-                    for para in section.header.paragraphs:
-                        if para.text.strip():
-                            self.processor.process_paragraph(para, language_name, language_code)
-                    
-                    for table in section.header.tables:
-                        self.processor.process_table(table, language_name, language_code)
-                    
-                    for para in section.footer.paragraphs:
+                if has_headers:
+                    progress.stage('headers_footers', "Translating headers and footers...")
+                    for _, para in self.processor.iter_header_footer_paragraphs(doc):
                         if para.text.strip():
-                            self.processor.process_paragraph(para, language_name, language_code)
-                    
-                    for table in section.footer.tables:
-                        self.processor.process_table(table, language_name, language_code)
-                print("Headers and footers completed.")
+                            try:
+                                self.processor.process_paragraph(para, language_name, language_code)
+                            except Exception:
+                                pass
+                    print("Headers and footers completed.")
+                    metrics.lap('headers_footers')
+                
+                run_stats = self.processor.run_stats
+                if run_stats['before']:
+                    print(f"Run coalescing: {run_stats['before']} runs → {run_stats['after']} runs")
                 
                 # Save intermediate document
                 intermediate_file = output_file.replace('.docx', '_temp.docx')
                 doc.save(intermediate_file)
+                metrics.lap('save')
                 
                 current_file = intermediate_file
                 
                 # Process footnotes
-                if self.processor.has_footnotes(input_file):
-                    print("Translating footnotes...")
+                if has_footnotes:
+                    progress.stage('footnotes', "Translating footnotes...")
                     footnote_file = current_file.replace('.docx', '_footnotes.docx')
                     footnote_success = self.processor.process_footnotes_with_merge(
                         input_file, current_file, footnote_file, language_name, language_code
@@ -1037,15 +2969,18 @@ class DocumentTranslator:
                         print("Footnotes completed.")
                     else:
                         print("No footnotes to translate.")
+                    metrics.lap('footnotes')
                 
                 # Copy current file to final output
                 if current_file != output_file:
                     shutil.copy2(current_file, output_file)
                 
                 # Preserve images
-                print("Processing images...")
-                self.processor.preserve_images(input_file, output_file)
-                print("Images processed.")
+                if features['images']:
+                    progress.stage('images', "Processing images...")
+                    self.processor.preserve_images(input_file, output_file)
+                    print("Images processed.")
+                    metrics.lap('images')
                 
                 # Clean up intermediate files
                 cleanup_files = [intermediate_file]
@@ -1058,17 +2993,621 @@ class DocumentTranslator:
                             os.remove(cleanup_file)
                         except Exception:
                             pass
+                metrics.lap('save')
                 
                 # Show translation statistics
                 success_rate = (self.translator.total_successes / self.translator.total_attempts * 100) if self.translator.total_attempts > 0 else 0
                 print(f"Network stats: {self.translator.total_successes}/{self.translator.total_attempts} successful ({success_rate:.1f}%)")
                 print(f"✓ {language_name} translation completed: {output_file}")
+                outputs.append(output_file)
+                
+            except Exception as e:
+                print(f"✗ Error translating to {language_name}: {e}")
+        
+        self.finish_metrics(metrics, output_dir, base_name)
+        
+        print("\n=== All translations completed ===")
+        print(f"Output directory: {output_dir}")
+        return outputs
+    
+    def translate_workbook(self, input_file, output_dir, google_sheet_url=None, resume=False, languages=None):
+        """Translate the shared strings of an .xlsx workbook to all target languages and return the output files
+        
+        Only xl/sharedStrings.xml is rewritten; every other member is copied as raw bytes.
+        """
+        return self.run_journaled(input_file, output_dir, resume, languages, lambda: self._translate_workbook(
+            input_file, output_dir, google_sheet_url, resume, languages))
+    
+    def _translate_workbook(self, input_file, output_dir, google_sheet_url, resume, languages):
+        print("Starting workbook translation...")
+        metrics = self.translator.metrics = TranslationMetrics()
+        processor = self.workbook_processor
+        processor.segment_workers = self.processor.segment_workers
+        
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        
+        if google_sheet_url:
+            self.load_terminology(google_sheet_url)
+        
+        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        journal, doc_hash = self.translator.journal, self.translator.journal_doc_hash
+        
+        with zipfile.ZipFile(input_file, 'r') as source_zip:
+            part = processor.shared_strings_part(source_zip)
+            plan = processor.build_workbook_plan(source_zip, part) if part else TranslationPlan()
+        if part is None:
+            print("⚠ Workbook has no shared strings; outputs are copies of the input.")
+        print(f"Translation plan: {plan.summary()}")
+        metrics.lap('parse')
+        
+        outputs = []
+        for language_name, language_code in (languages or LANGUAGES).items():
+            try:
+                progress = self.translator.progress
+                progress.stage('language', f"\n=== Translating to {language_name} ===", language=language_name)
+                self.translator.clear_memory()
                 
+                if resume:
+                    replayed = journal.load(doc_hash, language_code)
+                    self.translator.translation_memory.update(replayed)
+                    print(f"Resumed {len(replayed)} segments from journal.")
+                
+                output_file = os.path.join(output_dir, f"{base_name}_{language_code}.xlsx")
+                progress.stage('shared_strings', "Translating shared strings...")
+                processor.translate_plan(plan, language_name, language_code)
+                skip_counts = processor.skip_counts
+                if skip_counts:
+                    print(f"Pre-filter: {sum(skip_counts.values())} of {plan.unique_count} unique segments need no "
+                          f"translation ({', '.join(f'{reason} {count}' for reason, count in sorted(skip_counts.items()))})")
+                metrics.lap('translate')
+                
+                with zipfile.ZipFile(input_file, 'r') as source_zip:
+                    modified_parts = {}
+                    if part:
+                        modified_parts[part], translated = processor.translate_shared_strings(
+                            source_zip, part, language_code)
+                        print(f"Shared strings completed: {translated} of {plan.unique_count} strings translated.")
+                    processor._repackage(source_zip, output_file, modified_parts)
+                metrics.lap('save')
+                
+                success_rate = (self.translator.total_successes / self.translator.total_attempts * 100) if self.translator.total_attempts > 0 else 0
+                print(f"Network stats: {self.translator.total_successes}/{self.translator.total_attempts} successful ({success_rate:.1f}%)")
+                print(f"✓ {language_name} translation completed: {output_file}")
+                outputs.append(output_file)
+            
             except Exception as e:
                 print(f"✗ Error translating to {language_name}: {e}")
         
+        self.finish_metrics(metrics, output_dir, base_name)
+        
         print("\n=== All translations completed ===")
         print(f"Output directory: {output_dir}")
+        return outputs
+    
+    def finish_metrics(self, metrics, output_dir, base_name):
+        """Add a job's metrics to the running total, print them and export them if asked"""
+        self.metrics_total.merge(metrics)
+        print(f"Metrics: {metrics.summary()}")
+        if self.export_metrics:
+            with open(os.path.join(output_dir, f"{base_name}.metrics.json"), 'w', encoding='utf-8') as f:
+                json.dump(metrics.to_dict(), f, indent=2)
+            with open(os.path.join(output_dir, f"{base_name}.metrics.prom"), 'w', encoding='utf-8') as f:
+                f.write(metrics.to_prometheus())
+        
+    def plan_document(self, input_file):
+        """Estimate API requests, tokens and memory hits for a document, offline"""
+        processor = self.processor
+        if input_file.lower().endswith('.xlsx'):
+            processor = self.workbook_processor
+            with zipfile.ZipFile(input_file, 'r') as source_zip:
+                part = processor.shared_strings_part(source_zip)
+                plan = processor.build_workbook_plan(source_zip, part) if part else TranslationPlan()
+        else:
+            features = processor.scan_package(input_file)
+            has_headers = bool(features['headers'] or features['footers'])
+            has_footnotes = processor.has_footnotes(input_file)
+            print(f"Document features: {processor.describe_features(features)}")
+            if features['text_boxes']:
+                print(f"⚠ {features['text_boxes']} text boxes are not translated by this script and not estimated")
+        
+            doc = docx.Document(input_file)
+            plan = processor.build_plan(doc, input_file, include_notes=has_footnotes, include_headers=has_headers)
+        print(f"Translation plan: {plan.summary()}")
+        
+        totals = {'requests': 0, 'memory_hits': 0, 'skipped': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        for language_name, language_code in LANGUAGES.items():
+            self.translator.clear_memory()
+            estimate = processor.estimate_plan(plan, language_name, language_code)
+            print(f"  {language_name}: {estimate['requests']} requests, {estimate['memory_hits']} memory hits, "
+                  f"{estimate['skipped']} skipped, ~{estimate['prompt_tokens']} prompt + "
+                  f"~{estimate['completion_tokens']} completion tokens")
+            for name in totals:
+                totals[name] += estimate[name]
+        self.translator.clear_memory()
+        return totals
+
+def configure_progress(progress, verbose=False, events_path=None):
+    """Attach the console and/or JSON-lines consumers to a ProgressReporter"""
+    progress.subscribers = []
+    if events_path:
+        progress.subscribe(JsonLinesProgress(events_path), 'debug' if verbose else 'info')
+    if events_path == '-':
+        # stdout carries only the event stream; console output and plain prints move to stderr
+        sys.stdout = sys.stderr
+    progress.subscribe(ConsoleProgress(verbose), 'debug' if verbose else 'info')
+
+def print_plan_totals(totals, concurrency, min_interval, latency):
+    """Print the summary of a dry-run plan, with hit rate and expected wall time"""
+    lookups = totals['requests'] + totals['memory_hits']
+    totals['memory_hit_rate'] = totals['memory_hits'] / lookups if lookups else 0.0
+    # Requests run `concurrency` at a time, but never faster than the rate limit allows
+    totals['wall_seconds'] = max(totals['requests'] * latency / max(concurrency, 1),
+                                 totals['requests'] * min_interval)
+    
+    print("\n=== Plan (no API calls made) ===")
+    print(f"API requests: {totals['requests']}")
+    print(f"Prompt tokens: ~{totals['prompt_tokens']}  Completion tokens: ~{totals['completion_tokens']}")
+    print(f"Memory hit rate: {totals['memory_hit_rate']:.1%}  Skipped (no translation needed): {totals['skipped']}")
+    print(f"Expected wall time: {totals['wall_seconds'] / 60:.1f} min "
+          f"(concurrency {concurrency}, {min_interval}s min interval, {latency}s per request)")
+
+def benchmark_run_formatting(input_file, rounds=3):
+    """Microbenchmark: python-docx property round-trip vs raw w:rPr cloning for every run"""
+    doc = docx.Document(input_file)
+    runs = [run for para in doc.paragraphs for run in para.runs]
+    for table in doc.tables:
+        for row in table.rows:
+            for cell in row.cells:
+                for para in cell.paragraphs:
+                    runs.extend(para.runs)
+    
+    if not runs:
+        print("No runs found, nothing to benchmark.")
+        return {}
+    
+    processor = DocumentProcessor(TranslationManager())
+    scratch = doc.add_paragraph()
+    strategies = [
+        ("properties", processor.capture_run_properties, processor.apply_run_properties),
+        ("raw rPr", processor.capture_run_rpr, processor.apply_run_rpr),
+    ]
+    
+    results = {}
+    for name, capture, apply in strategies:
+        best = None
+        for _ in range(rounds):
+            scratch.clear()
+            start = time.perf_counter()
+            for run in runs:
+                formatting = capture(run)
+                apply(scratch.add_run(run.text), formatting)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+        print(f"{name:>10}: {best:.3f}s for {len(runs)} runs ({best / len(runs) * 1e6:.1f} µs/run)")
+    
+    if results["raw rPr"] > 0:
+        print(f"Speedup: {results['properties'] / results['raw rPr']:.1f}x")
+    return results
+
+# Per-process translator for batch workers (set by _init_batch_worker)
+_batch_translator = None
+
+def _process_body_shard(blocks_xml, target_language, language_code, translation_memory, terminology_db, options):
+    """Worker process: rebuild one shard of body blocks from translation memory and return the new XML
+    
+    The shard makes no API calls: texts missing from memory are returned so the parent can translate them.
+    """
+    processor = DocumentProcessor(TranslationManager())
+    processor.clone_run_xml, processor.coalesce_adjacent_runs = options
+    processor.translator.translation_memory = dict(translation_memory)
+    processor.translator.terminology_db = terminology_db
+    processor.translator.interactive = False
+    processor.translator.offline = True
+    
+    blocks = [parse_xml(xml) for xml in blocks_xml]
+    counts = processor.process_blocks(blocks, target_language, language_code)
+    return ([etree.tostring(block) for block in blocks], counts, processor.run_stats,
+            processor.translator.offline_misses, processor.translator.metrics)
+
+def collect_input_files(input_path):
+    """Resolve a file, directory or glob pattern to the list of .docx and .xlsx files to translate"""
+    if os.path.isdir(input_path):
+        candidates = glob.glob(os.path.join(input_path, '*.docx')) + glob.glob(os.path.join(input_path, '*.xlsx'))
+    elif glob.has_magic(input_path):
+        candidates = glob.glob(input_path, recursive=True)
+    else:
+        candidates = [input_path]
+    # Skip Office lock files such as ~$report.docx
+    return sorted(path for path in candidates
+                  if path.lower().endswith(('.docx', '.xlsx')) and not os.path.basename(path).startswith('~$'))
+
+def _init_batch_worker(memory_db, rate_lock, last_call, min_interval, google_sheet_url, verbose=False,
+                       events_path=None):
+    """Create one warm DocumentTranslator per worker process"""
+    global _batch_translator
+    memory_store = SharedTranslationMemory(memory_db)
+    rate_limiter = RateLimiter(min_interval, rate_lock, last_call)
+    _batch_translator = DocumentTranslator(memory_store, rate_limiter)
+    _batch_translator.translator.interactive = False  # Workers cannot prompt
+    configure_progress(_batch_translator.translator.progress, verbose, events_path)
+    if google_sheet_url:
+        _batch_translator.load_terminology(google_sheet_url)
+
+def _translate_batch_document(input_file, output_dir, resume=False, export_metrics=False):
+    """Translate one document inside a batch worker and return its throughput figures"""
+    start_time = time.time()
+    _batch_translator.export_metrics = export_metrics
+    try:
+        processor = _batch_translator.processor
+        if input_file.lower().endswith('.xlsx'):
+            processor = _batch_translator.workbook_processor
+        characters = processor.scan_package(input_file)['text_chars']
+        _batch_translator.translate_document(input_file, output_dir, resume=resume)
+        success = True
+    except Exception as e:
+        print(f"✗ Error translating {input_file}: {e}")
+        characters, success = 0, False
+    return {
+        'file': input_file,
+        'success': success,
+        'seconds': time.time() - start_time,
+        'characters': characters,
+    }
+
+def translate_directory(input_path, output_dir, google_sheet_url=None, workers=None, memory_db=None,
+                        min_interval=1.0, resume=False, export_metrics=False, verbose=False, events_path=None):
+    """Translate many documents on a process pool sharing one memory store and one API rate limit"""
+    input_files = collect_input_files(input_path)
+    if not input_files:
+        print(f"✗ No .docx or .xlsx files found for: {input_path}")
+        return []
+    
+    os.makedirs(output_dir, exist_ok=True)
+    memory_db = memory_db or os.path.join(output_dir, 'translation_memory.sqlite3')
+    SharedTranslationMemory(memory_db)  # Create the schema before workers start
+    workers = workers or os.cpu_count() or 1
+    
+    print(f"Batch: {len(input_files)} documents, {workers} workers, memory store {memory_db}")
+    
+    results = []
+    batch_start = time.time()
+    with multiprocessing.Manager() as manager:
+        rate_lock = manager.Lock()
+        last_call = manager.Value('d', 0.0)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(memory_db, rate_lock, last_call, min_interval, google_sheet_url,
+                                           verbose, events_path)) as pool:
+            futures = [pool.submit(_translate_batch_document, input_file, output_dir, resume, export_metrics)
+                       for input_file in input_files]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                rate = result['characters'] / result['seconds'] if result['seconds'] > 0 else 0
+                status = "✓" if result['success'] else "✗"
+                print(f"{status} [{len(results)}/{len(input_files)}] {os.path.basename(result['file'])}: "
+                      f"{result['seconds']:.1f}s, {result['characters']:,} chars, {rate:,.0f} chars/s")
+    
+    elapsed = time.time() - batch_start
+    total_characters = sum(result['characters'] for result in results)
+    succeeded = sum(1 for result in results if result['success'])
+    print("=" * 50)
+    print(f"Batch completed: {succeeded}/{len(results)} documents in {elapsed:.1f}s")
+    if elapsed > 0:
+        print(f"Throughput: {len(results) / elapsed * 60:.1f} documents/min, "
+              f"{total_characters / elapsed:,.0f} chars/s ({total_characters:,} chars)")
+    return results
+
+def run_job_worker(job_store_path, google_sheet_url=None, worker_id=None, lease_seconds=300, min_interval=1.0,
+                   poll_interval=5.0, exit_when_idle=True, verbose=False, events_path=None):
+    """Claim document x language jobs from a shared JobStore until none are left"""
+    store = JobStore(job_store_path)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    translator = DocumentTranslator(rate_limiter=StoreRateLimiter(store, min_interval))
+    translator.translator.interactive = False
+    configure_progress(translator.translator.progress, verbose, events_path)
+    if google_sheet_url:
+        translator.load_terminology(google_sheet_url)
+    
+    print(f"Worker {worker_id} using job store {job_store_path}")
+    processed = 0
+    while True:
+        job = store.claim(worker_id, lease_seconds)
+        if job is None:
+            counts = store.counts()
+            if exit_when_idle and not counts.get('pending') and not counts.get('running'):
+                break
+            time.sleep(poll_interval)
+            continue
+        
+        print(f"→ Job {job['id']}: {os.path.basename(job['document'])} → {job['language_name']} "
+              f"(attempt {job['attempts']})")
+        # Keep the lease alive while translating
+        done = threading.Event()
+        def keep_alive():
+            while not done.wait(lease_seconds / 3):
+                if not store.heartbeat(job['id'], worker_id, lease_seconds):
+                    print(f"⚠ Lease on job {job['id']} lost; its result will be discarded")
+                    return
+        heartbeat_thread = threading.Thread(target=keep_alive, daemon=True)
+        heartbeat_thread.start()
+        
+        # Stage outputs per attempt; only the lease holder publishes them
+        staging_dir = os.path.join(job['output_dir'], '.staging', f"{job['id']}-{job['attempts']}-{worker_id}")
+        try:
+            outputs = translator.translate_document(job['document'], staging_dir,
+                                                    languages={job['language_name']: job['language_code']})
+            if not outputs:
+                raise RuntimeError("no output produced")
+            if store.complete(job['id'], worker_id, outputs):
+                print(f"✓ Job {job['id']} done")
+                processed += 1
+        except Exception as e:
+            print(f"✗ Job {job['id']} failed: {e}")
+            store.fail(job['id'], worker_id, e)
+        finally:
+            done.set()
+            heartbeat_thread.join()
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(staging_dir))  # Only succeeds once no other attempt is staged
+            except OSError:
+                pass
+    
+    print(f"Worker {worker_id} finished: {processed} jobs, store status {store.counts()}")
+    return processed
+
+class TranslationDaemon:
+    """Long-running translator: warm glossary, memory and connections; jobs from HTTP or a drop folder"""
+    def __init__(self, output_dir, google_sheet_url=None, workers=2, memory_db=None, min_interval=1.0,
+                 drop_folder=None, poll_interval=2.0, allowed_roots=None, max_jobs=1000):
+        self.output_dir = output_dir
+        self.drop_folder = drop_folder
+        self.poll_interval = poll_interval
+        if drop_folder and self.is_inside(output_dir, drop_folder):
+            # Finished outputs would be picked up from the drop folder and translated again, forever
+            raise ValueError(f"output directory {output_dir} must not be inside the drop folder {drop_folder}")
+        # HTTP clients may only read inputs from and write outputs under these directories
+        self.allowed_roots = [os.path.realpath(root) for root in
+                              (allowed_roots or [output_dir] + ([drop_folder] if drop_folder else []))]
+        self.max_jobs = max_jobs  # Finished jobs beyond this are forgotten, oldest first
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.stopping = threading.Event()
+        os.makedirs(output_dir, exist_ok=True)
+        self.spool_dir = os.path.join(output_dir, 'uploads')
+        
+        # One translator per worker thread; memory store, rate limit and glossary are shared
+        memory_db = memory_db or os.path.join(output_dir, 'translation_memory.sqlite3')
+        memory_store = SharedTranslationMemory(memory_db)
+        rate_limiter = RateLimiter(min_interval)
+        self.translators = [DocumentTranslator(memory_store, rate_limiter) for _ in range(max(workers, 1))]
+        if google_sheet_url:
+            self.translators[0].load_terminology(google_sheet_url)
+        for translator in self.translators:
+            translator.translator.interactive = False
+            translator.translator.terminology_db = self.translators[0].translator.terminology_db
+        self.threads = [threading.Thread(target=self._worker, args=(translator,), daemon=True)
+                        for translator in self.translators]
+    
+    def submit(self, input_file, output_dir=None, source='http'):
+        """Queue a document and return its job record"""
+        job = {
+            'id': uuid.uuid4().hex[:12],
+            'input': os.path.abspath(input_file),
+            'output_dir': os.path.abspath(output_dir or self.output_dir),
+            'source': source,
+            'status': 'queued',
+            'outputs': [],
+            'error': None,
+            'submitted': time.time(),
+            'started': None,
+            'finished': None,
+        }
+        with self.jobs_lock:
+            self.jobs[job['id']] = job
+            self._prune_jobs()
+        self.queue.put(job['id'])
+        print(f"→ Job {job['id']} queued: {job['input']}")
+        return dict(job)
+    
+    def _prune_jobs(self):
+        """Drop the oldest finished jobs once more than max_jobs are kept (call with jobs_lock held)"""
+        finished = [job for job in self.jobs.values() if job['status'] in ('done', 'failed')]
+        for job in sorted(finished, key=lambda job: job['finished'])[:max(len(self.jobs) - self.max_jobs, 0)]:
+            del self.jobs[job['id']]
+    
+    @staticmethod
+    def is_inside(path, root):
+        """True if path is root or lies under it (symlinks resolved)"""
+        path, root = os.path.realpath(path), os.path.realpath(root)
+        return os.path.commonpath([root, path]) == root
+    
+    def is_allowed(self, path):
+        """True if path lies under one of the allowed roots"""
+        return any(self.is_inside(path, root) for root in self.allowed_roots)
+    
+    def get_job(self, job_id):
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+    
+    def list_jobs(self):
+        with self.jobs_lock:
+            return [dict(job) for job in self.jobs.values()]
+    
+    def _update_job(self, job_id, **fields):
+        with self.jobs_lock:
+            self.jobs[job_id].update(fields)
+    
+    def _worker(self, translator):
+        """Run queued jobs on a warm DocumentTranslator"""
+        while not self.stopping.is_set():
+            try:
+                job_id = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            job = self.get_job(job_id)
+            self._update_job(job_id, status='running', started=time.time())
+            # Each job works in its own staging directory, so concurrent jobs on documents with the
+            # same name never share a journal or half-written outputs
+            staging_dir = os.path.join(job['output_dir'], '.staging', job_id)
+            try:
+                outputs = []
+                for staged in translator.translate_document(job['input'], staging_dir):
+                    final_path = os.path.join(job['output_dir'], os.path.basename(staged))
+                    os.replace(staged, final_path)
+                    outputs.append(final_path)
+                self._update_job(job_id, status='done', outputs=outputs, finished=time.time(),
+                                 metrics=translator.translator.metrics.to_dict())
+                print(f"✓ Job {job_id} done in {time.time() - job['submitted']:.1f}s")
+            except Exception as e:
+                self._update_job(job_id, status='failed', error=str(e), finished=time.time())
+                print(f"✗ Job {job_id} failed: {e}")
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                try:
+                    os.rmdir(os.path.dirname(staging_dir))  # Only succeeds once no other job is staged
+                except OSError:
+                    pass
+                self.queue.task_done()
+    
+    def _watch_drop_folder(self):
+        """Submit .docx files that appear in the drop folder once their size stops changing"""
+        seen, sizes = set(), {}
+        while not self.stopping.is_set():
+            for path in collect_input_files(self.drop_folder):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                signature = (path, stat.st_mtime_ns, stat.st_size)
+                if signature in seen:
+                    continue
+                if sizes.get(path) != stat.st_size:
+                    sizes[path] = stat.st_size  # Still being copied, check again next round
+                    continue
+                seen.add(signature)
+                self.submit(path, source='drop_folder')
+            self.stopping.wait(self.poll_interval)
+    
+    def metrics(self):
+        """Metrics of every job run so far, across all workers"""
+        total = TranslationMetrics()
+        for translator in self.translators:
+            total.merge(translator.metrics_total)
+        return total
+    
+    def save_upload(self, filename, data):
+        """Store an uploaded document in the spool directory and return its path"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        filename = os.path.basename(filename or 'document.docx')
+        path = os.path.join(self.spool_dir, f"{uuid.uuid4().hex[:8]}_{filename}")
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+    
+    def serve(self, host='127.0.0.1', port=8765):
+        """Start the workers (and drop-folder watcher) and serve the HTTP API until interrupted"""
+        for thread in self.threads:
+            thread.start()
+        if self.drop_folder:
+            os.makedirs(self.drop_folder, exist_ok=True)
+            threading.Thread(target=self._watch_drop_folder, daemon=True).start()
+            print(f"Watching drop folder: {self.drop_folder}")
+        
+        server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+        server.translation_daemon = self
+        print(f"Translation daemon listening on http://{host}:{server.server_port} ({len(self.threads)} workers)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nShutting down...")
+        finally:
+            self.stopping.set()
+            server.server_close()
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """HTTP job API: POST /jobs, GET /jobs, GET /jobs/<id>, GET /jobs/<id>/files/<name>, GET /metrics"""
+    CONTENT_TYPES = {
+        '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    }
+    
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def do_POST(self):
+        daemon = self.server.translation_daemon
+        if self.path.rstrip('/') != '/jobs':
+            return self._send_json(404, {'error': 'not found'})
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        
+        # JSON {"input": path, "output_dir": ...} for local files, or the raw .docx bytes as the body
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            try:
+                request = json.loads(body or b'{}')
+            except ValueError:
+                return self._send_json(400, {'error': 'invalid JSON'})
+            input_file, output_dir = request.get('input'), request.get('output_dir')
+            if not input_file or not os.path.isfile(input_file):
+                return self._send_json(400, {'error': f'input file not found: {input_file}'})
+            if not daemon.is_allowed(input_file) or (output_dir and not daemon.is_allowed(output_dir)):
+                return self._send_json(403, {'error': 'input and output_dir must be under an allowed root'})
+            if output_dir and daemon.drop_folder and daemon.is_inside(output_dir, daemon.drop_folder):
+                return self._send_json(403, {'error': 'output_dir must not be inside the drop folder'})
+            job = daemon.submit(input_file, output_dir)
+        else:
+            if not body:
+                return self._send_json(400, {'error': 'empty body'})
+            job = daemon.submit(daemon.save_upload(self.headers.get('X-Filename'), body))
+        self._send_json(202, job)
+    
+    def do_GET(self):
+        daemon = self.server.translation_daemon
+        parts = [part for part in self.path.split('?', 1)[0].split('/') if part]
+        if parts == ['metrics']:
+            body = daemon.metrics().to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if parts == ['jobs']:
+            return self._send_json(200, daemon.list_jobs())
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            job = daemon.get_job(parts[1])
+            if job is None:
+                return self._send_json(404, {'error': 'unknown job'})
+            if len(parts) == 2:
+                return self._send_json(200, job)
+            if len(parts) == 4 and parts[2] == 'files':
+                # Only files produced by this job can be downloaded
+                matches = [path for path in job['outputs'] if os.path.basename(path) == parts[3]]
+                if not matches:
+                    return self._send_json(404, {'error': 'no such output'})
+                with open(matches[0], 'rb') as f:
+                    data = f.read()
+                self.send_response(200)
+                self.send_header('Content-Type', self.CONTENT_TYPES.get(os.path.splitext(matches[0])[1].lower(),
+                                                                        'application/octet-stream'))
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+        self._send_json(404, {'error': 'not found'})
+    
+    def log_message(self, format, *args):
+        pass  # Job progress is printed by the workers
 
 def main():
     """Main function"""
@@ -1076,19 +3615,115 @@ def main():
     output_dir = r"C:\\Users\\admin\\Desktop\\Selling points\\G100"
     google_sheet_url = "https://docs.google.com/spreadsheets/d/11B4LNWf27Mt_PvqsyKZYmtxeaLmCBPFSQHiiUyY2IC4/edit?gid=0"
     
+    parser = argparse.ArgumentParser(description="Document Translation Tool")
+    parser.add_argument('input', nargs='?', default=input_file,
+                        help="Input .docx or .xlsx file, or a directory / glob pattern for batch mode")
+    parser.add_argument('--output-dir', default=output_dir)
+    parser.add_argument('--sheet-url', default=google_sheet_url, help="Google Sheets glossary URL")
+    parser.add_argument('--workers', type=int, default=None, help="Batch worker processes (default: CPU count)")
+    parser.add_argument('--memory-db', default=None, help="Shared translation memory (SQLite) for batch mode")
+    parser.add_argument('--min-interval', type=float, default=1.0, help="Minimum seconds between API calls")
+    parser.add_argument('--resume', action='store_true', help="Replay the segment journal of an interrupted run")
+    parser.add_argument('--previous-source', default=None,
+                        help="Previous revision of the source; only changed paragraphs are re-translated")
+    parser.add_argument('--previous-output-dir', default=None,
+                        help="Directory with the previous translated outputs (default: --output-dir)")
+    parser.add_argument('--plan', action='store_true',
+                        help="Estimate requests, tokens and wall time without calling the API")
+    parser.add_argument('--latency', type=float, default=3.0, help="Assumed seconds per API request for --plan")
+    parser.add_argument('--shard-workers', type=int, default=None,
+                        help="Process the body of a very large document in shards on this many processes")
+    parser.add_argument('--metrics', action='store_true',
+                        help="Write <name>.metrics.json and <name>.metrics.prom to the output directory")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="Concurrent API requests per document, longest segments first")
+    parser.add_argument('--hedge', type=float, default=None, metavar='PERCENTILE',
+                        help="Duplicate requests still running at this latency percentile (e.g. 95)")
+    parser.add_argument('--hedge-budget', type=float, default=0.05,
+                        help="Maximum hedge requests per API request (default 0.05)")
+    parser.add_argument('--verbose', action='store_true', help="Print every segment and API request")
+    parser.add_argument('--events', default=None, help="Write progress events as JSON lines to this file ('-' for stdout)")
+    parser.add_argument('--daemon', action='store_true', help="Run as a local HTTP job server")
+    parser.add_argument('--job-store', default=None,
+                        help="Shared SQLite job store (on shared storage) for multi-node runs")
+    parser.add_argument('--enqueue', action='store_true', help="Add input documents x languages to --job-store")
+    parser.add_argument('--worker', action='store_true', help="Claim and run jobs from --job-store")
+    parser.add_argument('--lease', type=float, default=300, help="Job lease in seconds (renewed by heartbeats)")
+    parser.add_argument('--port', type=int, default=8765, help="Daemon HTTP port (binds to 127.0.0.1)")
+    parser.add_argument('--drop-folder', default=None, help="Daemon: translate .docx files dropped into this folder")
+    parser.add_argument('--allowed-root', action='append', default=None,
+                        help="Daemon: directory HTTP jobs may read and write (repeatable; default: "
+                             "--output-dir and --drop-folder)")
+    args = parser.parse_args()
+    input_file, output_dir, google_sheet_url = args.input, args.output_dir, args.sheet_url
+    if args.events == '-':
+        sys.stdout = sys.stderr  # stdout carries only the event stream in every mode
+    
+    if args.job_store and (args.enqueue or args.worker):
+        if args.enqueue:
+            store = JobStore(args.job_store)
+            added = store.enqueue(collect_input_files(input_file), output_dir, LANGUAGES)
+            print(f"Enqueued {added} jobs; store status {store.counts()}")
+        if args.worker:
+            run_job_worker(args.job_store, google_sheet_url, lease_seconds=args.lease, min_interval=args.min_interval,
+                           verbose=args.verbose, events_path=args.events)
+        return
+    
+    if args.daemon:
+        try:
+            daemon = TranslationDaemon(output_dir, google_sheet_url, args.workers or 2, args.memory_db,
+                                       args.min_interval, args.drop_folder, allowed_roots=args.allowed_root)
+        except ValueError as e:
+            print(f"✗ {e}")
+            return
+        for translator in daemon.translators:
+            configure_progress(translator.translator.progress, args.verbose, args.events)
+        daemon.serve(port=args.port)
+        return
+    
     print("Document Translation Tool")
     print("=" * 50)
     print(f"Input file: {input_file}")
     print(f"Output directory: {output_dir}")
     print("=" * 50)
     
+    if args.plan:
+        # Terminology is not loaded: the plan must not touch the network
+        memory_store = SharedTranslationMemory(args.memory_db) if args.memory_db else None
+        translator = DocumentTranslator(memory_store=memory_store)
+        translator.processor.segment_workers = args.concurrency
+        batch = os.path.isdir(input_file) or glob.has_magic(input_file)
+        # Batch runs one document per worker process; a single document runs --concurrency requests at a time
+        concurrency = (args.workers or os.cpu_count() or 1) if batch else max(args.concurrency, 1)
+        totals = None
+        for path in (collect_input_files(input_file) if batch else [input_file]):
+            print(f"\n{os.path.basename(path)}")
+            result = translator.plan_document(path)
+            totals = result if totals is None else {name: totals[name] + result[name] for name in totals}
+        if totals:
+            print_plan_totals(totals, concurrency, args.min_interval, args.latency)
+        return
+    
+    if os.path.isdir(input_file) or glob.has_magic(input_file):
+        translate_directory(input_file, output_dir, google_sheet_url, args.workers, args.memory_db, args.min_interval,
+                        args.resume, args.metrics, args.verbose, args.events)
+        return
+    
     if not os.path.exists(input_file):
         print(f"✗ Error: Input file not found: {input_file}")
         return
     
     try:
-        translator = DocumentTranslator()
-        translator.translate_document(input_file, output_dir, google_sheet_url)
+        translator = DocumentTranslator(rate_limiter=RateLimiter(args.min_interval))
+        translator.shard_workers = args.shard_workers
+        translator.processor.segment_workers = args.concurrency
+        translator.export_metrics = args.metrics
+        if args.hedge:
+            translator.translator.hedge = HedgePolicy(args.hedge, args.hedge_budget)
+        configure_progress(translator.translator.progress, args.verbose, args.events)
+        translator.translate_document(input_file, output_dir, google_sheet_url, resume=args.resume,
+                                      previous_source=args.previous_source,
+                                      previous_output_dir=args.previous_output_dir)
         print("\n🎉 All translations completed successfully!")
     except Exception as e:
         print(f"\n✗ Translation failed: {e}")